@@ -31,6 +31,11 @@ class Connection(models.Model):
     class Meta:
         unique_together = ('sender', 'receiver')
         ordering = ['-created_at']
+        # A user's connections are looked up from either side, by status
+        indexes = [
+            models.Index(fields=['sender', 'status'], name='connection_sender_status_idx'),
+            models.Index(fields=['receiver', 'status'], name='connection_receiver_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender} -> {self.receiver} ({self.status})"
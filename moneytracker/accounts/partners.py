@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from .models import Connection
+
+# =============================
+# Partner graph
+# =============================
+# Each user's accepted partners (ids, newest connection first) and pending
+# request counts, cached per user so partner checks on hot pages (the
+# transactions page's partner link, the partner feed) cost no queries once
+# warm. Every save or delete of a Connection (accounts.signals) invalidates
+# both users' entries once its transaction commits; the timeout only
+# bounds changes that skip signals (queryset update()).
+
+
+def _cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def partner_graph_key(user_id):
+    return f'partner-graph:{user_id}'
+
+
+def _build_partner_graph(user_id):
+    partners, incoming, outgoing = [], 0, 0
+    # One indexed lookup per side (sender, status) / (receiver, status)
+    rows = Connection.objects.filter(
+        Q(sender_id=user_id) | Q(receiver_id=user_id), status__in=['accepted', 'pending']
+    ).values_list('sender_id', 'receiver_id', 'status')
+    for sender_id, receiver_id, status in rows:
+        if status == 'accepted':
+            partners.append(receiver_id if sender_id == user_id else sender_id)
+        elif receiver_id == user_id:
+            incoming += 1
+        else:
+            outgoing += 1
+    return {'partners': partners, 'incoming': incoming, 'outgoing': outgoing}
+
+
+def get_partner_graph(user_id):
+    """
+    {'partners': [partner user ids], 'incoming': pending requests received,
+    'outgoing': pending requests sent} for the user, from the cache.
+    """
+    key = partner_graph_key(user_id)
+    graph = _cache().get(key)
+    if graph is None:
+        graph = _build_partner_graph(user_id)
+        _cache().set(key, graph, getattr(settings, 'PARTNER_GRAPH_CACHE_TIMEOUT', 3600))
+    return graph
+
+
+def get_partner_ids(user):
+    return get_partner_graph(user.id)['partners']
+
+
+def has_partner(user):
+    return bool(get_partner_graph(user.id)['partners'])
+
+
+def invalidate_partner_graph(*user_ids):
+    """
+    Drops the users' cached graphs now and again once the current
+    transaction commits, so a graph rebuilt from the old rows in between
+    does not survive.
+    """
+    keys = [partner_graph_key(user_id) for user_id in user_ids]
+    _cache().delete_many(keys)
+    transaction.on_commit(lambda: _cache().delete_many(keys))
@@ -1,10 +1,24 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile
+from expenses.data_version import bump_data_version
+from .models import Profile, Connection
+from .partners import invalidate_partner_graph
 
 
 @receiver(post_save, sender=User)
 def create_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=Connection)
+@receiver(post_delete, sender=Connection)
+def bump_version_on_connection_change(sender, instance, raw=False, **kwargs):
+    # Pages such as transactions show whether a partner is connected
+    if not raw:
+        bump_data_version(instance.sender_id)
+        bump_data_version(instance.receiver_id)
+        # Also covers changes made outside the shared views (admin, shell,
+        # cascades when a user is deleted)
+        invalidate_partner_graph(instance.sender_id, instance.receiver_id)
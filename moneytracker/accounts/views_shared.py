@@ -4,6 +4,7 @@ from django.contrib.auth.models import User
 from django.contrib import messages
 from django.db.models import Q
 from .models import Connection
+from .partners import get_partner_graph
 
 @login_required
 def shared_view(request):
@@ -12,31 +13,23 @@ def shared_view(request):
     Displays active connections and pending requests.
     """
     user = request.user
-    
-    # Active Connections (Where user is sender OR receiver, and status is accepted)
-    active_connections_qs = Connection.objects.filter(
-        (Q(sender=user) | Q(receiver=user)),
-        status='accepted'
-    )
-    
-    partners = []
-    for conn in active_connections_qs:
-        if conn.sender == user:
-            partners.append(conn.receiver)
-        else:
-            partners.append(conn.sender)
-            
-    # Pending Incoming Requests (Where user is receiver)
-    pending_requests = Connection.objects.filter(
-        receiver=user,
-        status='pending'
-    )
-    
+    graph = get_partner_graph(user.id)
+
+    # Active Connections: one query for all the partner users, kept in
+    # the graph's order (newest connection first)
+    by_id = User.objects.in_bulk(graph['partners'])
+    partners = [by_id[partner_id] for partner_id in graph['partners'] if partner_id in by_id]
+
+    # Pending Incoming Requests (Where user is receiver); skipped when the
+    # graph says there are none
+    pending_requests = Connection.objects.none()
+    if graph['incoming']:
+        pending_requests = Connection.objects.filter(receiver=user, status='pending').select_related('sender')
+
     # Pending Sent Requests (Where user is sender)
-    sent_requests = Connection.objects.filter(
-        sender=user,
-        status='pending'
-    )
+    sent_requests = Connection.objects.none()
+    if graph['outgoing']:
+        sent_requests = Connection.objects.filter(sender=user, status='pending').select_related('receiver')
     
     return render(request, 'dashboard/shared_profile.html', {
         'partners': partners,
@@ -0,0 +1,187 @@
+import numpy as np
+from django.db import connections
+from django.db.models import CharField, FloatField, IntegerField, Value
+from django.db.models.functions import Cast, Coalesce
+from expenses.metrics import span
+from expenses.models import Category, Expense, Income
+
+# =============================
+# Cash-flow analytics
+# =============================
+# A user's incomes and expenses are loaded as columnar arrays (one
+# values_list per table, no model instances) and every series below is
+# computed with numpy over the whole history at once.
+
+# Rolling-average windows, in periods of each series
+ROLLING_WINDOWS = {'daily': 30, 'weekly': 4, 'monthly': 3}
+
+
+def load_columns(user, start=None, end=None):
+    """
+    (days, amounts, categories) arrays of the user's incomes and expenses:
+    days as datetime64[D], amounts as float64 (incomes positive, expenses
+    negative), categories as int64 ids with 0 for uncategorized.
+    """
+    days, amounts, categories = [], [], []
+    for model, sign in ((Income, 1.0), (Expense, -1.0)):
+        qs = model.objects.filter(user=user)
+        if start:
+            qs = qs.filter(date__gte=start)
+        if end:
+            qs = qs.filter(date__lte=end)
+        # Cast in SQL and read the compiled query's cursor directly: rows
+        # come back as plain str/float/int, skipping Django's per-row
+        # date and Decimal converters
+        qs = qs.values_list(
+            Cast('date', CharField()), Cast('amount', FloatField()), Coalesce('category_id', Value(0), output_field=IntegerField())
+        )
+        sql, params = qs.query.get_compiler(qs.db).as_sql()
+        with connections[qs.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            columns = list(zip(*cursor.fetchall()))
+        if not columns:
+            continue
+        days.append(np.array(columns[0], dtype='datetime64[D]'))
+        amounts.append(np.array(columns[1], dtype=np.float64) * sign)
+        categories.append(np.array(columns[2], dtype=np.int64))
+
+    if not days:
+        return np.array([], dtype='datetime64[D]'), np.array([]), np.array([], dtype=np.int64)
+    return np.concatenate(days), np.concatenate(amounts), np.concatenate(categories)
+
+
+def rolling_mean(values, window):
+    """Trailing mean over window periods (fewer at the start)."""
+    if not len(values):
+        return values
+    sums = np.cumsum(values)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return sums / counts
+
+
+def _period_series(index, amounts, periods):
+    """Income, expense and net totals per period (index = period number)."""
+    income = np.bincount(index, weights=np.where(amounts > 0, amounts, 0), minlength=periods)
+    expense = np.bincount(index, weights=np.where(amounts < 0, -amounts, 0), minlength=periods)
+    return income, expense, income - expense
+
+
+def _savings_rate(income, expense):
+    """(income - expense) / income, NaN where there was no income."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(income > 0, (income - expense) / income, np.nan)
+
+
+def _round(values):
+    """JSON-ready list: rounded to cents, NaN as None."""
+    rounded = np.round(values, 2).astype(object)
+    rounded[np.isnan(values)] = None
+    return rounded.tolist()
+
+
+def _series(labels, income, expense, net, window):
+    return {
+        'labels': labels,
+        'income': _round(income),
+        'expense': _round(expense),
+        'net': _round(net),
+        'net_rolling': _round(rolling_mean(net, window)),
+        'expense_rolling': _round(rolling_mean(expense, window)),
+    }
+
+
+def category_trends(months, amounts, categories, names):
+    """
+    Expense totals per category and year, with a least-squares trend of
+    the monthly totals (change per month) for every category at once.
+    """
+    spent = amounts < 0
+    months, amounts, categories = months[spent], -amounts[spent], categories[spent]
+    if not len(amounts):
+        return {'years': [], 'items': []}
+
+    ids, category_index = np.unique(categories, return_inverse=True)
+    years = months // 12
+    first_year, first_month = years.min(), months.min()
+    year_count = years.max() - first_year + 1
+    month_count = months.max() - first_month + 1
+
+    yearly = np.zeros((len(ids), year_count))
+    np.add.at(yearly, (category_index, years - first_year), amounts)
+    monthly = np.zeros((len(ids), month_count))
+    np.add.at(monthly, (category_index, months - first_month), amounts)
+
+    x = np.arange(month_count) - (month_count - 1) / 2
+    denominator = (x * x).sum()
+    slopes = monthly @ x / denominator if denominator else np.zeros(len(ids))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = (yearly[:, -1] - yearly[:, -2]) / yearly[:, -2] if year_count > 1 else np.full(len(ids), np.nan)
+    change[~np.isfinite(change)] = np.nan
+
+    order = np.argsort(-yearly.sum(axis=1))
+    return {
+        'years': [int(first_year + 1970 + i) for i in range(year_count)],
+        'items': [
+            {
+                'category_id': int(ids[i]) or None,
+                'name': names.get(int(ids[i]), 'Uncategorized'),
+                'totals': _round(yearly[i]),
+                'monthly_trend': round(float(slopes[i]), 2),
+                'last_year_change': None if np.isnan(change[i]) else round(float(change[i]), 4),
+            }
+            for i in order
+        ],
+    }
+
+
+@span('get_cash_flow_analytics')
+def get_cash_flow_analytics(user, start=None, end=None):
+    """
+    Daily, weekly (Monday-based) and monthly cash-flow series with rolling
+    averages, monthly and overall savings rates, and per-category trends,
+    for the user's history between start and end (dates, both optional).
+    """
+    days, amounts, categories = load_columns(user, start, end)
+    if not len(days):
+        return {'start': None, 'end': None, 'savings_rate': None, 'daily': None,
+                'weekly': None, 'monthly': None, 'categories': {'years': [], 'items': []}}
+
+    first, last = days.min(), days.max()
+    day_numbers = days.astype(np.int64)
+
+    # Daily
+    daily_index = day_numbers - first.astype(np.int64)
+    daily = _period_series(daily_index, amounts, int(daily_index.max()) + 1)
+    daily_labels = np.datetime_as_string(np.arange(first, last + 1)).tolist()
+
+    # Weekly: 1970-01-01 was a Thursday, so +3 puts week boundaries on Mondays
+    week_numbers = (day_numbers + 3) // 7
+    weekly_index = week_numbers - week_numbers.min()
+    weekly = _period_series(weekly_index, amounts, int(weekly_index.max()) + 1)
+    mondays = (np.arange(week_numbers.min(), week_numbers.max() + 1) * 7 - 3).astype('datetime64[D]')
+    weekly_labels = np.datetime_as_string(mondays).tolist()
+
+    # Monthly
+    months = days.astype('datetime64[M]').astype(np.int64)
+    monthly_index = months - months.min()
+    monthly = _period_series(monthly_index, amounts, int(monthly_index.max()) + 1)
+    monthly_labels = np.datetime_as_string(
+        np.arange(months.min(), months.max() + 1).astype('datetime64[M]')
+    ).tolist()
+    monthly_series = _series(monthly_labels, *monthly, ROLLING_WINDOWS['monthly'])
+    monthly_series['savings_rate'] = _round(_savings_rate(monthly[0], monthly[1]))
+
+    total_income, total_expense = monthly[0].sum(), monthly[1].sum()
+    names = dict(Category.objects.filter(user=user).values_list('id', 'name'))
+
+    return {
+        'start': str(first),
+        'end': str(last),
+        'savings_rate': round(float(_savings_rate(total_income, total_expense)), 4) if total_income > 0 else None,
+        'daily': _series(daily_labels, *daily, ROLLING_WINDOWS['daily']),
+        'weekly': _series(weekly_labels, *weekly, ROLLING_WINDOWS['weekly']),
+        'monthly': monthly_series,
+        'categories': category_trends(months, amounts, categories, names),
+    }
@@ -0,0 +1,81 @@
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from expenses.data_version import data_version_key, get_data_version
+
+# Per-process hit/miss counters, read by dashboard_cache_stats
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def get_cache_stats():
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else None,
+    }
+
+
+def _lookup(cache, user_id, payload_key):
+    """Returns (version, payload or None) in a single get_many round trip."""
+    version_key = data_version_key(user_id)
+    found = cache.get_many([version_key, payload_key])
+    version = found.get(version_key)
+    entry = found.get(payload_key)
+    if version is not None and entry is not None and entry[0] == version:
+        _count('hits')
+        return version, entry[1]
+    _count('misses')
+    return version, None
+
+
+def _payload_key(name, user_id, year, month):
+    return f'dashboard:{name}:{user_id}:{year}:{month}'
+
+
+def cached_payload(name, user_id, year, month, build):
+    """
+    Returns build() for (name, user, year, month), cached against the
+    user's data version. The payload is stored with the version it was
+    built for, so an unchanged poll costs a single get_many round trip.
+    """
+    cache = _cache()
+    payload_key = _payload_key(name, user_id, year, month)
+    version, payload = _lookup(cache, user_id, payload_key)
+    if payload is not None:
+        return payload
+
+    if version is None:
+        version = get_data_version(user_id)
+    payload = build()
+    cache.set(payload_key, (version, payload), getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300))
+    return payload
+
+
+async def acached_payload(name, user_id, year, month, abuild):
+    """cached_payload for async views; abuild is an async callable."""
+    cache = _cache()
+    payload_key = _payload_key(name, user_id, year, month)
+    version, payload = await sync_to_async(_lookup)(cache, user_id, payload_key)
+    if payload is not None:
+        return payload
+
+    if version is None:
+        version = await sync_to_async(get_data_version)(user_id)
+    payload = await abuild()
+    await cache.aset(payload_key, (version, payload), getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 300))
+    return payload
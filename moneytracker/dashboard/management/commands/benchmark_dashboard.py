@@ -0,0 +1,163 @@
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from expenses.data_version import bump_data_version
+
+# (endpoint, variant, url name)
+TARGETS = [
+    ('live-data', 'sync', 'dashboard_live_data'),
+    ('live-data', 'async', 'dashboard_live_data_async'),
+    ('dashboard', 'sync', 'dashboard'),
+    ('dashboard', 'async', 'dashboard_async'),
+]
+
+
+def _percentile(sorted_values, q):
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare p50/p99 latency of the sync and async dashboard endpoints "
+        "under concurrent load, served by the project's ASGI application in-process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help="Username whose dashboard is requested.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint variant.")
+        parser.add_argument('--concurrency', type=int, default=20, help="Requests in flight at once.")
+        parser.add_argument('--month', type=int, default=datetime.now().month)
+        parser.add_argument('--year', type=int, default=datetime.now().year)
+        parser.add_argument('--cold', action='store_true',
+                            help="Invalidate the dashboard cache before every request, so each one runs the aggregates.")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist.")
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency must be positive.")
+
+        # An authenticated session, as a logged-in browser would send it
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+        from moneytracker.asgi import application
+
+        query = f"month={options['month']}&year={options['year']}"
+        results = []
+        try:
+            for endpoint, variant, url_name in TARGETS:
+                results.append(asyncio.run(self._load(
+                    application, reverse(url_name), query, cookie, user.id, options
+                )) | {'endpoint': endpoint, 'variant': variant})
+        finally:
+            session.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'endpoint':<11}{'variant':<8}{'ok':>6}{'errors':>8}"
+                          f"{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'req/s':>10}")
+        for r in results:
+            self.stdout.write(f"{r['endpoint']:<11}{r['variant']:<8}{r['ok']:>6}{r['errors']:>8}"
+                              f"{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['mean_ms']:>10.2f}"
+                              f"{r['throughput']:>10.1f}")
+
+    async def _load(self, application, path, query, cookie, user_id, options):
+        total = options['requests']
+        latencies = []
+        errors = 0
+        issued = 0
+
+        async def worker():
+            nonlocal errors, issued
+            while issued < total:
+                issued += 1
+                if options['cold']:
+                    await sync_to_async(bump_data_version)(user_id)
+                elapsed, status = await self._request(application, path, query, cookie)
+                latencies.append(elapsed)
+                if status != 200:
+                    errors += 1
+
+        # One untimed request so imports and template loading are not measured
+        await self._request(application, path, query, cookie)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(min(options['concurrency'], total))))
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        to_ms = 1000
+        return {
+            'requests': total,
+            'concurrency': options['concurrency'],
+            'cold': options['cold'],
+            'ok': total - errors,
+            'errors': errors,
+            'p50_ms': _percentile(latencies, 0.50) * to_ms,
+            'p99_ms': _percentile(latencies, 0.99) * to_ms,
+            'mean_ms': statistics.fmean(latencies) * to_ms,
+            'throughput': total / wall,
+        }
+
+    async def _request(self, application, path, query, cookie):
+        """Runs one GET through the ASGI application; returns (seconds, status)."""
+        host = 'localhost'
+        if settings.ALLOWED_HOSTS and settings.ALLOWED_HOSTS[0] not in ('*', ''):
+            host = settings.ALLOWED_HOSTS[0].lstrip('.')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [(b'host', host.encode()), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 0),
+            'server': (host, 80),
+        }
+        body_sent = False
+        disconnected = asyncio.Event()
+        status = None
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+
+        started = time.perf_counter()
+        await application(scope, receive, send)
+        elapsed = time.perf_counter() - started
+        disconnected.set()
+        return elapsed, status
@@ -0,0 +1,234 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.models import Sum
+from expenses.metrics import span
+from expenses.models import BalanceSnapshot, Expense, Income, BankAccount
+from expenses.rollups import get_month_summary
+from expenses.services import get_month_range
+
+
+@span('get_net_worth')
+def get_net_worth(user):
+    """Sum of account balances, excluding credit cards."""
+    return BankAccount.objects.filter(
+        user=user
+    ).exclude(
+        account_type='credit'
+    ).aggregate(
+        total=Sum('balance')
+    )['total'] or 0
+
+
+@span('get_net_worth_history')
+def get_net_worth_history(user, start=None, end=None, interval='day'):
+    """
+    Net worth (as in get_net_worth) over time, read from the balance
+    snapshots with one range scan. interval 'day' gives a point for every
+    date a balance changed, 'month' one per month (its closing value).
+    With start, the first point carries the net worth on that date.
+    """
+    rows = BalanceSnapshot.objects.filter(user=user).exclude(account__account_type='credit')
+    if end:
+        rows = rows.filter(date__lte=end)
+    rows = rows.order_by('date').values_list('date', 'account_id', 'balance')
+
+    def point(day):
+        return day.replace(day=1) if interval == 'month' else day
+
+    balances = {}
+    total = Decimal('0.00')
+    points = {}
+    for day, account_id, balance in rows:
+        total += balance - balances.get(account_id, 0)
+        balances[account_id] = balance
+        # Earlier rows are carried into the first point
+        points[point(max(day, start) if start else day)] = total
+
+    labels = sorted(points)
+    return {
+        'interval': interval,
+        'labels': [day.strftime('%Y-%m' if interval == 'month' else '%Y-%m-%d') for day in labels],
+        'net_worth': [float(points[day]) for day in labels],
+    }
+
+
+@span('get_dashboard_data')
+def get_dashboard_data(user, year, month, include_days=True):
+    """
+    Aggregates one month of a user's activity for the dashboard.
+
+    With include_days, reads each table once over the month's date range
+    and builds category totals, per-day totals and per-day detail rows in a
+    single pass. Without it (live polling), only the monthly rollup is read.
+    """
+    if not include_days:
+        summary = get_month_summary(user, year, month)
+        return {
+            'total_expenses': summary['total_expenses'],
+            'total_income': summary['total_income'],
+            'category_totals': summary['expense_by_category'],
+        }
+
+    start_date, next_month_start = get_month_range(date(year, month, 1))
+    return _build_dashboard_data(
+        _month_rows(Income, 'source', user, start_date, next_month_start),
+        _month_rows(Expense, 'description', user, start_date, next_month_start),
+    )
+
+
+def _month_rows(model, text_field, user, start_date, next_month_start):
+    """One month of a user's Income/Expense rows, newest first."""
+    return list(model.objects.filter(
+        user=user,
+        date__gte=start_date,
+        date__lt=next_month_start
+    ).order_by('-date', '-id').values_list('date', 'amount', text_field, 'category__name', 'account__name'))
+
+
+def _build_dashboard_data(incomes, expenses):
+    total_income = Decimal('0.00')
+    total_expenses = Decimal('0.00')
+    category_totals = {}
+    daily_stats = {}
+    daily_details = {}
+
+    for day_date, amount, source, cat_name, acc_name in incomes:
+        day = day_date.day
+        stats = daily_stats.setdefault(day, {'income': 0, 'expense': 0, 'count': 0})
+        stats['income'] += float(amount)
+        stats['count'] += 1
+        total_income += amount
+        daily_details.setdefault(day, []).append({
+            'type': 'income',
+            'description': source or cat_name or 'Income',
+            'amount': float(amount),
+            'category': cat_name or 'Uncategorized',
+            'icon': 'fa-money-bill-wave',
+            'account': acc_name or 'Cash'
+        })
+
+    for day_date, amount, description, cat_name, acc_name in expenses:
+        day = day_date.day
+        stats = daily_stats.setdefault(day, {'income': 0, 'expense': 0, 'count': 0})
+        stats['expense'] += float(amount)
+        stats['count'] += 1
+        total_expenses += amount
+        pie_name = cat_name or 'Uncategorized'
+        category_totals[pie_name] = category_totals.get(pie_name, 0) + float(amount)
+        daily_details.setdefault(day, []).append({
+            'type': 'expense',
+            'description': description,
+            'amount': float(amount),
+            'category': pie_name,
+            'icon': 'fa-shopping-cart',
+            'account': acc_name or 'Cash'
+        })
+
+    return {
+        'total_expenses': total_expenses,
+        'total_income': total_income,
+        'category_totals': category_totals,
+        'daily_stats': daily_stats,
+        'daily_details': daily_details,
+    }
+
+
+@span('get_live_data')
+def get_live_data(user, year, month):
+    """
+    JSON-ready payload for the live dashboard endpoint: monthly totals,
+    net worth and the expense pie, all from the rollup and account tables.
+    """
+    data = get_dashboard_data(user, year, month, include_days=False)
+    return _live_payload(year, month, data, get_net_worth(user))
+
+
+def _live_payload(year, month, data, net_worth):
+    total_expenses = data['total_expenses']
+    total_income = data['total_income']
+    cat_data = data['category_totals']
+
+    return {
+        'month': month,
+        'year': year,
+
+        'net_worth': float(net_worth),
+        'total_income': float(total_income),
+        'total_expenses': float(total_expenses),
+        'net_cash_flow': float(total_income) - float(total_expenses),
+
+        'pie_labels': list(cat_data.keys()),
+        'pie_data': list(cat_data.values()),
+    }
+
+
+@span('get_dashboard_payload')
+def get_dashboard_payload(user, year, month):
+    """Everything dashboard_view caches for one month."""
+    return {
+        'user_accounts': list(BankAccount.objects.filter(user=user)),
+        # Net Worth (EXCLUDE credit cards)
+        'net_worth': get_net_worth(user),
+        # Single pass over the month's rows
+        'data': get_dashboard_data(user, year, month),
+    }
+
+
+# =============================
+# Async variants
+# =============================
+# The ORM is sync-only, so each independent query runs on a thread of a
+# small dedicated pool and the results are awaited together. Pool threads
+# keep their database connection between requests (at most one per
+# thread), so concurrency does not cost a reconnect per query. The
+# payloads are identical to the sync versions.
+
+_query_pool = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'DASHBOARD_QUERY_WORKERS', 4),
+    thread_name_prefix='dashboard-query'
+)
+
+
+def _concurrent(func):
+    """Wraps func to run on the dashboard query pool."""
+    def run(*args):
+        try:
+            return func(*args)
+        except Exception:
+            # Never reuse a connection that may be broken
+            connections.close_all()
+            raise
+    return sync_to_async(run, thread_sensitive=False, executor=_query_pool)
+
+
+async def aget_live_data(user, year, month):
+    """get_live_data with the rollup read and net worth run concurrently."""
+    data, net_worth = await asyncio.gather(
+        _concurrent(get_dashboard_data)(user, year, month, False),
+        _concurrent(get_net_worth)(user),
+    )
+    return _live_payload(year, month, data, net_worth)
+
+
+async def aget_dashboard_payload(user, year, month):
+    """
+    get_dashboard_payload with the account list, net worth and both month
+    scans run concurrently.
+    """
+    start_date, next_month_start = get_month_range(date(year, month, 1))
+    accounts, net_worth, incomes, expenses = await asyncio.gather(
+        _concurrent(lambda: list(BankAccount.objects.filter(user=user)))(),
+        _concurrent(get_net_worth)(user),
+        _concurrent(_month_rows)(Income, 'source', user, start_date, next_month_start),
+        _concurrent(_month_rows)(Expense, 'description', user, start_date, next_month_start),
+    )
+    return {
+        'user_accounts': accounts,
+        'net_worth': net_worth,
+        'data': _build_dashboard_data(incomes, expenses),
+    }
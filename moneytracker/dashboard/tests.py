@@ -1,3 +1,154 @@
-from django.test import TestCase
+import asyncio
+import json
+from unittest import mock
+from datetime import date
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from expenses.models import BankAccount, Category, Expense, Income
+
+from . import views
+from .cache import get_cache_stats
+from .services import aget_dashboard_payload, aget_live_data, get_dashboard_payload, get_live_data
+
+
+class DashboardEventsTests(TransactionTestCase):
+    """
+    The event stream against real commits (autocommit, so every write is
+    published at once); its totals are built on other threads.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='streamed')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking')
+        self.async_client.force_login(self.user)
+
+    def add(self, amount, day):
+        Expense.objects.create(user=self.user, account=self.account, amount=Decimal(amount),
+                               description='Coffee', date=day)
+
+    async def next_event(self, stream):
+        return (await asyncio.wait_for(stream.__anext__(), 5)).decode()
+
+    @mock.patch('dashboard.views.EVENTS_HEARTBEAT', 0.2)
+    async def test_totals_for_the_viewed_month_only(self):
+        response = await self.async_client.get(reverse('dashboard_events'), {'year': 2024, 'month': 3})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content.__aiter__()
+        try:
+            # Subscribed once the stream has started
+            self.assertEqual(await self.next_event(stream), 'retry: 5000\n\n')
+
+            # Another month: its totals are not sent, only the net worth
+            await sync_to_async(self.add)('9.99', date(2024, 4, 5))
+            self.assertTrue((await self.next_event(stream)).startswith('event: net_worth\n'))
+            self.assertEqual(await self.next_event(stream), ': keep-alive\n\n')
+
+            await sync_to_async(self.add)('4.50', date(2024, 3, 5))
+            event = await self.next_event(stream)
+            self.assertTrue(event.startswith('event: totals\n'), event)
+            payload = json.loads(event.split('data: ', 1)[1])
+            self.assertEqual(payload['total_expenses'], 4.5)
+        finally:
+            await stream.aclose()
+
+    def test_sync_worker_gets_no_stream(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('dashboard_events')).status_code, 204)
+
+
+class DashboardCacheTests(TestCase):
+    """Live data cached against the data version: counted, and dropped on writes."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='cached', is_staff=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.account = BankAccount.objects.create(user=self.user, name='Checking')
+        self.client.force_login(self.user)
+
+    def live(self):
+        response = self.client.get(reverse('dashboard_live_data'), {'year': 2024, 'month': 3})
+        return json.loads(response.content)
+
+    def test_hits_misses_and_invalidation(self):
+        before = get_cache_stats()
+        with mock.patch.object(views, 'get_live_data', wraps=views.get_live_data) as build:
+            self.assertEqual(self.live()['total_expenses'], 0)
+            self.assertEqual(self.live()['total_expenses'], 0)
+            self.assertEqual(build.call_count, 1)
+
+            # A write moves the data version: the next poll rebuilds
+            with self.captureOnCommitCallbacks(execute=True):
+                Expense.objects.create(user=self.user, account=self.account, amount=Decimal('4.50'),
+                                       description='Coffee', date=date(2024, 3, 5))
+            self.assertEqual(self.live()['total_expenses'], 4.5)
+            self.assertEqual(self.live()['total_expenses'], 4.5)
+            self.assertEqual(build.call_count, 2)
+
+        after = get_cache_stats()
+        self.assertEqual(after['hits'] - before['hits'], 2)
+        self.assertEqual(after['misses'] - before['misses'], 2)
+
+        stats = json.loads(self.client.get(reverse('dashboard_cache_stats')).content)
+        self.assertEqual(stats, after)
+        self.assertEqual(stats['hit_ratio'], stats['hits'] / (stats['hits'] + stats['misses']))
+
+    def test_stats_are_staff_only(self):
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('dashboard_cache_stats')).status_code, 302)
+
+
+class DashboardAsyncTests(TransactionTestCase):
+    """
+    The async variants build the same payloads as the sync ones (their
+    queries run on pool threads, hence real commits).
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='concurrent')
+        checking = BankAccount.objects.create(user=self.user, name='Checking', balance=Decimal('1000.00'))
+        BankAccount.objects.create(user=self.user, name='Card', account_type='credit', balance=Decimal('-200.00'))
+        food = Category.objects.create(user=self.user, name='Food')
+        rent = Category.objects.create(user=self.user, name='Rent')
+        for amount, category, day in (('4.50', food, 2), ('12.25', food, 2), ('800.00', rent, 1), ('3.10', None, 20)):
+            Expense.objects.create(user=self.user, account=checking, category=category, amount=Decimal(amount),
+                                   description='Spent', date=date(2024, 3, day))
+        Income.objects.create(user=self.user, account=checking, amount=Decimal('2500.00'),
+                              source='Salary', date=date(2024, 3, 1))
+        # Outside the month
+        Expense.objects.create(user=self.user, account=checking, amount=Decimal('99.00'),
+                               description='Spent', date=date(2024, 4, 1))
+        self.client.force_login(self.user)
+
+    def test_payloads(self):
+        self.assertEqual(async_to_sync(aget_live_data)(self.user, 2024, 3), get_live_data(self.user, 2024, 3))
+        self.assertEqual(async_to_sync(aget_dashboard_payload)(self.user, 2024, 3),
+                         get_dashboard_payload(self.user, 2024, 3))
+
+    def test_live_data_views(self):
+        params = {'year': 2024, 'month': 3}
+        sync_payload = json.loads(self.client.get(reverse('dashboard_live_data'), params).content)
+        cache.clear()
+        async_payload = json.loads(self.client.get(reverse('dashboard_live_data_async'), params).content)
+        del sync_payload['timestamp'], async_payload['timestamp']
+        self.assertEqual(async_payload, sync_payload)
+        self.assertEqual(async_payload['total_expenses'], 819.85)
+
+    def test_dashboard_views(self):
+        params = {'year': 2024, 'month': 3}
+        sync_context = self.client.get(reverse('dashboard'), params).context
+        cache.clear()
+        response = self.client.get(reverse('dashboard_async'), params)
+        self.assertEqual(response.status_code, 200)
+        for name in ('total_expenses', 'total_income', 'net_cash_flow', 'user_balance', 'user_accounts',
+                     'pie_labels', 'pie_data', 'calendar_weeks', 'daily_transactions_json'):
+            self.assertEqual(response.context[name], sync_context[name], name)
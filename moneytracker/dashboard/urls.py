@@ -7,4 +7,12 @@ app_name = 'dashboard'
 urlpatterns = [
     path('', views.dashboard_view, name='dashboard'),
     path('live-data/', views.dashboard_live_data, name='dashboard_live_data'),
+    path('async/', views.dashboard_view_async, name='dashboard_async'),
+    path('live-data/async/', views.dashboard_live_data_async, name='dashboard_live_data_async'),
+    path('events/', views.dashboard_events, name='dashboard_events'),
+    path('analytics/', views.dashboard_analytics, name='dashboard_analytics'),
+    path('net-worth/', views.dashboard_net_worth, name='dashboard_net_worth'),
+    path('cache-stats/', views.dashboard_cache_stats, name='dashboard_cache_stats'),
+    path('profiles/', views.profile_list, name='profile_list'),
+    path('profiles/<str:profile_id>/<str:kind>/', views.profile_download, name='profile_download'),
 ]
\ No newline at end of file
@@ -1,16 +1,39 @@
 # views.py
 from django.shortcuts import render
-from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from expenses.models import Expense, Income, Budget, BankAccount
-from django.db.models import Sum, Q
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+from expenses.etags import conditional_on_user_data
+from expenses.data_version import get_data_version
+from expenses.events import hub
+from expenses.metrics import PROMETHEUS_CONTENT_TYPE, registry
+from expenses.profiling import PROFILE_FILES, list_profiles, profile_path
+from django.contrib.auth.views import redirect_to_login
+from .analytics import get_cash_flow_analytics
+from .cache import acached_payload, cached_payload, get_cache_stats
+from .services import (
+    aget_dashboard_payload, aget_live_data, get_dashboard_payload, get_live_data, get_net_worth,
+    get_net_worth_history
+)
 from datetime import datetime
+import asyncio
 import json
 from django.core.serializers.json import DjangoJSONEncoder
 from calendar import month_name
 import calendar
+from functools import wraps
+
+# Seconds between keep-alive comments on an idle event stream
+EVENTS_HEARTBEAT = 15
+# Streams are closed after this many seconds and EventSource reconnects
+# (resuming from Last-Event-ID). Django 4.2 does not notice disconnected
+# clients, so this bounds how long an abandoned stream stays subscribed.
+EVENTS_MAX_AGE = 300
 
 @login_required
+@conditional_on_user_data
 def dashboard_view(request):
     user = request.user
 
@@ -19,47 +42,22 @@ def dashboard_view(request):
     selected_year = int(request.GET.get('year', datetime.now().year))
 
     # =============================
-    # Expenses (selected month/year)
+    # Accounts, Net Worth & Month aggregates
+    # (cached against the user's data version)
     # =============================
-    expenses = Expense.objects.filter(
-        user=user,
-        date__month=selected_month,
-        date__year=selected_year
-    ).order_by('-date')
+    payload = cached_payload('view', user.id, selected_year, selected_month,
+                             lambda: get_dashboard_payload(user, selected_year, selected_month))
+    context = _dashboard_context(user, selected_year, selected_month, payload, get_data_version(user.id))
+    return render(request, 'dashboard/dashboard.html', context)
 
-    # =============================
-    # Income (selected month/year)
-    # =============================
-    incomes = Income.objects.filter(
-        user=user,
-        date__month=selected_month,
-        date__year=selected_year
-    ).order_by('-date')
 
-    # =============================
-    # Accounts
-    # =============================
-    user_accounts = BankAccount.objects.filter(user=user)
-
-    # ✅ Net Worth (EXCLUDE credit cards)
-    net_worth = BankAccount.objects.filter(
-        user=user
-    ).exclude(
-        account_type='credit'
-    ).aggregate(
-        total=Sum('balance')
-    )['total'] or 0
-
-    # =============================
-    # Monthly totals
-    # =============================
-    total_expenses = expenses.aggregate(
-        total=Sum('amount')
-    )['total'] or 0
-
-    total_income = incomes.aggregate(
-        total=Sum('amount')
-    )['total'] or 0
+def _dashboard_context(user, selected_year, selected_month, payload, data_version):
+    """Template context of the dashboard page, shared by both variants."""
+    user_accounts = payload['user_accounts']
+    net_worth = payload['net_worth']
+    data = payload['data']
+    total_expenses = data['total_expenses']
+    total_income = data['total_income']
 
     # Net cash flow
     net_cash_flow = float(total_income) - float(total_expenses)
@@ -67,10 +65,7 @@ def dashboard_view(request):
     # =============================
     # Pie Chart Data (Expenses)
     # =============================
-    cat_data = {}
-    for e in expenses:
-        cat_name = e.category.name if e.category else 'Uncategorized'
-        cat_data[cat_name] = cat_data.get(cat_name, 0) + float(e.amount)
+    cat_data = data['category_totals']
 
     pie_labels = list(cat_data.keys())
     pie_data = list(cat_data.values())
@@ -84,21 +79,7 @@ def dashboard_view(request):
     cal = calendar.Calendar(firstweekday=6)  # 0=Monday, 6=Sunday
     month_days_matrix = cal.monthdayscalendar(selected_year, selected_month)
 
-    daily_stats = {}
-
-    for inc in incomes:
-        day = inc.date.day
-        if day not in daily_stats:
-            daily_stats[day] = {'income': 0, 'expense': 0, 'count': 0}
-        daily_stats[day]['income'] += float(inc.amount)
-        daily_stats[day]['count'] += 1
-
-    for exp in expenses:
-        day = exp.date.day
-        if day not in daily_stats:
-            daily_stats[day] = {'income': 0, 'expense': 0, 'count': 0}
-        daily_stats[day]['expense'] += float(exp.amount)
-        daily_stats[day]['count'] += 1
+    daily_stats = data['daily_stats']
 
     calendar_weeks = []
     for week in month_days_matrix:
@@ -121,38 +102,8 @@ def dashboard_view(request):
         calendar_weeks.append(week_data)
 
     # ✅ Daily Transactions Data for Popup (Grouped by Day)
-    daily_details = {}
-    
-    # Process Incomes
-    for inc in incomes:
-        day = inc.date.day
-        if day not in daily_details:
-             daily_details[day] = []
-        daily_details[day].append({
-            'type': 'income',
-            'description': inc.source or inc.category.name if inc.category else 'Income',
-            'amount': float(inc.amount),
-            'category': inc.category.name if inc.category else 'Uncategorized',
-            'icon': getattr(inc.category, 'icon', 'fa-money-bill-wave') if inc.category else 'fa-money-bill-wave',
-            'account': inc.account.name if inc.account else 'Cash'
-        })
-
-    # Process Expenses
-    for exp in expenses:
-        day = exp.date.day
-        if day not in daily_details:
-             daily_details[day] = []
-        daily_details[day].append({
-            'type': 'expense',
-            'description': exp.description,
-            'amount': float(exp.amount),
-            'category': exp.category.name if exp.category else 'Uncategorized',
-            'icon': getattr(exp.category, 'icon', 'fa-shopping-cart') if exp.category else 'fa-shopping-cart', # Assuming category has icon field or fallback
-            'account': exp.account.name if exp.account else 'Cash'
-        })
-    
-    # Sort transactions within each day (optional, could sort by ID or keep as is) (Actually models are ordered by -date, but here we just append)
-    
+    daily_details = data['daily_details']
+
     # Serialize for template
     daily_transactions_json = json.dumps(daily_details)
 
@@ -171,7 +122,7 @@ def dashboard_view(request):
         next_month = selected_month + 1
         next_year = selected_year
 
-    return render(request, 'dashboard/dashboard.html', {
+    return {
         'welcome_name': welcome_name,
 
         # Numbers
@@ -197,6 +148,9 @@ def dashboard_view(request):
         'next_month': next_month,
         'next_year': next_year,
 
+        # Lets the event stream tell whether the page is already stale
+        'data_version': data_version,
+
         'months': [
             {'value': i, 'label': month_name[i]}
             for i in range(1, 13)
@@ -206,11 +160,12 @@ def dashboard_view(request):
             {'value': y, 'label': y}
             for y in range(datetime.now().year, datetime.now().year - 10, -1)
         ],
-    })
+    }
 
 
 # Add this new view for real-time data updates
 @login_required
+@conditional_on_user_data
 def dashboard_live_data(request):
     """
     API endpoint for AJAX-based dashboard updates
@@ -223,67 +178,202 @@ def dashboard_live_data(request):
     month = int(request.GET.get('month', datetime.now().month))
     year = int(request.GET.get('year', datetime.now().year))
 
-    # =============================
-    # Expenses & Income (Filtered)
-    # =============================
-    expenses = Expense.objects.filter(
-        user=user,
-        date__month=month,
-        date__year=year
-    )
-
-    incomes = Income.objects.filter(
-        user=user,
-        date__month=month,
-        date__year=year
-    )
+    # Cached against the user's data version: unchanged polls cost
+    # one cache round trip and no queries
+    payload = cached_payload('live', user.id, year, month, lambda: get_live_data(user, year, month))
 
-    # =============================
-    # Monthly totals
-    # =============================
-    total_expenses = expenses.aggregate(
-        total=Sum('amount')
-    )['total'] or 0
+    return JsonResponse({
+        **payload,
+        'timestamp': datetime.now().isoformat(),
+    })
 
-    total_income = incomes.aggregate(
-        total=Sum('amount')
-    )['total'] or 0
 
-    net_cash_flow = float(total_income) - float(total_expenses)
+@login_required
+@conditional_on_user_data
+def dashboard_analytics(request):
+    """
+    Cash-flow analytics over the user's history (JSON): daily, weekly and
+    monthly series with rolling averages, savings rates and category
+    trends. Optional start/end query params (YYYY-MM-DD) bound the range.
+    """
+    user = request.user
+    try:
+        start, end = (
+            datetime.strptime(request.GET[name], '%Y-%m-%d').date() if request.GET.get(name) else None
+            for name in ('start', 'end')
+        )
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Dates must be YYYY-MM-DD'})
 
-    # =============================
-    # Net Worth (GLOBAL – exclude credit cards)
-    # =============================
-    net_worth = BankAccount.objects.filter(
-        user=user
-    ).exclude(
-        account_type='credit'
-    ).aggregate(
-        total=Sum('balance')
-    )['total'] or 0
+    payload = cached_payload('analytics', user.id, start or '', end or '',
+                             lambda: get_cash_flow_analytics(user, start, end))
+    return JsonResponse({'success': True, **payload})
 
-    # =============================
-    # Pie Chart Data (Expenses)
-    # =============================
-    cat_data = {}
-    for e in expenses:
-        cat_name = e.category.name if e.category else 'Uncategorized'
-        cat_data[cat_name] = cat_data.get(cat_name, 0) + float(e.amount)
 
-    # =============================
-    # Response
-    # =============================
-    return JsonResponse({
-        'month': month,
-        'year': year,
 
-        'net_worth': float(net_worth),
-        'total_income': float(total_income),
-        'total_expenses': float(total_expenses),
-        'net_cash_flow': float(net_cash_flow),
+@login_required
+@conditional_on_user_data
+def dashboard_net_worth(request):
+    """
+    Net worth over time (JSON), from the balance snapshots. Optional
+    start/end query params (YYYY-MM-DD) and interval ('day' or 'month').
+    """
+    interval = request.GET.get('interval', 'day')
+    if interval not in ('day', 'month'):
+        return JsonResponse({'success': False, 'error': "interval must be 'day' or 'month'"})
+    try:
+        start, end = (
+            datetime.strptime(request.GET[name], '%Y-%m-%d').date() if request.GET.get(name) else None
+            for name in ('start', 'end')
+        )
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Dates must be YYYY-MM-DD'})
+
+    return JsonResponse({'success': True, **get_net_worth_history(request.user, start, end, interval)})
+
+# =============================
+# Async variants (ASGI)
+# =============================
+
+def async_login_required(view_func):
+    """login_required for async views (Django 4.2's only wraps sync ones)."""
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        if await sync_to_async(_request_user)(request) is None:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+@async_login_required
+@conditional_on_user_data
+async def dashboard_view_async(request):
+    """dashboard_view with its queries run concurrently on a miss."""
+    user = request.user
+    selected_month = int(request.GET.get('month', datetime.now().month))
+    selected_year = int(request.GET.get('year', datetime.now().year))
+
+    payload = await acached_payload('view', user.id, selected_year, selected_month,
+                                    lambda: aget_dashboard_payload(user, selected_year, selected_month))
+    data_version = await sync_to_async(get_data_version)(user.id)
+    context = _dashboard_context(user, selected_year, selected_month, payload, data_version)
+    return await sync_to_async(render)(request, 'dashboard/dashboard.html', context)
+
+
+@async_login_required
+@conditional_on_user_data
+async def dashboard_live_data_async(request):
+    """dashboard_live_data with its queries run concurrently on a miss."""
+    user = request.user
+    month = int(request.GET.get('month', datetime.now().month))
+    year = int(request.GET.get('year', datetime.now().year))
 
-        'pie_labels': list(cat_data.keys()),
-        'pie_data': list(cat_data.values()),
+    payload = await acached_payload('live', user.id, year, month, lambda: aget_live_data(user, year, month))
 
+    return JsonResponse({
+        **payload,
         'timestamp': datetime.now().isoformat(),
-    })
\ No newline at end of file
+    })
+
+
+def _sse(event, data, event_id=None):
+    message = f'event: {event}\n'
+    if event_id is not None:
+        message += f'id: {event_id}\n'
+    return message + f'data: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'
+
+
+def _request_user(request):
+    return request.user if request.user.is_authenticated else None
+
+
+async def dashboard_events(request):
+    """
+    Server-sent events for one dashboard month (ASGI only).
+
+    Write paths publish change events to the in-process hub; this stream
+    sends the recomputed totals ('totals') only when the viewed month
+    changed, and just the net worth ('net_worth') when only balances did.
+    An idle stream waits on the hub and does no database work.
+    """
+    if not isinstance(request, ASGIRequest):
+        # A sync worker would be held for the life of the stream.
+        # 204 tells EventSource not to reconnect.
+        return HttpResponse(status=204)
+
+    user = await sync_to_async(_request_user)(request)
+    if user is None:
+        return HttpResponse(status=401)
+
+    month = int(request.GET.get('month', datetime.now().month))
+    year = int(request.GET.get('year', datetime.now().year))
+    month_date = datetime(year, month, 1).date()
+    # The version the page (or the last event received) was built from
+    seen_version = request.headers.get('Last-Event-ID') or request.GET.get('version')
+
+    def build_totals():
+        version = get_data_version(user.id)
+        payload = cached_payload('live', user.id, year, month, lambda: get_live_data(user, year, month))
+        return _sse('totals', payload, version)
+
+    def build_net_worth():
+        return _sse('net_worth', {'net_worth': float(get_net_worth(user))}, get_data_version(user.id))
+
+    async def stream():
+        subscription = hub.subscribe(user.id)
+        try:
+            yield 'retry: 5000\n\n'
+            current = await sync_to_async(get_data_version)(user.id)
+            if seen_version and seen_version != str(current):
+                # Something changed between the page render and connecting
+                yield await sync_to_async(build_totals)()
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + EVENTS_MAX_AGE
+            while loop.time() < deadline:
+                change = await subscription.next_change(EVENTS_HEARTBEAT)
+                if change is None:
+                    yield ': keep-alive\n\n'
+                elif change.affects(month_date):
+                    yield await sync_to_async(build_totals)()
+                elif change.balances:
+                    yield await sync_to_async(build_net_worth)()
+        finally:
+            hub.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@user_passes_test(lambda u: u.is_staff)
+def dashboard_cache_stats(request):
+    """Hit/miss counters of the dashboard cache for this worker process."""
+    return JsonResponse(get_cache_stats())
+
+
+@user_passes_test(lambda u: u.is_staff)
+def metrics_view(request):
+    """Request, SQL and span metrics of this worker process, for Prometheus."""
+    return HttpResponse(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@user_passes_test(lambda u: u.is_staff)
+def profile_list(request):
+    """The saved request profiles, newest first."""
+    return render(request, 'dashboard/profiles.html', {
+        'profiles': list_profiles(),
+        'enabled': getattr(settings, 'REQUEST_PROFILING_ENABLED', False),
+        'sample_rate': getattr(settings, 'REQUEST_PROFILING_SAMPLE_RATE', 0.0),
+    })
+
+
+@user_passes_test(lambda u: u.is_staff)
+def profile_download(request, profile_id, kind):
+    """A profile's cProfile stats ('prof') or query log ('sql')."""
+    path = profile_path(profile_id, kind)
+    if path is None or not path.exists():
+        raise Http404('No such profile')
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name,
+                        content_type=PROFILE_FILES[kind][1])
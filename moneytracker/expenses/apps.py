@@ -7,3 +7,13 @@ class ExpensesConfig(AppConfig):
 
     def ready(self):
         import expenses.signals
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        from .metrics import install_sql_wrapper
+        from .rollups import backfill_year_month_after_migrate
+        from .search import create_search_index
+        post_migrate.connect(create_search_index, sender=self)
+        # Month filters and rollups read year_month; rows stored before the
+        # column was added would otherwise be missed
+        post_migrate.connect(backfill_year_month_after_migrate, sender=self)
+        connection_created.connect(install_sql_wrapper)
@@ -0,0 +1,172 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, reset_queries, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .feed import get_feed_page
+from .models import BankAccount, Category
+from .synthetic import generate_dataset
+
+# =============================
+# View benchmarks
+# =============================
+# Times the main views through the test client against generated data, at
+# one or more scales (transactions per user). Every timed request starts
+# from cold caches; the query count comes from an extra untimed run, so
+# capturing the SQL does not skew the timings. Results are plain dicts,
+# written as JSON by the benchmark_views command and compared between runs.
+
+BULK_ROWS = 50
+DEEP_PAGE = 2000
+
+
+def _consume(response):
+    """Reads a streaming response to the end, as a client would."""
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def _add_bulk(client, context):
+    # Rolled back, so every run inserts into the same data
+    with transaction.atomic():
+        response = client.post(
+            reverse('add_bulk_transactions'),
+            json.dumps({'transactions': context['bulk_rows'], 'duplicates': 'allow'}),
+            content_type='application/json',
+        )
+        transaction.set_rollback(True)
+    return response
+
+
+# name: request(client, context)
+BENCHMARKS = {
+    'dashboard_view': lambda client, context: client.get(reverse('dashboard'), context['month']),
+    'dashboard_live_data': lambda client, context: client.get(reverse('dashboard_live_data'), context['month']),
+    'transactions_view': lambda client, context: client.get(reverse('transactions')),
+    'transactions_view_deep_page': lambda client, context: client.get(
+        reverse('transactions'), {'after': context['deep_cursor']} if context['deep_cursor'] else {}
+    ),
+    'transactions_view_csv': lambda client, context: client.get(reverse('transactions'), {'export': 'csv'}),
+    'budget_list': lambda client, context: client.get(reverse('budget_list')),
+    'budget_manage': lambda client, context: client.get(reverse('budget_edit', args=[context['month_str']])),
+    'add_bulk_transactions': _add_bulk,
+}
+
+
+def _clear_caches():
+    for alias in settings.CACHES:
+        caches[alias].clear()
+
+
+def _context(user):
+    today = timezone.localdate()
+    account = BankAccount.objects.filter(user=user, account_type='checking').first()
+    category = Category.objects.filter(user=user, type='expense').first()
+    deep = get_feed_page(user, page_size=DEEP_PAGE)
+    return {
+        'month': {'year': today.year, 'month': today.month},
+        'month_str': today.strftime('%Y-%m'),
+        'deep_cursor': deep.next_cursor,
+        'bulk_rows': [
+            {'type': 'expense', 'date': today.isoformat(), 'amount': f'{5 + i % 40}.{i % 100:02d}',
+             'description': f'Benchmark row {i}', 'account_id': account.pk, 'category_id': category.pk}
+            for i in range(BULK_ROWS)
+        ],
+    }
+
+
+def time_view(name, client, context, repeat=5):
+    """
+    {'view', 'runs', 'median_ms', 'mean_ms', 'min_ms', 'max_ms', 'queries',
+    'status'} for repeat cold-cache runs of the named benchmark.
+    """
+    request = BENCHMARKS[name]
+    _clear_caches()
+    # The query log is capped; begin from empty so the capture's offsets hold
+    reset_queries()
+    with CaptureQueriesContext(connection) as captured:
+        status = _consume(request(client, context)).status_code
+    # Read from the log, which the next request empties
+    queries = len(captured)
+
+    timings = []
+    for _ in range(repeat):
+        _clear_caches()
+        started = time.perf_counter()
+        _consume(request(client, context))
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        'view': name,
+        'runs': repeat,
+        'median_ms': round(statistics.median(timings), 2),
+        'mean_ms': round(statistics.mean(timings), 2),
+        'min_ms': round(min(timings), 2),
+        'max_ms': round(max(timings), 2),
+        'queries': queries,
+        'status': status,
+    }
+
+
+def run_benchmarks(scales, users=2, months=24, repeat=5, seed=0, views=None, progress=None):
+    """
+    Generates users users at each scale (transactions per user) and times
+    the views (default: all of BENCHMARKS) as the first of them. Returns
+    one result dict per (scale, view), with the scale added; progress, if
+    given, is called with each one as it is done.
+    """
+    results = []
+    for scale in scales:
+        created = generate_dataset(users, scale, months, seed, prefix=f'bench{scale}_')
+        client = Client()
+        client.force_login(created[0])
+        context = _context(created[0])
+        for name in views or BENCHMARKS:
+            result = {'scale': scale, **time_view(name, client, context, repeat)}
+            results.append(result)
+            if progress:
+                progress(result)
+    return results
+
+
+def run_metadata(**options):
+    """Where and how a run was made, stored next to its results."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'created': timezone.now().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'machine': platform.machine(),
+        **options,
+    }
+
+
+def compare_results(old, new):
+    """
+    [(scale, view, old median, new median, change)] for the (scale, view)
+    pairs in both runs' results; change is new / old - 1.
+    """
+    before = {(result['scale'], result['view']): result['median_ms'] for result in old}
+    rows = []
+    for result in new:
+        key = (result['scale'], result['view'])
+        if key in before:
+            change = result['median_ms'] / before[key] - 1 if before[key] else None
+            rows.append((*key, before[key], result['median_ms'], change))
+    return rows
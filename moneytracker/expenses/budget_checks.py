@@ -0,0 +1,57 @@
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+from .services import check_month_budgets
+
+_local = threading.local()
+
+
+class _Batch:
+    """The keys queued in one transaction, checked by one on_commit callback."""
+
+    def __init__(self, hooks):
+        # The connection's callback list when the flush was registered
+        self.hooks = hooks
+        self.keys = set()
+        self.done = False
+
+    def flush(self):
+        self.done = True
+        run_budget_checks(self.keys)
+
+
+def _current_batch():
+    # A commit or rollback (of the transaction, or of a savepoint) replaces
+    # the connection's list of on_commit callbacks, so a batch registered on
+    # another list was either flushed or dropped along with its callback:
+    # keys of a rolled-back transaction are never checked.
+    hooks = transaction.get_connection().run_on_commit
+    batch = getattr(_local, 'batch', None)
+    if batch is None or batch.done or batch.hooks is not hooks:
+        batch = _local.batch = _Batch(hooks)
+        transaction.on_commit(batch.flush)
+    return batch
+
+
+def schedule_budget_check(user_id, month, category_id):
+    """
+    Queues a budget check for (user, month, category) to run once the
+    current transaction commits (immediately in autocommit mode).
+    Any number of writes to the same key in one transaction cost one check.
+    """
+    key = (user_id, month, category_id)
+    if not transaction.get_connection().in_atomic_block:
+        run_budget_checks({key})
+    else:
+        _current_batch().keys.add(key)
+
+
+def run_budget_checks(keys):
+    """Runs the checks for keys, grouped into one pass per (user, month)."""
+    by_month = defaultdict(set)
+    for user_id, month, category_id in keys:
+        by_month[(user_id, month)].add(category_id)
+
+    for (user_id, month), category_ids in by_month.items():
+        check_month_budgets(user_id, month, category_ids)
@@ -0,0 +1,245 @@
+from collections import Counter
+
+from django import forms
+from django.db.models import Count
+from .forms import ExpenseForm, IncomeForm
+from .metrics import span
+from .ledger import balance_ledger, expense_effect, income_effect
+from .models import Expense, Income, BankAccount, Category, year_month_key
+from .rollups import apply_rows, rollup_key
+from .budget_checks import schedule_budget_check
+from .data_version import bump_data_version
+from .events import publish_change
+from .search import index_objects
+from .categorizer import record_category_changes
+
+# Per type: model, form (for its field definitions) and the text field the
+# front-end 'description' maps onto.
+BULK_TYPES = {
+    'expense': (Expense, ExpenseForm, 'description'),
+    'income': (Income, IncomeForm, 'source'),
+}
+
+# How rows already stored (same fingerprint) are handled
+DUPLICATE_MODES = ('flag', 'skip', 'allow')
+
+
+class BulkValidator:
+    """
+    Validates bulk rows the way ExpenseForm/IncomeForm would, with the same
+    error messages, but against lookup maps loaded once for the whole batch
+    instead of two queryset lookups per row.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.accounts = BankAccount.objects.filter(user=user).in_bulk()
+        self.categories = {'expense': {}, 'income': {}}
+        for category in Category.objects.filter(user=user, type__in=['expense', 'income']):
+            self.categories[category.type][category.pk] = category
+
+    def _choice(self, field, value, choices):
+        if value in field.empty_values:
+            if field.required:
+                raise forms.ValidationError(field.error_messages['required'], code='required')
+            return None
+        try:
+            return choices[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise forms.ValidationError(field.error_messages['invalid_choice'], code='invalid_choice')
+
+    def validate(self, t_type, item):
+        """
+        Returns (unsaved instance, None) or (None, "field: error, ...").
+        """
+        model, form_class, text_field = BULK_TYPES[t_type]
+        data = {
+            'amount': item.get('amount'),
+            'date': item.get('date'),
+            'category': item.get('category_id'),
+            'account': item.get('account_id'),
+            text_field: item.get('description'),
+        }
+
+        cleaned = {}
+        field_errors = []
+        # Form field order, so messages match what the forms produced
+        for name in form_class._meta.fields:
+            field = form_class.base_fields[name]
+            try:
+                if name == 'category':
+                    cleaned[name] = self._choice(field, data[name], self.categories[t_type])
+                elif name == 'account':
+                    cleaned[name] = self._choice(field, data[name], self.accounts)
+                else:
+                    cleaned[name] = field.clean(data[name])
+            except forms.ValidationError as e:
+                field_errors.append(f"{name}: {e.messages[0]}")
+
+        if field_errors:
+            return None, ", ".join(field_errors)
+
+        obj = model(user=self.user, **cleaned)
+        # bulk_create skips save(), which keeps these in step
+        obj.year_month = year_month_key(obj.date)
+        obj.fingerprint = obj.compute_fingerprint()
+        return obj, None
+
+
+@span('ingest_transactions')
+def ingest_transactions(user, transactions_list, duplicates='flag'):
+    """
+    Validates and inserts a batch of bulk rows, all or nothing.
+    Returns (saved_count, errors, duplicate_report); nothing is written if
+    errors is non-empty.
+
+    Rows matching an already stored transaction (see split_duplicates)
+    are handled per duplicates: 'flag' reports them as errors, so nothing
+    is written, 'skip' leaves them out and inserts the rest, 'allow'
+    inserts them anyway. duplicate_report has one line per matched row.
+    """
+    new_rows, row_errors = validate_transactions(BulkValidator(user), transactions_list)
+    if row_errors:
+        return 0, [f"Row {index + 1}: {error}" for index, error in row_errors], []
+
+    report = []
+    if duplicates != 'allow':
+        new_rows, matched = split_duplicates(user, new_rows)
+        report = [f"Row {index + 1}: {describe_duplicate(obj)}" for index, obj in matched]
+        if matched and duplicates == 'flag':
+            return 0, report, report
+    return insert_transactions(user, new_rows), [], report
+
+
+def validate_transactions(validator, transactions_list):
+    """
+    Validates bulk rows. Returns ({type: [unsaved instances]}, errors) with
+    errors as (index in transactions_list, message) pairs. Each instance
+    remembers its index as _bulk_index.
+    """
+    new_rows = {'expense': [], 'income': []}
+    errors = []
+
+    for index, item in enumerate(transactions_list):
+        t_type = item.get('type')
+        if t_type not in BULK_TYPES:
+            errors.append((index, f"Invalid type '{t_type}'"))
+            continue
+
+        obj, error = validator.validate(t_type, item)
+        if error:
+            errors.append((index, error))
+        else:
+            obj._bulk_index = index
+            new_rows[t_type].append(obj)
+
+    return new_rows, errors
+
+
+def split_duplicates(user, new_rows):
+    """
+    Separates validated rows that are already stored, by fingerprint, with
+    one query for the whole batch. Returns (new_rows without them,
+    [(_bulk_index, instance)] of the matches).
+
+    Matching counts occurrences: if a statement legitimately has the same
+    purchase twice and one copy is stored, only one of the two is a match.
+    """
+    fingerprints = {obj.fingerprint for rows in new_rows.values() for obj in rows}
+    if not fingerprints:
+        return new_rows, []
+
+    stored = Counter()
+    querysets = [
+        model.objects.filter(user=user, fingerprint__in=fingerprints)
+        .values('fingerprint').annotate(n=Count('id')).values_list('fingerprint', 'n')
+        for model, _, _ in BULK_TYPES.values()
+    ]
+    for fingerprint, n in querysets[0].union(*querysets[1:], all=True):
+        stored[fingerprint] += n
+
+    fresh = {t_type: [] for t_type in new_rows}
+    matched = []
+    for t_type, rows in new_rows.items():
+        for obj in rows:
+            if stored[obj.fingerprint] > 0:
+                stored[obj.fingerprint] -= 1
+                matched.append((obj._bulk_index, obj))
+            else:
+                fresh[t_type].append(obj)
+    matched.sort(key=lambda pair: pair[0])
+    return fresh, matched
+
+
+def describe_duplicate(obj):
+    text = getattr(obj, BULK_TYPES[obj.FINGERPRINT_KIND][2]) or ''
+    return f"duplicate of an existing {obj.FINGERPRINT_KIND} ({obj.date}, {obj.amount:.2f}, '{text}')"
+
+
+def rebuild_fingerprints(user=None, chunk_size=2000):
+    """
+    Recomputes stored fingerprints (rows saved before the column existed,
+    or left stale when their account was deleted). Returns rows changed.
+    """
+    changed = 0
+    for model, _, text_field in BULK_TYPES.values():
+        qs = model.objects.only('id', 'user_id', 'account_id', 'date', 'amount', text_field, 'fingerprint')
+        if user is not None:
+            qs = qs.filter(user=user)
+        stale = []
+        for obj in qs.iterator(chunk_size=chunk_size):
+            fingerprint = obj.compute_fingerprint()
+            if obj.fingerprint != fingerprint:
+                obj.fingerprint = fingerprint
+                stale.append(obj)
+            if len(stale) >= chunk_size:
+                model.objects.bulk_update(stale, ['fingerprint'])
+                changed += len(stale)
+                stale = []
+        model.objects.bulk_update(stale, ['fingerprint'])
+        changed += len(stale)
+    return changed
+
+
+def insert_transactions(user, new_rows):
+    """
+    Inserts validated rows (as returned by validate_transactions) in one
+    transaction and returns how many were saved.
+
+    Rows are inserted with bulk_create, balances get one combined update per
+    account, the monthly rollup one update per bucket, and budget checks
+    are queued once per affected (month, category).
+    """
+    if not new_rows['expense'] and not new_rows['income']:
+        return 0
+
+    with balance_ledger() as ledger:
+        for obj in Expense.objects.bulk_create(new_rows['expense'], batch_size=500):
+            expense_effect(ledger, obj)
+        for obj in Income.objects.bulk_create(new_rows['income'], batch_size=500):
+            income_effect(ledger, obj)
+
+        # bulk_create skips the model signals, so keep the rollup, the
+        # search index and the categorizer in step here
+        apply_rows('expense', new_rows['expense'])
+        apply_rows('income', new_rows['income'])
+        index_objects('expense', new_rows['expense'], replace=False)
+        index_objects('income', new_rows['income'], replace=False)
+        for t_type, (model, form_class, text_field) in BULK_TYPES.items():
+            record_category_changes(user.id, t_type, [
+                (getattr(obj, text_field), obj.category_id, 1) for obj in new_rows[t_type]
+            ])
+
+        # Budgets only depend on expenses; checks are coalesced per month
+        # and run after commit
+        for key in {rollup_key(obj) for obj in new_rows['expense']}:
+            schedule_budget_check(*key)
+
+        bump_data_version(user.id)
+        publish_change(
+            user.id,
+            months={rollup_key(obj)[1] for obj in new_rows['expense'] + new_rows['income']},
+            balances=True
+        )
+
+    return len(new_rows['expense']) + len(new_rows['income'])
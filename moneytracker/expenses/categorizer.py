@@ -0,0 +1,235 @@
+import math
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from .models import Expense, Income
+from .search import tokenize
+
+# =============================
+# Category suggestions
+# =============================
+# Learns each user's categories from their own descriptions/sources: an
+# index of whole descriptions (the same merchant text usually gets the same
+# category) backed by naive Bayes over the words. Models live in an
+# in-process LRU per user, are updated incrementally by the save/delete
+# signals and the bulk path once the write commits, and are rebuilt from the
+# database when the model is older than CATEGORIZER_MAX_AGE and missed
+# changes made by other processes. Missed changes are told apart by a
+# per-user counter in the shared cache, moved by every change the models
+# learn from (and nothing else), so other writes never cost a rebuild.
+
+# kind -> (model, text field)
+CATEGORIZER_SOURCES = {
+    'expense': (Expense, 'description'),
+    'income': (Income, 'source'),
+}
+
+_models = OrderedDict()
+_models_lock = threading.Lock()
+
+
+def features(text):
+    """Words used to categorize text: search tokens minus pure numbers."""
+    # Reference numbers and dates would otherwise make every row unique
+    return [token for token in tokenize(text) if not token.isdigit()]
+
+
+def _add(counter, key, count):
+    total = counter[key] + count
+    if total > 0:
+        counter[key] = total
+    else:
+        del counter[key]
+
+
+class CategoryModel:
+    """Word and whole-description counts per category, for one kind."""
+
+    def __init__(self):
+        self.docs = Counter()  # category -> rows
+        self.word_totals = Counter()  # category -> words over all its rows
+        self.words = defaultdict(Counter)  # word -> category -> rows
+        self.merchants = defaultdict(Counter)  # all words joined -> category -> rows
+
+    def learn(self, text, category_id, count=1):
+        """Adds (count=1) or removes (count=-1) one categorized row."""
+        if category_id is None:
+            return
+        words = features(text)
+        _add(self.docs, category_id, count)
+        _add(self.word_totals, category_id, count * len(words))
+        for word in words:
+            _add(self.words[word], category_id, count)
+            if not self.words[word]:
+                del self.words[word]
+        if words:
+            merchant = ' '.join(words)
+            _add(self.merchants[merchant], category_id, count)
+            if not self.merchants[merchant]:
+                del self.merchants[merchant]
+
+    def predict(self, text):
+        """(category_id, confidence between 0 and 1), or (None, 0)."""
+        words = features(text)
+        if not words or not self.docs:
+            return None, 0.0
+
+        merchant = self.merchants.get(' '.join(words))
+        if merchant:
+            category_id, count = merchant.most_common(1)[0]
+            return category_id, count / sum(merchant.values())
+
+        known = [self.words[word] for word in words if word in self.words]
+        if not known:
+            return None, 0.0
+        total_docs = sum(self.docs.values())
+        vocabulary = len(self.words)
+        scores = {}
+        for category_id, docs in self.docs.items():
+            # Laplace-smoothed log likelihood of the known words
+            denominator = self.word_totals[category_id] + vocabulary
+            score = math.log(docs / total_docs)
+            for counts in known:
+                score += math.log((counts.get(category_id, 0) + 1) / denominator)
+            scores[category_id] = score
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        return best, 1 / sum(math.exp(score - top) for score in scores.values())
+
+
+class UserCategorizer:
+    """One user's models (one per kind), safe to share between threads."""
+
+    def __init__(self, version):
+        self.version = version
+        self.checked = time.monotonic()
+        self.models = {kind: CategoryModel() for kind in CATEGORIZER_SOURCES}
+        self._lock = threading.Lock()
+
+    def learn(self, kind, text, category_id, count=1):
+        with self._lock:
+            self.models[kind].learn(text, category_id, count)
+
+    def predict(self, kind, text, min_confidence=None):
+        """
+        (category_id, confidence) for text, or (None, 0) when nothing scores
+        at least min_confidence (CATEGORIZER_MIN_CONFIDENCE by default).
+        """
+        if min_confidence is None:
+            min_confidence = getattr(settings, 'CATEGORIZER_MIN_CONFIDENCE', 0.6)
+        with self._lock:
+            category_id, confidence = self.models[kind].predict(text)
+        if category_id is None or confidence < min_confidence:
+            return None, 0.0
+        return category_id, confidence
+
+
+def _cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def categorizer_version_key(user_id):
+    return f'categorizer-version:{user_id}'
+
+
+def get_categorizer_version(user_id):
+    """The user's counter of categorizer changes, created if needed."""
+    key = categorizer_version_key(user_id)
+    version = _cache().get(key)
+    if version is None:
+        # Time based, like the data version, so a recreated counter never
+        # matches a model built before it was evicted
+        version = time.time_ns()
+        if not _cache().add(key, version, timeout=None):
+            version = _cache().get(key, version)
+    return version
+
+
+def _bump_categorizer_version(user_id):
+    """Moves the counter on by one; returns the new value."""
+    key = categorizer_version_key(user_id)
+    try:
+        return _cache().incr(key)
+    except ValueError:
+        version = time.time_ns()
+        _cache().set(key, version, timeout=None)
+        return version
+
+
+def _build(user_id, version):
+    categorizer = UserCategorizer(version)
+    for kind, (model, text_field) in CATEGORIZER_SOURCES.items():
+        rows = model.objects.filter(user_id=user_id, category__isnull=False).values_list(text_field, 'category_id')
+        target = categorizer.models[kind]
+        for text, category_id in rows.iterator(chunk_size=5000):
+            target.learn(text, category_id)
+    return categorizer
+
+
+def get_categorizer(user_id):
+    """The user's cached categorizer, built or refreshed as needed."""
+    with _models_lock:
+        categorizer = _models.get(user_id)
+        if categorizer is not None:
+            _models.move_to_end(user_id)
+
+    now = time.monotonic()
+    if categorizer is not None and now - categorizer.checked < getattr(settings, 'CATEGORIZER_MAX_AGE', 600):
+        return categorizer
+
+    version = get_categorizer_version(user_id)
+    if categorizer is not None and categorizer.version == version:
+        categorizer.checked = now
+        return categorizer
+
+    categorizer = _build(user_id, version)
+    with _models_lock:
+        _models[user_id] = categorizer
+        _models.move_to_end(user_id)
+        while len(_models) > getattr(settings, 'CATEGORIZER_CACHE_SIZE', 256):
+            _models.popitem(last=False)
+    return categorizer
+
+
+def suggest_category(user_id, kind, text):
+    """(category_id, confidence) for one new row, or (None, 0)."""
+    return get_categorizer(user_id).predict(kind, text)
+
+
+def forget_categorizer(user_id):
+    """
+    Drops the user's cached models (e.g. after a category is deleted),
+    here and, after CATEGORIZER_MAX_AGE, in other processes.
+    """
+    with _models_lock:
+        _models.pop(user_id, None)
+    _bump_categorizer_version(user_id)
+
+
+def _apply_changes(user_id, kind, changes):
+    # Moved even if the models are not loaded here: other processes must
+    # see the change
+    version = _bump_categorizer_version(user_id)
+    with _models_lock:
+        categorizer = _models.get(user_id)
+    # Nothing to update if the models are not loaded; they are built from
+    # the committed rows when first needed
+    if categorizer is not None:
+        for text, category_id, count in changes:
+            categorizer.learn(kind, text, category_id, count)
+        if categorizer.version == version - 1:
+            # Up to date with every change so far, this one included
+            categorizer.version = version
+
+
+def record_category_changes(user_id, kind, changes):
+    """
+    Queues (text, category_id, +1/-1) changes to the user's model, applied
+    once the current transaction commits.
+    """
+    if changes:
+        transaction.on_commit(lambda: _apply_changes(user_id, kind, changes))
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def _cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def data_version_key(user_id):
+    return f'data-version:{user_id}'
+
+
+def _fresh_version():
+    # Time based, so a version recreated after eviction never matches
+    # anything cached under an older one.
+    return time.time_ns()
+
+
+def get_data_version(user_id):
+    """
+    Returns the user's current data version, creating it if needed.
+    Every write to the user's transactions, accounts or categories moves it.
+    """
+    key = data_version_key(user_id)
+    version = _cache().get(key)
+    if version is None:
+        version = _fresh_version()
+        if not _cache().add(key, version, timeout=None):
+            version = _cache().get(key, version)
+    return version
+
+
+def bump_data_version(user_id):
+    """
+    Moves the user's data version once the current transaction commits,
+    so nothing can be cached against uncommitted data.
+    """
+    def bump():
+        key = data_version_key(user_id)
+        try:
+            _cache().incr(key)
+        except ValueError:
+            _cache().set(key, _fresh_version(), timeout=None)
+
+    transaction.on_commit(bump)
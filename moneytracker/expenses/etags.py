@@ -0,0 +1,71 @@
+import asyncio
+import hashlib
+from datetime import date
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from .data_version import get_data_version
+
+
+def user_data_etag(request, *args, **kwargs):
+    """
+    ETag for pages built only from the requesting user's data.
+
+    Combines the user's data version (one cache lookup) with the path and
+    the sorted query parameters, so every month, filter set and page has
+    its own validator. Today's date covers the "current month" defaults and
+    the CSRF cookie keeps a cached form from outliving its token.
+    """
+    if not request.user.is_authenticated:
+        return None
+    # Pending flash messages must be rendered, never answered with a 304
+    if len(messages.get_messages(request)):
+        return None
+
+    parts = [
+        request.path,
+        str(request.user.id),
+        str(get_data_version(request.user.id)),
+        date.today().isoformat(),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+    ]
+    for key, values in sorted(request.GET.lists()):
+        parts.append(f'{key}={",".join(values)}')
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def conditional_on_user_data(view_func):
+    """
+    Answers 304 Not Modified, without calling the view, when the client's
+    If-None-Match still matches user_data_etag. Responses are marked
+    private and must be revalidated on every use. Works on async views too.
+    """
+    if asyncio.iscoroutinefunction(view_func):
+        return _async_conditional(view_func)
+    conditional_view = cache_control(private=True, no_cache=True)(
+        condition(etag_func=user_data_etag)(view_func)
+    )
+    return wraps(view_func)(conditional_view)
+
+
+def _async_conditional(view_func):
+    # Django 4.2's condition() and cache_control() only wrap sync views
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        etag = await sync_to_async(user_data_etag)(request, *args, **kwargs)
+        response = None
+        if etag:
+            etag = quote_etag(etag)
+            response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await view_func(request, *args, **kwargs)
+            if etag and request.method in ('GET', 'HEAD') and not response.has_header('ETag'):
+                response.headers['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    return wrapper
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+
+_local = threading.local()
+
+
+class Change:
+    """What changed for one user since a subscriber last looked."""
+
+    def __init__(self):
+        self.months = set()
+        self.all_months = False
+        self.balances = False
+
+    def merge(self, months=None, all_months=False, balances=False):
+        if months:
+            self.months |= set(months)
+        self.all_months = self.all_months or all_months
+        self.balances = self.balances or balances
+
+    def affects(self, month):
+        """True if the totals of month (a first-of-month date) may differ."""
+        return self.all_months or month in self.months
+
+
+class Subscription:
+    """
+    One listener (e.g. an open event stream) for one user's changes.
+    Changes published while the listener is busy are merged, so a burst of
+    writes wakes it once.
+    """
+
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._lock = threading.Lock()
+        self._change = Change()
+
+    def _deliver(self, months, all_months, balances):
+        # Called from whichever thread committed the write
+        with self._lock:
+            self._change.merge(months, all_months, balances)
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # The subscriber's event loop is gone
+            pass
+
+    async def next_change(self, timeout=None):
+        """
+        Waits for the next change and returns it as a Change, or None if
+        nothing happened within timeout seconds.
+        """
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._wakeup.clear()
+        with self._lock:
+            change, self._change = self._change, Change()
+        return change
+
+
+class ChangeHub:
+    """
+    In-process publish/subscribe of per-user data changes. Only reaches
+    subscribers in the same process as the writer.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        """Must be called from the event loop that will await the subscription."""
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id, months=None, all_months=False, balances=False):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription._deliver(months, all_months, balances)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+
+hub = ChangeHub()
+
+
+class _Batch:
+    """The changes queued in one transaction, published by one on_commit callback."""
+
+    def __init__(self, hooks):
+        # The connection's callback list when the flush was registered
+        self.hooks = hooks
+        self.changes = {}
+        self.done = False
+
+    def flush(self):
+        self.done = True
+        for user_id, change in self.changes.items():
+            hub.publish(user_id, change.months, change.all_months, change.balances)
+
+
+def _current_batch():
+    # Same bookkeeping as the budget checks: a commit or rollback replaces
+    # the connection's list of on_commit callbacks, so changes of a
+    # rolled-back transaction go with their dropped callback
+    hooks = transaction.get_connection().run_on_commit
+    batch = getattr(_local, 'batch', None)
+    if batch is None or batch.done or batch.hooks is not hooks:
+        batch = _local.batch = _Batch(hooks)
+        transaction.on_commit(batch.flush)
+    return batch
+
+
+def publish_change(user_id, months=None, all_months=False, balances=False):
+    """
+    Queues a change event for the user, published to the hub once the
+    current transaction commits (immediately in autocommit mode). months
+    are first-of-month dates whose totals changed; all_months for changes
+    such as a category rename; balances when account balances (and so net
+    worth) may have moved.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        hub.publish(user_id, months, all_months, balances)
+        return
+    changes = _current_batch().changes
+    changes.setdefault(user_id, Change()).merge(months, all_months, balances)
@@ -0,0 +1,387 @@
+from datetime import date
+import heapq
+from decimal import Decimal
+from itertools import islice
+
+from django.db import connections
+from django.db.models import Q, F, Value, IntegerField
+from .metrics import span
+from .models import Expense, Income, Transfer, BankAccount, Category
+from .search import SEARCH_SOURCES, has_hits, ranked_hits, search_filter
+
+PAGE_SIZE = 10
+
+# Rows from different tables can share (date, id), so each table gets a fixed
+# rank that breaks the tie and keeps the keyset order total.
+KIND_RANKS = {'expense': 0, 'income': 1, 'transfer': 2}
+KIND_NAMES = {rank: kind for kind, rank in KIND_RANKS.items()}
+
+# Rows fetched per round trip when streaming the whole feed.
+EXPORT_CHUNK_SIZE = 2000
+
+# Search hits checked against the other filters per round trip.
+RANKED_BATCH_SIZE = 200
+
+
+def _base_querysets(user, account_id=None, category_id=None, transaction_type=None, search_query=None, start_date=None, end_date=None, indexed=None):
+    """
+    Returns {kind: queryset} for the tables included by the filters.
+    Transfers are dropped when filtering by category since they have none.
+    indexed is _uses_index(user, search_query), if already known.
+    """
+    expense_qs = Expense.objects.filter(user=user)
+    income_qs = Income.objects.filter(user=user)
+    transfer_qs = Transfer.objects.filter(user=user)
+
+    if account_id:
+        expense_qs = expense_qs.filter(account_id=account_id)
+        income_qs = income_qs.filter(account_id=account_id)
+        transfer_qs = transfer_qs.filter(Q(from_account_id=account_id) | Q(to_account_id=account_id))
+
+    if start_date:
+        expense_qs = expense_qs.filter(date__gte=start_date)
+        income_qs = income_qs.filter(date__gte=start_date)
+        transfer_qs = transfer_qs.filter(date__gte=start_date)
+
+    if end_date:
+        expense_qs = expense_qs.filter(date__lte=end_date)
+        income_qs = income_qs.filter(date__lte=end_date)
+        transfer_qs = transfer_qs.filter(date__lte=end_date)
+
+    if search_query:
+        if indexed is None:
+            indexed = _uses_index(user, search_query)
+        expense_qs = _search(expense_qs, 'expense', user, search_query, indexed)
+        income_qs = _search(income_qs, 'income', user, search_query, indexed)
+        transfer_qs = _search(transfer_qs, 'transfer', user, search_query, indexed)
+
+    querysets = {}
+    if transaction_type not in ['income', 'transfer']:
+        querysets['expense'] = expense_qs
+    if transaction_type not in ['expense', 'transfer']:
+        querysets['income'] = income_qs
+    # Transfers don't have categories
+    if transaction_type not in ['expense', 'income'] and not category_id:
+        querysets['transfer'] = transfer_qs
+
+    if category_id:
+        for kind in ('expense', 'income'):
+            if kind in querysets:
+                querysets[kind] = querysets[kind].filter(category_id=category_id)
+
+    return querysets
+
+
+def _uses_index(user, search_query):
+    """
+    True if search_query is answered by the search index, which matches
+    word prefixes. Queries without indexable words (only punctuation) or
+    without any hit in the index fall back to a substring match, so a part
+    of a word ('bucks' in 'Starbucks') still finds it.
+    """
+    return has_hits(user.pk, search_query, list(SEARCH_SOURCES))
+
+
+def _search(qs, kind, user, search_query, indexed):
+    """Restricts qs to rows matching search_query."""
+    if not indexed:
+        return qs.filter(**{f'{SEARCH_SOURCES[kind][1]}__icontains': search_query})
+    return qs.filter(search_filter(kind, user.pk, search_query, qs.db))
+
+
+def _feed_columns(kind, qs):
+    """
+    Projects a table onto the common feed columns.
+    Everything is an annotation so the SELECT order is identical across
+    the three tables, which UNION ALL requires.
+    """
+    null_id = Value(None, output_field=IntegerField())
+    if kind == 'expense':
+        columns = dict(f_category=F('category_id'), f_account=F('account_id'), f_to_account=null_id, f_text=F('description'))
+    elif kind == 'income':
+        columns = dict(f_category=F('category_id'), f_account=F('account_id'), f_to_account=null_id, f_text=F('source'))
+    else:
+        columns = dict(f_category=null_id, f_account=F('from_account_id'), f_to_account=F('to_account_id'), f_text=F('description'))
+
+    qs = qs.order_by().annotate(
+        f_rank=Value(KIND_RANKS[kind], output_field=IntegerField()),
+        f_id=F('id'),
+        f_date=F('date'),
+        f_amount=F('amount'),
+        **columns
+    )
+    return qs.values_list('f_rank', 'f_id', 'f_date', 'f_amount', 'f_category', 'f_account', 'f_to_account', 'f_text')
+
+
+def encode_cursor(row):
+    """Cursor for a hydrated feed row: '<date>_<id>_<rank>'."""
+    return f"{row['date'].isoformat()}_{row['id']}_{KIND_RANKS[row['type']]}"
+
+
+def decode_cursor(cursor):
+    """Returns (date, id, rank) or None for a missing/garbled cursor."""
+    if not cursor:
+        return None
+    try:
+        day, pk, rank = cursor.split('_')
+        return date.fromisoformat(day), int(pk), int(rank)
+    except ValueError:
+        return None
+
+
+def _keyset_filter(qs, rank, cursor, forward):
+    """
+    Restricts one table to rows strictly after (forward) or before the cursor
+    in the (-date, -id, -rank) feed order.
+    """
+    c_date, c_id, c_rank = cursor
+    if forward:
+        cond = Q(date__lt=c_date) | Q(date=c_date, id__lt=c_id)
+        if rank < c_rank:
+            cond |= Q(date=c_date, id=c_id)
+    else:
+        cond = Q(date__gt=c_date) | Q(date=c_date, id__gt=c_id)
+        if rank > c_rank:
+            cond |= Q(date=c_date, id=c_id)
+    return qs.filter(cond)
+
+
+def _union(querysets):
+    parts = list(querysets)
+    if len(parts) == 1:
+        return parts[0]
+    return parts[0].union(*parts[1:], all=True)
+
+
+class FeedPage:
+    """
+    One keyset page of the unified feed.
+    Iterates like a Paginator page so templates can loop over it directly.
+    """
+
+    def __init__(self, object_list, has_next, has_previous, cursors=None):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        if cursors is not None:
+            self.next_cursor, self.previous_cursor = cursors
+        else:
+            self.next_cursor = encode_cursor(object_list[-1]) if object_list and has_next else None
+            self.previous_cursor = encode_cursor(object_list[0]) if object_list and has_previous else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+def _make_row(user, raw, categories, accounts):
+    """Turns one raw feed tuple into the dict the templates expect."""
+    rank, pk, day, amount, category_id, account_id, to_account_id, text = raw
+    kind = KIND_NAMES[rank]
+    category = categories.get(category_id)
+    if kind == 'income':
+        description = text if text else (category.name if category else 'Income')
+    elif kind == 'transfer':
+        description = text or 'Transfer'
+    else:
+        description = text
+    row = {
+        'id': pk,
+        'type': kind,
+        'date': day,
+        'amount': amount,
+        'category': category,
+        'description': description,
+        'user': user,
+        'account': accounts.get(account_id),
+    }
+    if kind == 'transfer':
+        row['to_account'] = accounts.get(to_account_id)
+    return row
+
+
+def _hydrate(user, rows):
+    """Hydrates a page of raw feed tuples with two in_bulk lookups."""
+    category_ids = {r[4] for r in rows if r[4]}
+    account_ids = {r[5] for r in rows if r[5]} | {r[6] for r in rows if r[6]}
+    categories = Category.objects.in_bulk(category_ids) if category_ids else {}
+    accounts = BankAccount.objects.in_bulk(account_ids) if account_ids else {}
+    return [_make_row(user, raw, categories, accounts) for raw in rows]
+
+
+@span('get_feed_page')
+def get_feed_page(user, after=None, before=None, page_size=PAGE_SIZE, **filters):
+    """
+    Returns a FeedPage of the user's transactions, newest first.
+    The three tables are merged with UNION ALL in the database and cut with
+    a keyset cursor, so only page_size + 1 rows are ever read. A search
+    query switches to relevance order (see _ranked_page).
+    """
+    indexed = bool(filters.get('search_query')) and _uses_index(user, filters['search_query'])
+    if indexed:
+        return _ranked_page(user, after, before, page_size, **filters)
+
+    querysets = _base_querysets(user, indexed=indexed, **filters)
+    if not querysets:
+        return FeedPage([], False, False)
+
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before) if not after_key else None
+    cursor = after_key or before_key
+    forward = before_key is None
+
+    parts = []
+    for kind, qs in querysets.items():
+        if cursor:
+            qs = _keyset_filter(qs, KIND_RANKS[kind], cursor, forward)
+        parts.append(_feed_columns(kind, qs))
+
+    feed = _union(parts)
+    if forward:
+        feed = feed.order_by('-f_date', '-f_id', '-f_rank')
+    else:
+        feed = feed.order_by('f_date', 'f_id', 'f_rank')
+
+    rows = list(feed[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if not forward:
+        rows.reverse()
+
+    transactions = _hydrate(user, rows)
+    if forward:
+        return FeedPage(transactions, has_next=has_more, has_previous=cursor is not None)
+    # Rows older than the page exist, starting at the cursor row; a page
+    # with no rows (a cursor at the newest row) has nothing to link on to
+    return FeedPage(transactions, has_next=bool(transactions), has_previous=has_more)
+
+
+def _iter_ranked(user, search_query, batch_size=RANKED_BATCH_SIZE, **filters):
+    """
+    Yields raw feed tuples of the search hits, best match first.
+
+    The index returns every hit in relevance order in one pass; the other
+    filters are then applied to batches of hits with one indexed id
+    lookup per table, so reading only the first pages stays cheap.
+    """
+    querysets = _base_querysets(user, search_query=None, **filters)
+    hits = ranked_hits(user.pk, search_query, list(querysets))
+    while True:
+        batch = list(islice(hits, batch_size))
+        if not batch:
+            return
+        ids_by_kind = {}
+        for kind, pk in batch:
+            ids_by_kind.setdefault(kind, []).append(pk)
+        found = {}
+        for kind, ids in ids_by_kind.items():
+            for raw in _feed_columns(kind, querysets[kind].filter(id__in=ids)):
+                found[(kind, raw[1])] = raw
+        for hit in batch:
+            if hit in found:
+                yield found[hit]
+
+
+def _offset(cursor):
+    try:
+        return max(0, int(cursor))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _ranked_page(user, after, before, page_size, search_query, **filters):
+    """
+    A page of search results, best match first. Relevance is not a stable
+    key, so the cursors here are offsets into the ranking.
+    """
+    if after:
+        start = _offset(after)
+    elif before:
+        start = max(0, _offset(before) - page_size)
+    else:
+        start = 0
+
+    rows = list(islice(_iter_ranked(user, search_query, **filters), start, start + page_size + 1))
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    cursors = (str(start + page_size) if has_next else None, str(start) if start else None)
+    return FeedPage(_hydrate(user, rows), has_next, start > 0, cursors)
+
+
+def iter_feed(user, chunk_size=EXPORT_CHUNK_SIZE, **filters):
+    """
+    Yields every filtered transaction, newest first (best match first when
+    searching), in constant memory. Each table is read in chunks with
+    .iterator() and the three sorted streams are merged in Python, so no
+    full list is ever built.
+    """
+    # Names are resolved from the user's own (small) lookup tables once.
+    categories = Category.objects.filter(user=user).in_bulk()
+    accounts = BankAccount.objects.filter(user=user).in_bulk()
+
+    indexed = bool(filters.get('search_query')) and _uses_index(user, filters['search_query'])
+    if indexed:
+        for raw in _iter_ranked(user, **filters):
+            yield _make_row(user, raw, categories, accounts)
+        return
+
+    querysets = _base_querysets(user, indexed=indexed, **filters)
+    if not querysets:
+        return
+
+    streams = [
+        _feed_columns(kind, qs).order_by('-f_date', '-f_id').iterator(chunk_size=chunk_size)
+        for kind, qs in querysets.items()
+    ]
+    merged = heapq.merge(*streams, key=lambda raw: (raw[2], raw[1], raw[0]), reverse=True)
+    for raw in merged:
+        yield _make_row(user, raw, categories, accounts)
+
+
+def _to_decimal(value):
+    if value is None:
+        return Decimal('0.00')
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+@span('get_feed_totals')
+def get_feed_totals(user, **filters):
+    """
+    Returns {'count', 'total_income', 'total_expense'} for the filtered feed,
+    computed by one conditional aggregate over the UNION ALL of the tables.
+    """
+    querysets = _base_querysets(user, **filters)
+    if not querysets:
+        return {'count': 0, 'total_income': Decimal('0.00'), 'total_expense': Decimal('0.00')}
+
+    feed = _union(
+        qs.order_by().annotate(
+            f_rank=Value(KIND_RANKS[kind], output_field=IntegerField()),
+            f_amount=F('amount'),
+        ).values_list('f_rank', 'f_amount')
+        for kind, qs in querysets.items()
+    )
+
+    # The ORM can't aggregate over a UNION, so wrap its SQL in a derived table.
+    compiler = feed.query.get_compiler(using=feed.db)
+    inner_sql, params = compiler.as_sql()
+    sql = (
+        "SELECT COUNT(*), "
+        "SUM(CASE WHEN feed.f_rank = %s THEN feed.f_amount ELSE 0 END), "
+        "SUM(CASE WHEN feed.f_rank = %s THEN feed.f_amount ELSE 0 END) "
+        f"FROM ({inner_sql}) feed"
+    )
+    with connections[feed.db].cursor() as cursor:
+        cursor.execute(sql, (KIND_RANKS['income'], KIND_RANKS['expense'], *params))
+        count, total_income, total_expense = cursor.fetchone()
+
+    return {
+        'count': count,
+        'total_income': _to_decimal(total_income),
+        'total_expense': _to_decimal(total_expense),
+    }
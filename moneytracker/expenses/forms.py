@@ -82,3 +82,38 @@ class TransferForm(forms.ModelForm):
              'to_account': forms.Select(attrs={'class': 'form-input'}),
              'description': forms.TextInput(attrs={'placeholder': 'Transfer details...', 'class': 'form-input'}),
         }
+
+
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+
+class MultipleFileField(forms.FileField):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleFileInput(attrs={'class': 'form-input', 'accept': '.csv,.xlsx,.xlsm,.pdf'}))
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        if isinstance(data, (list, tuple)) and data:
+            return [super(MultipleFileField, self).clean(item, initial) for item in data]
+        return [super().clean(data, initial)]
+
+
+class StatementImportForm(forms.Form):
+    statements = MultipleFileField(help_text="CSV, XLSX or PDF statements of one account.")
+    profile = forms.ChoiceField(widget=forms.Select(attrs={'class': 'form-input'}))
+    account = forms.ModelChoiceField(queryset=BankAccount.objects.none(),
+                                     widget=forms.Select(attrs={'class': 'form-input'}))
+    allow_duplicates = forms.BooleanField(
+        required=False, label="Import duplicates",
+        help_text="Also import rows that match transactions already recorded."
+    )
+
+    def __init__(self, user, *args, **kwargs):
+        from .statements import get_statement_profiles
+
+        super().__init__(*args, **kwargs)
+        self.fields['account'].queryset = BankAccount.objects.filter(user=user)
+        self.fields['profile'].choices = [
+            (name, profile.get('label', name)) for name, profile in get_statement_profiles().items()
+        ]
@@ -0,0 +1,101 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from .models import BankAccount
+from .snapshots import patch_snapshots, snapshot_date
+
+
+class BalanceLedger:
+    """
+    Collects balance changes for a unit of work and applies them as
+    database-side F() deltas, with one UPDATE per touched account.
+    Never reads or writes BankAccount.balance in Python, so concurrent
+    writers cannot lose each other's updates.
+
+    Changes given with the day they happened also patch the account's
+    balance snapshots.
+    """
+
+    def __init__(self):
+        self.deltas = defaultdict(Decimal)
+        # (account_id, snapshot date) -> delta
+        self.dated = defaultdict(Decimal)
+
+    def _add(self, account, amount, day=None):
+        if account is None:
+            return
+        account_id = account if isinstance(account, int) else account.pk
+        amount = Decimal(str(amount))
+        self.deltas[account_id] += amount
+        if day is not None:
+            self.dated[account_id, snapshot_date(day)] += amount
+
+    def credit(self, account, amount, day=None):
+        """Money into the account (income, incoming transfer) on day."""
+        self._add(account, amount, day)
+
+    def debit(self, account, amount, day=None):
+        """Money out of the account (expense, outgoing transfer) on day."""
+        self._add(account, -Decimal(str(amount)), day)
+
+    def apply(self):
+        """Flushes the merged deltas. Returns the number of accounts updated."""
+        updated = 0
+        for account_id, delta in self.deltas.items():
+            if delta:
+                BankAccount.objects.filter(pk=account_id).update(balance=F('balance') + delta)
+                updated += 1
+        if self.dated:
+            patch_snapshots(self.dated)
+        self.deltas.clear()
+        self.dated.clear()
+        return updated
+
+
+@contextmanager
+def balance_ledger():
+    """
+    Opens an atomic block and yields a BalanceLedger whose changes are
+    applied at the end of it, together with the caller's own writes.
+    """
+    ledger = BalanceLedger()
+    with transaction.atomic():
+        yield ledger
+        # The caller may have marked the block for rollback (set_rollback)
+        if not transaction.get_rollback():
+            ledger.apply()
+
+
+def transaction_day(instance):
+    """The instance's date as a date (it may have been assigned a string)."""
+    return instance._meta.get_field('date').to_python(instance.date)
+
+
+def expense_effect(ledger, expense, reverse=False):
+    day = transaction_day(expense)
+    if reverse:
+        ledger.credit(expense.account_id, expense.amount, day)
+    else:
+        ledger.debit(expense.account_id, expense.amount, day)
+
+
+def income_effect(ledger, income, reverse=False):
+    day = transaction_day(income)
+    if reverse:
+        ledger.debit(income.account_id, income.amount, day)
+    else:
+        ledger.credit(income.account_id, income.amount, day)
+
+
+def transfer_effect(ledger, transfer, reverse=False):
+    amount = transfer.amount
+    day = transaction_day(transfer)
+    if reverse:
+        ledger.credit(transfer.from_account_id, amount, day)
+        ledger.debit(transfer.to_account_id, amount, day)
+    else:
+        ledger.debit(transfer.from_account_id, amount, day)
+        ledger.credit(transfer.to_account_id, amount, day)
@@ -0,0 +1,75 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from expenses.benchmarks import BENCHMARKS, compare_results, run_benchmarks, run_metadata
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the main views against generated data at several scales, in a throwaway test "
+        "database, and write the results as JSON for comparing runs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1000,10000',
+                            help="Comma-separated transactions per user (default 1000,10000).")
+        parser.add_argument('--users', type=int, default=2, help="Users generated per scale (default 2).")
+        parser.add_argument('--months', type=int, default=24, help="Months of history (default 24).")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per view (default 5).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the generated data.")
+        parser.add_argument('--view', action='append', choices=list(BENCHMARKS), dest='views',
+                            help="Only time this view (repeatable).")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--compare', help="Compare with the results in this JSON file.")
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',') if scale.strip()]
+        except ValueError:
+            raise CommandError("--scales must be comma-separated numbers.")
+        if not scales or options['repeat'] < 1:
+            raise CommandError("Give at least one scale and --repeat of 1 or more.")
+
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)['results']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        # Never touch the real data: generate into a test database
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = run_benchmarks(
+                scales, options['users'], options['months'], options['repeat'], options['seed'],
+                options['views'], progress=self._report,
+            )
+            metadata = run_metadata(scales=scales, users=options['users'], months=options['months'],
+                                    repeat=options['repeat'], seed=options['seed'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'meta': metadata, 'results': results}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}."))
+
+        if baseline is not None:
+            self.stdout.write("\nChange in median time:")
+            for scale, view, old, new, change in compare_results(baseline, results):
+                change = f"{change:+.1%}" if change is not None else 'n/a'
+                self.stdout.write(f"{view:<28} {scale:>8} {old:>10.1f} -> {new:>8.1f} ms  {change}")
+
+    def _report(self, result):
+        self.stdout.write(
+            f"{result['view']:<28} {result['scale']:>8} {result['median_ms']:>10.1f} ms median "
+            f"({result['min_ms']:.1f}-{result['max_ms']:.1f}), {result['queries']} queries, "
+            f"HTTP {result['status']}"
+        )
+        self.stdout.flush()
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from expenses.synthetic import generate_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate realistic users with accounts, categories, budgets, partner connections "
+        "and transactions, for benchmarks and local testing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Users to create (default 10).")
+        parser.add_argument('--transactions', type=int, default=1000,
+                            help="Transactions per user (default 1000).")
+        parser.add_argument('--months', type=int, default=24, help="Months of history (default 24).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same data.")
+        parser.add_argument('--prefix', default='demo', help="Username prefix (default 'demo': demo1, demo2, ...).")
+        parser.add_argument('--password', default='password', help="Password for every user.")
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['transactions'] < 0:
+            raise CommandError("--users must be at least 1 and --transactions not negative.")
+
+        started = time.perf_counter()
+        try:
+            users = generate_dataset(options['users'], options['transactions'], options['months'],
+                                     options['seed'], options['prefix'], options['password'])
+        except ValueError as e:
+            raise CommandError(f"{e}. Pick another --prefix.")
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users ({users[0].username} .. {users[-1].username}) with about "
+            f"{options['transactions']} transactions each in {elapsed:.1f}s."
+        ))
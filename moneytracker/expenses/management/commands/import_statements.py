@@ -0,0 +1,76 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from expenses.models import BankAccount
+from expenses.statement_parsers import StatementError
+from expenses.statements import StatementSource, get_statement_profiles, import_statements
+
+
+class Command(BaseCommand):
+    help = (
+        "Import CSV/XLSX/PDF bank statements. Each FILE is ACCOUNT=PATH, or just PATH "
+        "with --account; the profile names the statement's columns."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', metavar='FILE')
+        parser.add_argument('--user', required=True, help="Username to import for.")
+        parser.add_argument('--account', help="Account name for files given without ACCOUNT=.")
+        parser.add_argument('--profile', default='generic',
+                            help=f"Statement profile: {', '.join(get_statement_profiles())}.")
+        parser.add_argument('--workers', type=int, help="Parser processes (default: one per CPU).")
+        parser.add_argument('--batch-size', type=int, help="Rows per bulk-insert batch.")
+        parser.add_argument('--allow-duplicates', action='store_true',
+                            help="Also import rows matching transactions already recorded.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist.")
+        accounts = {account.name: account for account in BankAccount.objects.filter(user=user)}
+
+        sources = []
+        for spec in options['files']:
+            account_name, _, path = spec.rpartition('=')
+            account_name = account_name or options['account']
+            if not account_name:
+                raise CommandError(f"No account for '{spec}': use ACCOUNT=PATH or --account.")
+            if account_name not in accounts:
+                raise CommandError(f"User '{user.username}' has no account named '{account_name}'.")
+            try:
+                sources.append(StatementSource(path, options['profile'], accounts[account_name]))
+            except StatementError as e:
+                raise CommandError(str(e))
+
+        last_line = ''
+
+        def report(state):
+            nonlocal last_line
+            line = (f"{state.units_done}/{state.units_total} parts parsed, "
+                    f"{state.imported} imported, {len(state.errors)} errors")
+            if line != last_line:
+                self.stdout.write(f"\r{line}", ending='')
+                self.stdout.flush()
+                last_line = line
+
+        started = time.perf_counter()
+        try:
+            result = import_statements(user, sources, options['workers'], options['batch_size'], report,
+                                       skip_duplicates=not options['allow_duplicates'])
+        except StatementError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+        self.stdout.write('')
+
+        for error in result.errors:
+            self.stderr.write(error)
+        if options['verbosity'] > 1:
+            for duplicate in result.duplicates:
+                self.stdout.write(f"Skipped {duplicate}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.imported} transactions from {len(sources)} statement(s) in {elapsed:.2f}s "
+            f"({result.skipped} lines and {len(result.duplicates)} duplicates skipped, "
+            f"{len(result.errors)} errors)."
+        ))
@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from expenses.snapshots import rebuild_snapshots
+
+
+class Command(BaseCommand):
+    help = "Rebuild the account balance snapshots (net worth history) from raw transactions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only rebuild snapshots for this username.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        written = rebuild_snapshots(user)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} balance snapshots."))
@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from expenses.bulk import rebuild_fingerprints
+
+
+class Command(BaseCommand):
+    help = "Recompute the duplicate-detection fingerprints of Expense and Income rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only recompute fingerprints for this username.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        changed = rebuild_fingerprints(user)
+        self.stdout.write(self.style.SUCCESS(f"Updated {changed} fingerprints."))
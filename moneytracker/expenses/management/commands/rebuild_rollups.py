@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from expenses.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the monthly category rollup table from raw Expense and Income rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only rebuild rollups for this username.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        written = rebuild_rollups(user)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} rollup buckets."))
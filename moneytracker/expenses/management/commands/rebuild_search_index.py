@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from expenses.search import rebuild_search_index, uses_fts
+
+
+class Command(BaseCommand):
+    help = "Rebuild the transaction search index (FTS5 table or SearchToken rows) from the transaction tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only rebuild the index for this username.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        indexed = rebuild_search_index(user)
+        backend = 'FTS5' if uses_fts() else 'token'
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} transactions ({backend} index)."))
@@ -0,0 +1,74 @@
+import csv
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from expenses.reconcile import RECONCILE_SHARD_SIZE, reconcile_all
+
+CSV_FIELDS = ['username', 'account_id', 'account', 'balance', 'expected', 'difference', 'status']
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every account balance from its opening balance and transactions and report "
+        "the accounts that are off. Nothing is changed without --fix."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help="Correct the balances (and record missing opening balances).")
+        parser.add_argument('--user', help="Only check this username's accounts.")
+        parser.add_argument('--workers', type=int, help="Worker processes (default: one per CPU).")
+        parser.add_argument('--shard-size', type=int, default=RECONCILE_SHARD_SIZE,
+                            help=f"Users per shard (default {RECONCILE_SHARD_SIZE}).")
+        parser.add_argument('--format', choices=['text', 'csv'], default='text',
+                            help="Report format, written as shards finish.")
+
+    def handle(self, *args, **options):
+        users = None
+        if options['user']:
+            try:
+                users = [User.objects.get(username=options['user'])]
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        writer = None
+        if options['format'] == 'csv':
+            writer = csv.DictWriter(self.stdout, CSV_FIELDS, extrasaction='ignore', lineterminator='\n')
+            writer.writeheader()
+
+        started = time.perf_counter()
+        shards = accounts = 0
+        counts = {'found': 0, 'fixed': 0, 'no_opening': 0, 'opening_recorded': 0}
+        for result in reconcile_all(options['workers'], options['shard_size'], options['fix'], users):
+            shards += 1
+            accounts += result['accounts']
+            for entry in result['discrepancies']:
+                counts[entry['status']] += 1
+                if writer:
+                    writer.writerow(entry)
+                else:
+                    self.stdout.write(self._describe(entry))
+            self.stdout.flush()
+        elapsed = time.perf_counter() - started
+
+        summary = (
+            f"Checked {accounts} accounts in {shards} shard(s) in {elapsed:.2f}s: "
+            f"{counts['found'] + counts['fixed']} off ({counts['fixed']} fixed), "
+            f"{counts['no_opening'] + counts['opening_recorded']} without an opening balance "
+            f"({counts['opening_recorded']} recorded)."
+        )
+        # Keep the CSV on stdout clean
+        if writer:
+            self.stderr.write(summary)
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+    def _describe(self, entry):
+        name = f"{entry['username']} / {entry['account']} (#{entry['account_id']})"
+        if entry['expected'] is None:
+            recorded = 'recorded' if entry['status'] == 'opening_recorded' else 'not recorded'
+            return f"{name}: opening balance {recorded}, {entry['opening']} from the current balance"
+        fixed = ' - fixed' if entry['status'] == 'fixed' else ''
+        return (f"{name}: balance {entry['balance']}, transactions say {entry['expected']} "
+                f"(off by {entry['difference']}){fixed}")
@@ -0,0 +1,232 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# =============================
+# Request metrics
+# =============================
+# MetricsMiddleware counts every request per URL name with its latency and
+# the SQL it ran. SQL is seen by an execute wrapper put on each database
+# connection when it opens; it adds to the counters of the request in the
+# current context (a context variable, so queries run through
+# sync_to_async on other threads still count) and does nothing outside
+# requests. span() times named service calls. Everything is aggregated in
+# this process under one lock, taken once per request or span, and
+# rendered in the Prometheus text format by the staff-only /metrics view.
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _buckets():
+    return tuple(getattr(settings, 'METRICS_LATENCY_BUCKETS', DEFAULT_LATENCY_BUCKETS))
+
+
+class _RequestSQL:
+    """Queries and seconds of SQL run for one request so far."""
+    __slots__ = ('queries', 'seconds', 'lock')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.queries += 1
+            self.seconds += seconds
+
+
+_current_request = ContextVar('metrics_request', default=None)
+
+
+def record_sql(execute, sql, params, many, context):
+    """Execute wrapper: times the query against the current request."""
+    counters = _current_request.get()
+    if counters is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counters.add(time.perf_counter() - started)
+
+
+def install_sql_wrapper(sender, connection, **kwargs):
+    """connection_created receiver. Connections are reopened on the same object."""
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+class _Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, bounds, value):
+        self.counts[bisect.bisect_left(bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """In-process aggregates of requests and spans."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.bounds = _buckets()
+            self.requests = {}  # (view, method, status): count
+            self.latency = {}  # view: _Histogram
+            self.sql = {}  # view: [queries, seconds]
+            self.spans = {}  # name: [count, seconds]
+
+    def observe_request(self, view, method, status, seconds, queries, sql_seconds):
+        with self._lock:
+            key = (view, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.latency.get(view)
+            if histogram is None:
+                histogram = self.latency[view] = _Histogram(len(self.bounds) + 1)
+            histogram.observe(self.bounds, seconds)
+            sql = self.sql.setdefault(view, [0, 0.0])
+            sql[0] += queries
+            sql[1] += sql_seconds
+
+    def observe_span(self, name, seconds):
+        with self._lock:
+            span = self.spans.setdefault(name, [0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+
+    def render(self):
+        """The Prometheus text exposition of everything recorded."""
+        with self._lock:
+            bounds = self.bounds
+            requests = dict(self.requests)
+            latency = {view: (list(h.counts), h.total, h.count) for view, h in self.latency.items()}
+            sql = {view: tuple(values) for view, values in self.sql.items()}
+            spans = {name: tuple(values) for name, values in self.spans.items()}
+
+        lines = []
+
+        def header(name, kind, text):
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        header('moneytracker_http_requests_total', 'counter', 'Requests handled, per URL name.')
+        for (view, method, status), count in sorted(requests.items()):
+            lines.append(f'moneytracker_http_requests_total{_labels(view=view, method=method, status=status)} {count}')
+
+        header('moneytracker_http_request_duration_seconds', 'histogram', 'Request latency, per URL name.')
+        for view, (counts, total, count) in sorted(latency.items()):
+            cumulative = 0
+            for bound, bucket in zip(bounds, counts):
+                cumulative += bucket
+                lines.append(f'moneytracker_http_request_duration_seconds_bucket{_labels(view=view, le=_number(bound))} {cumulative}')
+            lines.append(f'moneytracker_http_request_duration_seconds_bucket{_labels(view=view, le="+Inf")} {count}')
+            lines.append(f'moneytracker_http_request_duration_seconds_sum{_labels(view=view)} {_number(total)}')
+            lines.append(f'moneytracker_http_request_duration_seconds_count{_labels(view=view)} {count}')
+
+        header('moneytracker_db_queries_total', 'counter', 'SQL queries run by requests, per URL name.')
+        for view, (queries, _) in sorted(sql.items()):
+            lines.append(f'moneytracker_db_queries_total{_labels(view=view)} {queries}')
+        header('moneytracker_db_query_seconds_total', 'counter', 'Time spent in SQL by requests, per URL name.')
+        for view, (_, seconds) in sorted(sql.items()):
+            lines.append(f'moneytracker_db_query_seconds_total{_labels(view=view)} {_number(seconds)}')
+
+        header('moneytracker_span_duration_seconds', 'summary', 'Time spent in named service calls.')
+        for name, (count, seconds) in sorted(spans.items()):
+            lines.append(f'moneytracker_span_duration_seconds_sum{_labels(span=name)} {_number(seconds)}')
+            lines.append(f'moneytracker_span_duration_seconds_count{_labels(span=name)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _number(value):
+    return repr(float(value))
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def span(name):
+    """
+    Times a named block into the span metrics. Also works as a decorator:
+    @span('calculate_spending').
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe_span(name, time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    """
+    Records each request's URL name, method, status, latency and SQL.
+    Latency runs until the response is returned, so a streamed body
+    (CSV export, server-sent events) is not included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        counters, token, started = self._start()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            self._finish(request, response, counters, token, started)
+
+    async def __acall__(self, request):
+        counters, token, started = self._start()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            self._finish(request, response, counters, token, started)
+
+    def _start(self):
+        counters = _RequestSQL()
+        return counters, _current_request.set(counters), time.perf_counter()
+
+    def _finish(self, request, response, counters, token, started):
+        elapsed = time.perf_counter() - started
+        _current_request.reset(token)
+        match = getattr(request, 'resolver_match', None)
+        registry.observe_request(
+            match.view_name if match else 'unmatched',
+            request.method,
+            str(response.status_code if response is not None else 500),
+            elapsed, counters.queries, counters.seconds,
+        )
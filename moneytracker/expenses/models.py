@@ -1,6 +1,77 @@
+import hashlib
+import re
+from decimal import Decimal
+
 from django.db import models
 from django.contrib.auth.models import User
 
+
+def year_month_key(value):
+    """
+    Integer month key (e.g. 202403) stored on transactions so grouping
+    and filtering by month can use an index instead of date functions.
+    """
+    value = models.DateField().to_python(value)
+    return value.year * 100 + value.month
+
+
+class YearMonthMixin(models.Model):
+    """Keeps year_month in step with date on every save()."""
+    year_month = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self.date:
+            self.year_month = year_month_key(self.date)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'date' in update_fields:
+                kwargs['update_fields'] = set(update_fields) | {'year_month'}
+        super().save(*args, **kwargs)
+
+_FINGERPRINT_WORDS = re.compile(r'[^\W_]+')
+
+
+def transaction_fingerprint(kind, user_id, account_id, date, amount, text):
+    """
+    Hash identifying a transaction as a statement would show it: kind,
+    user, account, date, amount and description with case, spacing and
+    punctuation ignored. Equal fingerprints mean a likely duplicate.
+    """
+    date = models.DateField().to_python(date)
+    amount = Decimal(str(amount)).quantize(Decimal('0.01'))
+    words = ' '.join(_FINGERPRINT_WORDS.findall((text or '').lower()))
+    value = f"{kind}|{user_id}|{account_id or ''}|{date.isoformat()}|{amount}|{words}"
+    return hashlib.sha1(value.encode()).hexdigest()
+
+
+class FingerprintMixin(models.Model):
+    """Keeps fingerprint in step with the fields it hashes on every save()."""
+    FINGERPRINT_KIND = None
+    FINGERPRINT_TEXT_FIELD = None
+    FINGERPRINT_FIELDS = {'user', 'account', 'date', 'amount'}
+
+    fingerprint = models.CharField(max_length=40, blank=True, default='', editable=False)
+
+    class Meta:
+        abstract = True
+
+    def compute_fingerprint(self):
+        return transaction_fingerprint(
+            self.FINGERPRINT_KIND, self.user_id, self.account_id, self.date, self.amount,
+            getattr(self, self.FINGERPRINT_TEXT_FIELD)
+        )
+
+    def save(self, *args, **kwargs):
+        if self.date and self.amount is not None:
+            self.fingerprint = self.compute_fingerprint()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and set(update_fields) & (self.FINGERPRINT_FIELDS | {self.FINGERPRINT_TEXT_FIELD}):
+                kwargs['update_fields'] = set(update_fields) | {'fingerprint'}
+        super().save(*args, **kwargs)
+
+
 # Standard types for reference, but we will allow dynamic creation via a proper model if needed, 
 # or just keep these for the 'type' of account while the user defines the 'name'.
 ACCOUNT_TYPES = [
@@ -34,11 +105,18 @@ class BankAccount(models.Model):
     # We keep account_type as a high-level grouping, but users define the specific "Account Name"
     account_type = models.CharField(max_length=20, choices=ACCOUNT_TYPES, default='checking')
     balance = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    # What balance is reconciled against: balance = opening balance + the
+    # account's transactions. Set on creation and moved by direct balance
+    # edits; null for accounts created before it was recorded.
+    opening_balance = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
 
     def __str__(self):
         return f"{self.name} ({self.get_account_type_display()})"
 
-class Income(models.Model):
+class Income(FingerprintMixin, YearMonthMixin):
+    FINGERPRINT_KIND = 'income'
+    FINGERPRINT_TEXT_FIELD = 'source'
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     account = models.ForeignKey(BankAccount, on_delete=models.SET_NULL, null=True, blank=True, related_name='incomes')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -46,11 +124,25 @@ class Income(models.Model):
     source = models.CharField(max_length=100, blank=True) # Making source optional as category can replace it
     date = models.DateField()
 
+    class Meta:
+        # Hot paths filter by user + date range/month and sort by (-date, -id)
+        indexes = [
+            models.Index(fields=['user', 'date', 'id'], name='income_user_date_idx'),
+            models.Index(fields=['user', 'category', 'date'], name='income_user_cat_date_idx'),
+            models.Index(fields=['user', 'account', 'date'], name='income_user_acc_date_idx'),
+            models.Index(fields=['user', 'year_month'], name='income_user_ym_idx'),
+            # Duplicate checks of a whole import batch
+            models.Index(fields=['user', 'fingerprint'], name='income_user_fp_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.amount}"
 
 
-class Expense(models.Model):
+class Expense(FingerprintMixin, YearMonthMixin):
+    FINGERPRINT_KIND = 'expense'
+    FINGERPRINT_TEXT_FIELD = 'description'
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     account = models.ForeignKey(BankAccount, on_delete=models.SET_NULL, null=True, blank=True, related_name='expenses')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -59,6 +151,15 @@ class Expense(models.Model):
     description = models.CharField(max_length=255)
     date = models.DateField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date', 'id'], name='expense_user_date_idx'),
+            models.Index(fields=['user', 'category', 'date'], name='expense_user_cat_date_idx'),
+            models.Index(fields=['user', 'account', 'date'], name='expense_user_acc_date_idx'),
+            models.Index(fields=['user', 'year_month'], name='expense_user_ym_idx'),
+            models.Index(fields=['user', 'fingerprint'], name='expense_user_fp_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.amount}"
 
@@ -88,7 +189,7 @@ class BudgetNotification(models.Model):
     def __str__(self):
         return f"Notification for {self.budget.id}"
 
-class Transfer(models.Model):
+class Transfer(YearMonthMixin):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     from_account = models.ForeignKey(BankAccount, related_name='transfers_sent', on_delete=models.CASCADE)
     to_account = models.ForeignKey(BankAccount, related_name='transfers_received', on_delete=models.CASCADE)
@@ -98,5 +199,84 @@ class Transfer(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'date', 'id'], name='transfer_user_date_idx'),
+            # Account filter is an OR over both sides
+            models.Index(fields=['user', 'from_account', 'date'], name='transfer_user_from_date_idx'),
+            models.Index(fields=['user', 'to_account', 'date'], name='transfer_user_to_date_idx'),
+            models.Index(fields=['user', 'year_month'], name='transfer_user_ym_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}: {self.from_account} -> {self.to_account} ({self.amount})"
+
+class MonthlyRollup(models.Model):
+    """
+    Running totals per (user, month, category, kind), kept in sync with
+    Expense and Income by signals so dashboards never scan raw rows.
+    """
+    KIND_CHOICES = [
+        ('expense', 'Expense'),
+        ('income', 'Income'),
+    ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    month = models.DateField()  # Always the first day of the month
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'month', 'category', 'kind')
+
+    def __str__(self):
+        cat = self.category.name if self.category else "Uncategorized"
+        return f"{self.user.username} - {self.month:%Y-%m} - {cat} ({self.kind}): {self.total}"
+
+class BalanceSnapshot(models.Model):
+    """
+    An account's balance at the end of a day (or month, with
+    BALANCE_SNAPSHOT_GRANULARITY = 'month'). Rows exist only for periods
+    with activity; a balance holds until the account's next row. Kept in
+    step with the balance by the ledger (expenses/snapshots.py).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    account = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name='snapshots')
+    date = models.DateField()
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        unique_together = ('account', 'date')
+        indexes = [
+            # Net worth over time is one range scan of these
+            models.Index(fields=['user', 'date'], name='snapshot_user_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} @ {self.date}: {self.balance}"
+
+class SearchToken(models.Model):
+    """
+    Inverted index of transaction text (token -> row), used for search on
+    databases without SQLite FTS5. Maintained by expenses/search.py.
+    """
+    KIND_CHOICES = [
+        ('expense', 'Expense'),
+        ('income', 'Income'),
+        ('transfer', 'Transfer'),
+    ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    token = models.CharField(max_length=64)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            # Prefix lookups for one user's rows
+            models.Index(fields=['user', 'token'], name='searchtoken_user_token_idx'),
+            models.Index(fields=['kind', 'object_id'], name='searchtoken_object_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.token} -> {self.kind} #{self.object_id}"
@@ -0,0 +1,179 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
+
+# =============================
+# Request profiling
+# =============================
+# With REQUEST_PROFILING_ENABLED, staff can profile one request by adding
+# ?profile=1 or an "X-Profile: 1" header, and REQUEST_PROFILING_SAMPLE_RATE
+# profiles that share of everyone's requests. A profiled request runs under
+# cProfile with every SQL statement logged, and is saved to
+# REQUEST_PROFILING_DIR as three files per request: the .prof stats
+# (pstats, snakeviz), the query log with the top functions, and a small
+# summary read by the staff list page. Only the newest
+# REQUEST_PROFILING_KEEP are kept. When profiling is off the middleware
+# removes itself at startup (MiddlewareNotUsed), so it costs nothing.
+
+PROFILE_PARAM = 'profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+# 20240301-143000-123456-1a2b: sorts by time (to the microsecond)
+PROFILE_ID = re.compile(r'^\d{8}-\d{6}-\d{6}-[0-9a-f]{4}$')
+# Files of one profile: kind: (suffix, content type)
+PROFILE_FILES = {
+    'prof': ('.prof', 'application/octet-stream'),
+    'sql': ('.sql.json', 'application/json'),
+}
+TOP_FUNCTIONS = 40
+MAX_PARAMS_LENGTH = 1000
+
+
+def profile_dir():
+    return Path(getattr(settings, 'REQUEST_PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+
+
+def profile_path(profile_id, kind):
+    """Path of one of a profile's files, or None for an invalid id or kind."""
+    if not PROFILE_ID.match(profile_id) or kind not in PROFILE_FILES:
+        return None
+    return profile_dir() / f'{profile_id}{PROFILE_FILES[kind][0]}'
+
+
+class QueryLog:
+    """Execute wrapper keeping every statement with its duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': repr(params)[:MAX_PARAMS_LENGTH],
+                'many': many,
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+def _write_json(path, data):
+    # Readers never see a partial file
+    temporary = path.with_name(path.name + '.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(temporary, path)
+
+
+def save_profile(request, response, profiler, queries, seconds, sampled=False):
+    """Writes a profiled request to the ring buffer. Returns its id."""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = f'{timezone.now():%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:4]}'
+
+    profiler.dump_stats(directory / f'{profile_id}.prof')
+    top = io.StringIO()
+    pstats.Stats(profiler, stream=top).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+    _write_json(directory / f'{profile_id}.sql.json', {'queries': queries, 'top_functions': top.getvalue()})
+
+    match = getattr(request, 'resolver_match', None)
+    user = getattr(request, 'user', None)
+    # The summary goes last: a profile is listed once it is complete
+    _write_json(directory / f'{profile_id}.json', {
+        'id': profile_id,
+        'created': timezone.now().isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'view': match.view_name if match else None,
+        'user': user.get_username() if user is not None and user.is_authenticated else None,
+        'status': response.status_code,
+        'ms': round(seconds * 1000, 1),
+        'queries': len(queries),
+        'sql_ms': round(sum(query['ms'] for query in queries), 1),
+        'sampled': sampled,
+    })
+    prune_profiles()
+    return profile_id
+
+
+def prune_profiles(keep=None):
+    """Deletes all but the newest keep profiles (REQUEST_PROFILING_KEEP)."""
+    keep = getattr(settings, 'REQUEST_PROFILING_KEEP', 50) if keep is None else keep
+    directory = profile_dir()
+    ids = sorted(path.stem for path in directory.glob('*.json') if PROFILE_ID.match(path.stem))
+    for profile_id in ids[:max(len(ids) - keep, 0)]:
+        for suffix in ('.json', '.prof', '.sql.json'):
+            try:
+                (directory / f'{profile_id}{suffix}').unlink()
+            except FileNotFoundError:
+                # Pruned by another worker
+                pass
+
+
+def list_profiles():
+    """Summaries of the saved profiles, newest first."""
+    profiles = []
+    for path in sorted(profile_dir().glob('*.json'), reverse=True):
+        if not PROFILE_ID.match(path.stem):
+            continue
+        try:
+            with open(path) as f:
+                profiles.append(json.load(f))
+        except (FileNotFoundError, ValueError):
+            continue
+    return profiles
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests asked for by staff (or sampled). Goes after
+    AuthenticationMiddleware, which it needs for request.user. Only the
+    response is profiled, not the body of a streaming response.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'REQUEST_PROFILING_SAMPLE_RATE', 0.0)
+
+    def __call__(self, request):
+        if request.GET.get(PROFILE_PARAM) == '1' or request.META.get(PROFILE_HEADER) == '1':
+            if request.user.is_staff:
+                return self._profile(request, sampled=False)
+        elif self.sample_rate and random.random() < self.sample_rate:
+            return self._profile(request, sampled=True)
+        return self.get_response(request)
+
+    def _profile(self, request, sampled):
+        log = QueryLog()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(log))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        elapsed = time.perf_counter() - started
+
+        profile_id = save_profile(request, response, profiler, log.queries, elapsed, sampled)
+        if not sampled:
+            response['X-Profile-Id'] = profile_id
+        return response
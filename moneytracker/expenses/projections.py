@@ -0,0 +1,134 @@
+import calendar
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Sum
+from django.db.models.functions import ExtractDay
+from django.utils import timezone
+from .metrics import span
+from .models import Expense
+
+# =============================
+# Month-end spending projection
+# =============================
+# A budget month still in progress is projected from two estimates of the
+# spending still to come: the month's own run rate so far, and the user's
+# usual spending for the rest of the month (from the daily pattern of the
+# previous months). The run rate is trusted in proportion to the part of
+# the month's usual spending already done, so a bill due late in the month
+# (rent on the 25th) is still expected after a quiet start; categories with
+# no history use the run rate alone. Every (month, category) pair is
+# projected in one set of array operations.
+
+
+def _month_number(day):
+    return day.year * 12 + day.month - 1
+
+
+def _year_month(month_number):
+    """YYYYMM, as stored in year_month."""
+    return (month_number // 12) * 100 + month_number % 12 + 1
+
+
+class SpendingPattern:
+    """
+    A user's expenses over the months before the current one, per category
+    and day of the month.
+    """
+
+    def __init__(self, rows, today):
+        self.today = today
+        months = set()
+        totals = {}
+        for year_month, category_id, day, total in rows:
+            months.add(year_month)
+            totals[category_id, day] = totals.get((category_id, day), 0.0) + float(total)
+
+        self.months = len(months)
+        self.category_ids = sorted({category_id for category_id, _ in totals}, key=lambda c: (c is not None, c))
+        index = {category_id: i for i, category_id in enumerate(self.category_ids)}
+        # daily[c, d]: spent in category c on day d + 1, over all the months
+        daily = np.zeros((len(self.category_ids), 31))
+        for (category_id, day), total in totals.items():
+            daily[index[category_id], day - 1] = total
+
+        spent = daily.sum(axis=1)
+        self.average = spent / self.months if self.months else spent
+        # share[c, t]: part of a month's spending usually done by the end of day t
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.cumsum(daily, axis=1) / spent[:, None]
+        self.share = np.hstack([np.zeros((len(self.category_ids), 1)), np.nan_to_num(share)])
+
+    def project(self, spent_by_month):
+        """
+        {month: {category_id: projected month-end spend}} for
+        {month: {category_id: spent so far}}. Past months keep what was
+        spent; months after the current one are projected from the pattern
+        alone.
+        """
+        current = _month_number(self.today)
+        months = [month for month in spent_by_month if _month_number(month) >= current]
+        projected = {
+            month: dict(spent) for month, spent in spent_by_month.items() if _month_number(month) < current
+        }
+        if not months:
+            return projected
+
+        category_ids = list(self.category_ids)
+        known = set(category_ids)
+        for month in months:
+            for category_id in spent_by_month[month]:
+                if category_id not in known:
+                    known.add(category_id)
+                    category_ids.append(category_id)
+        extra = len(category_ids) - len(self.category_ids)
+
+        # Rows are months, columns are categories
+        spent = np.array([[float(spent_by_month[month].get(c, 0)) for c in category_ids] for month in months])
+        length = np.array([calendar.monthrange(month.year, month.month)[1] for month in months], dtype=float)
+        elapsed = np.array([self.today.day if _month_number(month) == current else 0 for month in months])
+
+        average = np.concatenate([self.average, np.zeros(extra)])
+        share = np.vstack([self.share, np.zeros((extra, 32))])[:, elapsed].T
+        from_pattern = average * (1 - share)
+        # A month not started yet (elapsed 0) has no run rate: only the
+        # rows of months in progress are divided
+        started = elapsed[:, None] > 0
+        from_run_rate = np.zeros_like(spent)
+        np.divide(spent * (length - elapsed)[:, None], elapsed[:, None], out=from_run_rate,
+                  where=np.broadcast_to(started, spent.shape))
+        weight = np.where(average > 0, share, 1.0)
+        estimate = np.where(started, spent + weight * from_run_rate + (1 - weight) * from_pattern,
+                            spent + from_pattern)
+
+        for row, month in enumerate(months):
+            projected[month] = {
+                category_id: Decimal(f'{estimate[row, column]:.2f}')
+                for column, category_id in enumerate(category_ids)
+            }
+        return projected
+
+
+@span('get_spending_pattern')
+def get_spending_pattern(user, today=None):
+    """
+    The user's SpendingPattern over the BUDGET_PROJECTION_MONTHS months
+    before today's, from one grouped query.
+    """
+    today = today or timezone.localdate()
+    current = _month_number(today)
+    history = getattr(settings, 'BUDGET_PROJECTION_MONTHS', 6)
+    rows = Expense.objects.filter(
+        user=user,
+        year_month__gte=_year_month(current - history),
+        year_month__lt=_year_month(current),
+    ).order_by().values_list('year_month', 'category_id', ExtractDay('date')).annotate(total=Sum('amount'))
+    return SpendingPattern(rows, today)
+
+
+def needs_projection(month, today=None):
+    """True for the current month and later ones."""
+    today = today or timezone.localdate()
+    return month >= date(today.year, today.month, 1)
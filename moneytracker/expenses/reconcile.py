@@ -0,0 +1,132 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from decimal import Decimal
+
+import django
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import F, Sum
+from .data_version import bump_data_version
+from .events import publish_change
+from .models import BankAccount
+from .snapshots import BALANCE_SOURCES, rebuild_snapshots
+
+# =============================
+# Balance reconciliation
+# =============================
+# An account's balance should equal its opening balance plus its incomes
+# and incoming transfers, minus its expenses and outgoing transfers. Users
+# are split into shards; each shard is checked with one grouped aggregate
+# per transaction table, in a process pool, and results are reported as
+# the shards finish. Workers only read: the users with a discrepancy are
+# re-checked and fixed by the calling process, so writes stay serial (one
+# writer at a time on SQLite) and happen under the accounts' row locks.
+
+# Users per shard
+RECONCILE_SHARD_SIZE = 200
+CENT = Decimal('0.01')
+
+
+def user_shards(shard_size=RECONCILE_SHARD_SIZE, users=None):
+    """Lists of user ids, in id order, shard_size at a time."""
+    ids = User.objects.order_by('id').values_list('id', flat=True)
+    if users is not None:
+        ids = ids.filter(pk__in=[user.pk for user in users])
+    ids = list(ids)
+    return [ids[i:i + shard_size] for i in range(0, len(ids), shard_size)]
+
+
+def ledger_totals(user_ids):
+    """{account_id: net of its transactions} for the users' accounts."""
+    totals = defaultdict(Decimal)
+    for model, field, sign in BALANCE_SOURCES:
+        grouped = (
+            model.objects.filter(user_id__in=user_ids).exclude(**{field: None})
+            .values_list(field).annotate(total=Sum('amount')).order_by()
+        )
+        for account_id, total in grouped:
+            totals[account_id] += sign * total
+    # SQLite sums come back with extra digits
+    return {account_id: total.quantize(CENT) for account_id, total in totals.items()}
+
+
+def reconcile_accounts(user_ids, fix=False):
+    """
+    Checks the balances of the users' accounts against their transactions.
+    Returns {'accounts': number checked, 'discrepancies': [...]}, one dict
+    per account that is off (or has no opening balance recorded) with
+    account_id, user_id, username, account, balance, expected, difference
+    and status ('found', 'fixed', 'no_opening' or 'opening_recorded').
+
+    With fix, balances are set to the expected value, missing opening
+    balances are recorded from the current balance, and the snapshots of
+    users with a corrected balance are rebuilt.
+    """
+    discrepancies = []
+    with transaction.atomic():
+        accounts = BankAccount.objects.filter(user_id__in=user_ids).order_by('id')
+        if fix:
+            # Writers update balances through the ledger; hold them off
+            # until the corrections are in
+            accounts = accounts.select_for_update(of=('self',))
+        accounts = list(accounts.values_list('id', 'user_id', 'user__username', 'name', 'balance', 'opening_balance'))
+        totals = ledger_totals(user_ids)
+
+        for account_id, user_id, username, name, balance, opening in accounts:
+            net = totals.get(account_id, Decimal('0.00'))
+            entry = {'account_id': account_id, 'user_id': user_id, 'username': username, 'account': name,
+                     'balance': balance}
+            if opening is None:
+                entry.update(expected=None, difference=None, opening=balance - net,
+                             status='opening_recorded' if fix else 'no_opening')
+                if fix:
+                    BankAccount.objects.filter(pk=account_id).update(opening_balance=balance - net)
+            elif opening + net != balance:
+                entry.update(expected=opening + net, difference=opening + net - balance,
+                             status='fixed' if fix else 'found')
+                if fix:
+                    BankAccount.objects.filter(pk=account_id).update(balance=F('balance') + entry['difference'])
+            else:
+                continue
+            discrepancies.append(entry)
+
+        if fix:
+            # update() sends no signals: move the data versions (ETags,
+            # cached dashboards) and tell live pages, once committed
+            for user_id in {entry['user_id'] for entry in discrepancies if entry['status'] == 'fixed'}:
+                bump_data_version(user_id)
+                publish_change(user_id, balances=True)
+
+    if fix:
+        for user_id in {entry['user_id'] for entry in discrepancies if entry['status'] == 'fixed'}:
+            rebuild_snapshots(user_id)
+    return {'accounts': len(accounts), 'discrepancies': discrepancies}
+
+
+def _fix_shard(result):
+    user_ids = sorted({entry['user_id'] for entry in result['discrepancies']})
+    if not user_ids:
+        return result
+    return {'accounts': result['accounts'], 'discrepancies': reconcile_accounts(user_ids, fix=True)['discrepancies']}
+
+
+def reconcile_all(workers=None, shard_size=RECONCILE_SHARD_SIZE, fix=False, users=None):
+    """
+    Runs reconcile_accounts over every user's shard (or the given users')
+    in a process pool of workers (default: one per CPU). Yields each
+    shard's result as soon as it is done, in no particular order.
+    """
+    shards = user_shards(shard_size, users)
+    workers = min(workers or os.cpu_count() or 1, len(shards))
+    if workers <= 1:
+        for shard in shards:
+            yield reconcile_accounts(shard, fix)
+        return
+
+    # Workers open their own connections; none may be inherited
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        futures = [pool.submit(reconcile_accounts, shard) for shard in shards]
+        for future in as_completed(futures):
+            yield _fix_shard(future.result()) if fix else future.result()
@@ -0,0 +1,170 @@
+from datetime import date
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+from .data_version import bump_data_version
+from .events import publish_change
+from .models import Expense, Income, Transfer, MonthlyRollup
+
+# Maps a rollup kind to its source model.
+ROLLUP_SOURCES = {
+    'expense': Expense,
+    'income': Income,
+}
+
+
+def month_start(date_obj):
+    """First day of the month containing date_obj."""
+    return date(date_obj.year, date_obj.month, 1)
+
+
+def rollup_key(instance):
+    """
+    Returns the (user_id, month, category_id) bucket an Expense/Income
+    counts towards, or None if it has no date yet.
+    """
+    if not instance.date:
+        return None
+    # Dates assigned as strings stay strings on the instance after save()
+    day = instance._meta.get_field('date').to_python(instance.date)
+    return (instance.user_id, month_start(day), instance.category_id)
+
+
+def apply_delta(user_id, month, category_id, kind, amount, count):
+    """
+    Adds amount/count to one rollup bucket with a database-side update,
+    creating the bucket the first time a row is added to it.
+    """
+    bucket = MonthlyRollup.objects.filter(user_id=user_id, month=month, category_id=category_id, kind=kind)
+    updated = bucket.update(total=F('total') + amount, count=F('count') + count)
+    if updated or count <= 0:
+        # A missing bucket on removal means it was cascaded away already
+        return
+
+    try:
+        with transaction.atomic():
+            MonthlyRollup.objects.create(
+                user_id=user_id, month=month, category_id=category_id, kind=kind,
+                total=amount, count=count
+            )
+    except IntegrityError:
+        # Another writer created the bucket first
+        bucket.update(total=F('total') + amount, count=F('count') + count)
+
+
+def apply_rows(kind, objs):
+    """
+    Adds a batch of new rows (e.g. from bulk_create, which sends no
+    signals) to the rollup with one update per touched bucket.
+    """
+    buckets = {}
+    for obj in objs:
+        key = rollup_key(obj)
+        total, count = buckets.get(key, (Decimal('0.00'), 0))
+        buckets[key] = (total + obj.amount, count + 1)
+    for key, (total, count) in buckets.items():
+        apply_delta(*key, kind, total, count)
+
+
+def backfill_year_month(using='default'):
+    """
+    Fills year_month on rows written before the column existed (or through
+    a path that bypassed save()). One UPDATE per table.
+    """
+    updated = 0
+    for model in (Expense, Income, Transfer):
+        updated += model.objects.using(using).filter(year_month=0).update(
+            year_month=ExtractYear('date') * 100 + ExtractMonth('date')
+        )
+    return updated
+
+
+def backfill_year_month_after_migrate(sender, using='default', **kwargs):
+    """post_migrate: keys the rows that predate the year_month column."""
+    backfill_year_month(using)
+
+
+def rebuild_rollups(user=None):
+    """
+    Recomputes every rollup bucket from the raw Expense and Income tables.
+    Restricted to one user if given. Returns the number of buckets written.
+    """
+    backfill_year_month()
+
+    buckets = []
+    for kind, model in ROLLUP_SOURCES.items():
+        qs = model.objects.all()
+        if user is not None:
+            qs = qs.filter(user=user)
+        # Grouping on the stored key is served by the (user, year_month) index
+        grouped = (
+            qs.values('user_id', 'year_month', 'category_id')
+            .annotate(total=Sum('amount'), count=Count('id'))
+            .order_by()
+        )
+        for row in grouped:
+            buckets.append(MonthlyRollup(
+                user_id=row['user_id'],
+                month=date(row['year_month'] // 100, row['year_month'] % 100, 1),
+                category_id=row['category_id'],
+                kind=kind,
+                total=row['total'],
+                count=row['count'],
+            ))
+
+    with transaction.atomic():
+        existing = MonthlyRollup.objects.all()
+        if user is not None:
+            existing = existing.filter(user=user)
+        touched = {bucket.user_id for bucket in buckets} | set(existing.order_by().values_list('user_id', flat=True).distinct())
+        existing.delete()
+        MonthlyRollup.objects.bulk_create(buckets, batch_size=1000)
+        # Dashboards and budget pages are cached against the data version
+        for user_id in touched:
+            bump_data_version(user_id)
+            publish_change(user_id, all_months=True)
+    return len(buckets)
+
+
+def get_month_summary(user, year, month):
+    """
+    Returns totals and the expense category breakdown for one month,
+    read from the rollup table in a single query.
+    """
+    rows = MonthlyRollup.objects.filter(
+        user=user,
+        month=date(year, month, 1),
+        count__gt=0
+    ).values('kind', 'category__name', 'total').order_by('-total')
+
+    total_expenses = Decimal('0.00')
+    total_income = Decimal('0.00')
+    expense_by_category = {}
+
+    for row in rows:
+        if row['kind'] == 'expense':
+            total_expenses += row['total']
+            cat_name = row['category__name'] or 'Uncategorized'
+            expense_by_category[cat_name] = expense_by_category.get(cat_name, 0) + float(row['total'])
+        else:
+            total_income += row['total']
+
+    return {
+        'total_expenses': total_expenses,
+        'total_income': total_income,
+        'expense_by_category': expense_by_category,
+    }
+
+
+def get_spending_by_category(user, month_date):
+    """
+    Returns {category_id: spent} for the month (None = uncategorized).
+    """
+    rows = MonthlyRollup.objects.filter(
+        user=user,
+        month=month_start(month_date),
+        kind='expense'
+    ).values_list('category_id', 'total')
+    return {category_id: total for category_id, total in rows}
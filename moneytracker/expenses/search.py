@@ -0,0 +1,284 @@
+import re
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, IntegerField, Max, Q, Sum, Value, When
+from django.db.models.expressions import RawSQL
+from .models import Expense, Income, Transfer, SearchToken
+
+# =============================
+# Transaction text search
+# =============================
+# On SQLite with FTS5 the index is a virtual table; elsewhere it is the
+# SearchToken inverted index. Both are kept in sync by signals (single
+# rows) and index_objects (bulk_create paths), and can be rebuilt with
+# `manage.py rebuild_search_index`.
+#
+# A query is split into terms and every term is matched as a word prefix,
+# all terms required ("cof sta" finds "Starbucks coffee").
+
+FTS_TABLE = 'expenses_search_fts'
+
+# kind -> (model, text field, number). The numbers match the feed's kind
+# ranks and make up the FTS rowid (object id * 4 + number), unique across
+# tables.
+SEARCH_SOURCES = {
+    'expense': (Expense, 'description', 0),
+    'income': (Income, 'source', 1),
+    'transfer': (Transfer, 'description', 2),
+}
+
+# Same word definition as FTS5's unicode61 tokenizer: letters and digits
+TOKEN_RE = re.compile(r'[^\W_]+')
+MAX_TOKEN_LENGTH = 64
+MAX_QUERY_TERMS = 8
+
+_fts_available = {}
+
+
+def tokenize(text):
+    """Lower-cased words of text, in order, duplicates removed."""
+    tokens = []
+    for token in TOKEN_RE.findall((text or '').lower()):
+        token = token[:MAX_TOKEN_LENGTH]
+        if token not in tokens:
+            tokens.append(token)
+    return tokens
+
+
+def uses_fts(using='default'):
+    """True if the database behind `using` is served by the FTS5 table."""
+    backend = getattr(settings, 'EXPENSES_SEARCH_BACKEND', 'auto')
+    if backend == 'tokens':
+        return False
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    if using not in _fts_available:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            _fts_available[using] = bool(cursor.fetchone()[0])
+    return _fts_available[using]
+
+
+def ensure_fts_table(using='default'):
+    """Creates the FTS5 table if missing. Returns True if it was created."""
+    if not uses_fts(using):
+        return False
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+        if cursor.fetchone():
+            return False
+        # Rows are stored as user-qualified tokens (see _user_tokens), not
+        # as raw text, and are hydrated from the transaction tables.
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "body, tokenize='unicode61 remove_diacritics 2')"
+        )
+    return True
+
+
+def _user_tokens(user_id, text):
+    """
+    Every word prefixed with its owner ('u12xcoffee'), so each user's
+    words have their own doclists: a search only ever reads the
+    searching user's entries, and ranking statistics are per user.
+    """
+    return ' '.join(f'u{user_id}x{token}' for token in tokenize(text))
+
+
+def _rowid(kind, object_id):
+    return object_id * 4 + SEARCH_SOURCES[kind][2]
+
+
+def _text(kind, obj):
+    return getattr(obj, SEARCH_SOURCES[kind][1]) or ''
+
+
+# =============================
+# Index maintenance
+# =============================
+
+def index_objects(kind, objs, using='default', replace=True):
+    """
+    (Re)indexes saved rows of one kind. replace=False skips removing old
+    entries, for rows known not to be indexed yet.
+    """
+    objs = [obj for obj in objs if obj.pk]
+    if not objs:
+        return
+    if uses_fts(using):
+        with connections[using].cursor() as cursor:
+            if replace:
+                rowids = [(_rowid(kind, obj.pk),) for obj in objs]
+                cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", rowids)
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, body) VALUES (%s, %s)",
+                [(_rowid(kind, obj.pk), _user_tokens(obj.user_id, _text(kind, obj))) for obj in objs]
+            )
+        return
+
+    with transaction.atomic(using=using):
+        if replace:
+            SearchToken.objects.using(using).filter(kind=kind, object_id__in=[obj.pk for obj in objs]).delete()
+        SearchToken.objects.using(using).bulk_create([
+            SearchToken(user_id=obj.user_id, token=token, kind=kind, object_id=obj.pk)
+            for obj in objs
+            for token in tokenize(_text(kind, obj))
+        ], batch_size=1000)
+
+
+def unindex_object(kind, object_id, using='default'):
+    if uses_fts(using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [_rowid(kind, object_id)])
+    else:
+        SearchToken.objects.using(using).filter(kind=kind, object_id=object_id).delete()
+
+
+def rebuild_search_index(user=None, using='default', chunk_size=2000):
+    """
+    Re-creates the index from the transaction tables, for every user or
+    just one. Returns the number of rows indexed.
+    """
+    fts = uses_fts(using)
+    ensure_fts_table(using)
+    indexed = 0
+    with transaction.atomic(using=using):
+        if fts:
+            with connections[using].cursor() as cursor:
+                if user is None:
+                    cursor.execute(f"DELETE FROM {FTS_TABLE}")
+                else:
+                    # By rowid: a row with blank text has no tokens to match
+                    for model, _, number in SEARCH_SOURCES.values():
+                        cursor.execute(
+                            f"DELETE FROM {FTS_TABLE} WHERE rowid IN "
+                            f"(SELECT id * 4 + %s FROM {model._meta.db_table} WHERE user_id = %s)",
+                            [number, user.pk]
+                        )
+        else:
+            existing = SearchToken.objects.using(using).all()
+            if user is not None:
+                existing = existing.filter(user=user)
+            existing.delete()
+
+        for kind, (model, text_field, _) in SEARCH_SOURCES.items():
+            qs = model.objects.using(using).only('id', 'user_id', text_field)
+            if user is not None:
+                qs = qs.filter(user=user)
+            batch = []
+            for obj in qs.iterator(chunk_size=chunk_size):
+                batch.append(obj)
+                if len(batch) >= chunk_size:
+                    index_objects(kind, batch, using, replace=False)
+                    indexed += len(batch)
+                    batch = []
+            index_objects(kind, batch, using, replace=False)
+            indexed += len(batch)
+    return indexed
+
+
+# =============================
+# Querying
+# =============================
+
+def parse_query(query):
+    """Search terms of a free-text query (each one used as a prefix)."""
+    return tokenize(query)[:MAX_QUERY_TERMS]
+
+
+def _match_expression(terms, user_id):
+    # Terms only contain letters and digits, so quoting them is enough
+    return ' AND '.join(f'"u{user_id}x{term}"*' for term in terms)
+
+
+def _prefix(term):
+    # A range rather than LIKE, so the (user, token) index serves it on
+    # every backend and collation
+    return Q(token__gte=term, token__lt=term + '\uffff')
+
+
+def _token_matches(user_id, kinds, terms, using):
+    """SearchToken rows grouped per (kind, object_id) that match every term."""
+    matches = SearchToken.objects.using(using).filter(user_id=user_id, kind__in=kinds)
+    matches = matches.filter(Q(*[_prefix(term) for term in terms], _connector=Q.OR))
+    # Every term has to be matched by at least one of the row's tokens
+    per_term = {
+        f'term_{i}': Max(Case(When(_prefix(term), then=Value(1)), default=Value(0), output_field=IntegerField()))
+        for i, term in enumerate(terms)
+    }
+    return matches.values('kind', 'object_id').annotate(**per_term).filter(**{name: 1 for name in per_term})
+
+
+def search_filter(kind, user_id, query, using='default'):
+    """
+    Q restricting a queryset of `kind` to the user's rows whose text
+    matches every term of query. None if query has no terms.
+    """
+    terms = parse_query(query)
+    if not terms:
+        return None
+    if uses_fts(using):
+        return Q(id__in=RawSQL(
+            f"SELECT rowid / 4 FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid %% 4 = %s",
+            [_match_expression(terms, user_id), SEARCH_SOURCES[kind][2]]
+        ))
+    return Q(id__in=_token_matches(user_id, [kind], terms, using).values('object_id'))
+
+
+def has_hits(user_id, query, kinds, using='default'):
+    """True if any of the user's rows of the kinds matches query in the index."""
+    terms = parse_query(query)
+    if not terms or not kinds:
+        return False
+    if uses_fts(using):
+        numbers = [SEARCH_SOURCES[kind][2] for kind in kinds]
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"SELECT 1 FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"AND rowid %% 4 IN ({', '.join(['%s'] * len(numbers))}) LIMIT 1",
+                [_match_expression(terms, user_id), *numbers]
+            )
+            return cursor.fetchone() is not None
+    return _token_matches(user_id, kinds, terms, using).exists()
+
+
+def ranked_hits(user_id, query, kinds, using='default', chunk_size=500):
+    """
+    Yields (kind, object_id) of the user's matching rows, best match
+    first, from a single pass over the index. Ties go to the most recently
+    added row.
+    """
+    terms = parse_query(query)
+    if not terms or not kinds:
+        return
+    kind_names = {number: kind for kind, (_, _, number) in SEARCH_SOURCES.items()}
+
+    if uses_fts(using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}), rowid DESC",
+                [_match_expression(terms, user_id)]
+            )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                for (rowid,) in rows:
+                    kind = kind_names[rowid % 4]
+                    if kind in kinds:
+                        yield kind, rowid // 4
+
+    # Whole-word hits count double a prefix hit
+    weight = Case(When(token__in=terms, then=Value(2)), default=Value(1), output_field=IntegerField())
+    ranked = _token_matches(user_id, kinds, terms, using).annotate(score=Sum(weight))
+    ranked = ranked.order_by('-score', '-object_id').values_list('kind', 'object_id')
+    yield from ranked.iterator(chunk_size=chunk_size)
+
+
+def create_search_index(sender, using='default', **kwargs):
+    """post_migrate: creates the FTS5 table and fills it the first time."""
+    if ensure_fts_table(using):
+        rebuild_search_index(using=using)
@@ -1,5 +1,8 @@
 from django.db.models import Sum
-from .models import Expense, Budget, BudgetNotification
+from .metrics import span
+from .models import Budget, BudgetNotification, MonthlyRollup
+from .projections import get_spending_pattern, needs_projection
+from .rollups import get_spending_by_category
 from django.utils import timezone
 from datetime import date
 from decimal import Decimal
@@ -16,31 +19,35 @@ def get_month_range(date_obj):
         end_date = date(year, month + 1, 1)
     return start_date, end_date
 
+@span('calculate_spending')
 def calculate_spending(user, month_date, category=None):
     """
     Calculates spending for a user in a given month.
     If category is provided, filters by that category.
     """
-    start_date, next_month_start = get_month_range(month_date)
+    start_date, _ = get_month_range(month_date)
     
-    qs = Expense.objects.filter(
+    # Read from the monthly rollup rather than the raw Expense rows
+    qs = MonthlyRollup.objects.filter(
         user=user,
-        date__gte=start_date,
-        date__lt=next_month_start
+        month=start_date,
+        kind='expense'
     )
     
     if category:
         qs = qs.filter(category=category)
         
-    val = qs.aggregate(Sum('amount'))['amount__sum']
+    val = qs.aggregate(Sum('total'))['total__sum']
     return Decimal(val) if val is not None else Decimal('0.00')
 
-def check_budget_state(user, budget):
+def check_budget_state(user, budget, spent=None):
     """
     Checks a specific budget to see if it is exceeded.
     Manages notification state (activate/deactivate).
+    Pass spent if the caller already knows it.
     """
-    spent = calculate_spending(user, budget.month, category=budget.category)
+    if spent is None:
+        spent = calculate_spending(user, budget.month, category=budget.category)
     
     if spent > budget.limit_amount:
         # Exceeded
@@ -72,6 +79,31 @@ def check_and_notify_limit(user, expense):
     except Budget.DoesNotExist:
         pass 
 
+@span('check_month_budgets')
+def check_month_budgets(user, month_date, category_ids):
+    """
+    Batch variant of check_and_notify_limit: checks the global budget and
+    the budgets of the given categories for one month.
+    """
+    month_start = date(month_date.year, month_date.month, 1)
+    budgets = [
+        b for b in Budget.objects.filter(user=user, month=month_start)
+        if b.category_id is None or b.category_id in category_ids
+    ]
+    if not budgets:
+        return
+    
+    # One spending query for all the month's budgets
+    spent_by_category = get_spending_by_category(user, month_start)
+    total_spent = sum(spent_by_category.values(), Decimal('0.00'))
+    
+    for budget in budgets:
+        if budget.category_id is None:
+            spent = total_spent
+        else:
+            spent = spent_by_category.get(budget.category_id, Decimal('0.00'))
+        check_budget_state(user, budget, spent=spent)
+
 def _create_notification_if_needed(user, budget, current_spent):
     """
     Internal helper to create budget notification if rate limits allow.
@@ -85,7 +117,7 @@ def _create_notification_if_needed(user, budget, current_spent):
 
     # No active notification, so create one.
     BudgetNotification.objects.create(
-        user=user,
+        user_id=budget.user_id,
         budget=budget,
         exceeded_amount=current_spent - budget.limit_amount,
         active=True
@@ -97,15 +129,12 @@ def _reset_notification(user, budget):
     """
     BudgetNotification.objects.filter(budget=budget, active=True).update(active=False)
 
-def get_budget_dashboard_data(user, month_date):
+def _build_budget_data(start_date, budgets, spent_by_category, projected_by_category=None):
     """
-    Returns a structured object with budget vs spending data for the UI.
+    Shapes one month of budgets and its {category_id: spent} map into the
+    structure the budget templates use. projected_by_category holds the
+    projected month-end spend (the spend so far if not given).
     """
-    start_date = date(month_date.year, month_date.month, 1)
-    
-    # Get all budgets for this month
-    budgets = Budget.objects.filter(user=user, month=start_date)
-    
     global_budget = None
     category_budgets = []
     
@@ -115,8 +144,10 @@ def get_budget_dashboard_data(user, month_date):
         else:
             category_budgets.append(b)
             
-    # Calculate global spending
-    total_spent = calculate_spending(user, start_date)
+    total_spent = sum(spent_by_category.values(), Decimal('0.00'))
+    if projected_by_category is None:
+        projected_by_category = spent_by_category
+    total_projected = sum(projected_by_category.values(), Decimal('0.00'))
     
     global_data = None
     if global_budget:
@@ -126,12 +157,15 @@ def get_budget_dashboard_data(user, month_date):
             'remaining': global_budget.limit_amount - total_spent,
             'percent': (total_spent / global_budget.limit_amount) * 100 if global_budget.limit_amount > 0 else 100,
             'is_exceeded': total_spent > global_budget.limit_amount,
+            'projected': total_projected,
+            'projected_to_exceed': total_projected > global_budget.limit_amount,
             'obj': global_budget
         }
         
     cat_data = []
     for cb in category_budgets:
-        c_spent = calculate_spending(user, start_date, category=cb.category)
+        c_spent = spent_by_category.get(cb.category_id, Decimal('0.00'))
+        c_projected = projected_by_category.get(cb.category_id, c_spent)
         cat_data.append({
             'category': cb.category,
             'limit': cb.limit_amount,
@@ -139,6 +173,8 @@ def get_budget_dashboard_data(user, month_date):
             'remaining': cb.limit_amount - c_spent,
             'percent': (c_spent / cb.limit_amount) * 100 if cb.limit_amount > 0 else 100,
             'is_exceeded': c_spent > cb.limit_amount,
+            'projected': c_projected,
+            'projected_to_exceed': c_projected > cb.limit_amount,
             'obj': cb
         })
         
@@ -146,5 +182,78 @@ def get_budget_dashboard_data(user, month_date):
         'month': start_date,
         'global': global_data,
         'categories': cat_data,
-        'total_spent': total_spent
+        'total_spent': total_spent,
+        'total_projected': total_projected
     }
+
+@span('get_budget_dashboard_data')
+def get_budget_dashboard_data(user, month_date):
+    """
+    Returns a structured object with budget vs spending data for the UI,
+    with month-end projections for the current and later months.
+    """
+    start_date = date(month_date.year, month_date.month, 1)
+    
+    # Get all budgets for this month
+    budgets = Budget.objects.filter(user=user, month=start_date).select_related('category')
+    
+    # Spending per category for the month, from one rollup query
+    spent_by_category = get_spending_by_category(user, start_date)
+    
+    projected_by_category = None
+    if needs_projection(start_date):
+        projected_by_category = get_spending_pattern(user).project({start_date: spent_by_category})[start_date]
+    
+    return _build_budget_data(start_date, budgets, spent_by_category, projected_by_category)
+
+def get_budget_months(user):
+    """
+    Distinct budget months for a user, newest first (a lazy queryset,
+    so it can be handed to a Paginator).
+    """
+    return Budget.objects.filter(user=user).order_by('-month').values_list('month', flat=True).distinct()
+
+@span('get_budget_summaries')
+def get_budget_summaries(user, months=None):
+    """
+    Batched get_budget_dashboard_data for many months at once.
+    Uses one query for the budgets and one for the spending of every
+    (month, category) pair, whatever the number of months, plus one
+    grouped query for the projections when the current or a later month
+    is included.
+    Returns the summaries newest month first.
+    """
+    budgets = Budget.objects.filter(user=user).select_related('category')
+    if months is not None:
+        months = list(months)
+        if not months:
+            return []
+        budgets = budgets.filter(month__in=months)
+    
+    budgets_by_month = {}
+    for b in budgets:
+        budgets_by_month.setdefault(b.month, []).append(b)
+    if not budgets_by_month:
+        return []
+    
+    spending = MonthlyRollup.objects.filter(
+        user=user,
+        kind='expense',
+        month__in=list(budgets_by_month)
+    ).values_list('month', 'category_id', 'total')
+    
+    spent_by_month = {}
+    for month, category_id, total in spending:
+        spent_by_month.setdefault(month, {})[category_id] = total
+    
+    # Month-end projections for every budget at once
+    projected_by_month = {}
+    upcoming = {month: spent_by_month.get(month, {}) for month in budgets_by_month if needs_projection(month)}
+    if upcoming:
+        projected_by_month = get_spending_pattern(user).project(upcoming)
+    
+    return [
+        _build_budget_data(month, budgets_by_month[month], spent_by_month.get(month, {}),
+                           projected_by_month.get(month))
+        for month in sorted(budgets_by_month, reverse=True)
+    ]
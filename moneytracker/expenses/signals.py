@@ -1,12 +1,266 @@
-from django.db.models.signals import post_save
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F
+from django.contrib.auth.models import User
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import Expense
-from .services import check_and_notify_limit
+from django.utils import timezone
+from .models import BalanceSnapshot, Expense, Income, Transfer, BankAccount, Category, MonthlyRollup
+from .rollups import apply_delta, month_start, rollup_key
+from .budget_checks import schedule_budget_check
+from .data_version import bump_data_version
+from .events import publish_change
+from .search import index_objects, unindex_object
+from .categorizer import CATEGORIZER_SOURCES, forget_categorizer, record_category_changes
+from .snapshots import patch_snapshots, snapshot_date
+
+
+# =============================
+# Per-user data version and change events
+# =============================
+# Defined before the rollup receivers on purpose: on_commit callbacks run
+# in registration order, so the version has moved by the time any change
+# event is published and listeners re-read the cached payloads.
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Income)
+@receiver(post_save, sender=Transfer)
+@receiver(post_save, sender=BankAccount)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+@receiver(post_delete, sender=Transfer)
+@receiver(post_delete, sender=BankAccount)
+@receiver(post_delete, sender=Category)
+def bump_version_on_write(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_data_version(instance.user_id)
+    if sender is Category:
+        # Renames show up in every month's breakdown
+        publish_change(instance.user_id, all_months=True)
+    else:
+        # The months themselves are published by the rollup receivers
+        publish_change(instance.user_id, balances=True)
+
+
+# =============================
+# Monthly rollup maintenance
+# =============================
+# Budget checks are queued from here and run after commit, so they
+# always see the updated totals.
+
+ROLLUP_FIELDS = {'user_id', 'date', 'category_id', 'amount'}
+
+
+def _remember_rollup_state(instance):
+    """Snapshot of the fields the rollup depends on, as last persisted."""
+    key = None
+    # Never touch deferred fields here, that would cost a query per row
+    if instance.pk and not (instance.get_deferred_fields() & ROLLUP_FIELDS):
+        key = rollup_key(instance)
+    instance._rollup_state = (key, Decimal(str(instance.amount))) if key else None
+
+
+def _sync_rollup(kind, instance):
+    """Moves the instance between rollup buckets; returns (old_key, new_key)."""
+    old = getattr(instance, '_rollup_state', None)
+    key = rollup_key(instance)
+    amount = Decimal(str(instance.amount))
+
+    if old and old[0] == key:
+        # Same bucket, only the amount may have changed
+        if old[1] != amount:
+            apply_delta(*key, kind, amount - old[1], 0)
+    else:
+        if old:
+            apply_delta(*old[0], kind, -old[1], -1)
+        apply_delta(*key, kind, amount, 1)
+
+    _remember_rollup_state(instance)
+    return (old[0] if old else None), key
+
+
+def _publish_months(user_id, *keys):
+    publish_change(user_id, months={key[1] for key in keys if key})
+
+
+@receiver(post_init, sender=Expense)
+@receiver(post_init, sender=Income)
+def remember_saved_state(sender, instance, **kwargs):
+    # One receiver for the rollup and categorizer snapshots: this runs for
+    # every row loaded
+    _remember_rollup_state(instance)
+    _remember_category_state(sender, instance)
+
+
+@receiver(pre_save, sender=Expense)
+@receiver(pre_save, sender=Income)
+@receiver(pre_delete, sender=Expense)
+@receiver(pre_delete, sender=Income)
+def load_rollup_state(sender, instance, raw=False, **kwargs):
+    """
+    Rows loaded with only()/defer() have no snapshot; read the persisted
+    bucket before the write so it is moved, not counted a second time.
+    """
+    if raw or instance._state.adding or getattr(instance, '_rollup_state', None):
+        return
+    row = sender.objects.filter(pk=instance.pk).values_list('user_id', 'date', 'category_id', 'amount').first()
+    if row:
+        instance._rollup_state = ((row[0], month_start(row[1]), row[2]), row[3])
+
 
 @receiver(post_save, sender=Expense)
-def check_budget_on_expense_save(sender, instance, created, **kwargs):
+def update_rollup_on_expense_save(sender, instance, raw=False, **kwargs):
     """
-    Trigger budget check whenever an expense is created or updated.
+    Keeps the rollup in step and queues budget checks for the bucket the
+    expense left (on a month/category move) and the one it is now in.
     """
-    if instance.user:
-        check_and_notify_limit(instance.user, instance)
+    if raw:
+        return
+    old_key, new_key = _sync_rollup('expense', instance)
+    if old_key and old_key != new_key:
+        schedule_budget_check(*old_key)
+    schedule_budget_check(*new_key)
+    _publish_months(instance.user_id, old_key, new_key)
+
+
+@receiver(post_save, sender=Income)
+def update_rollup_on_income_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        old_key, new_key = _sync_rollup('income', instance)
+        _publish_months(instance.user_id, old_key, new_key)
+
+
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+def update_rollup_on_delete(sender, instance, **kwargs):
+    old = getattr(instance, '_rollup_state', None)
+    if old:
+        kind = 'expense' if sender is Expense else 'income'
+        apply_delta(*old[0], kind, -old[1], -1)
+        if sender is Expense:
+            # Deleting can bring a budget back under its limit
+            schedule_budget_check(*old[0])
+        _publish_months(instance.user_id, old[0])
+
+
+@receiver(pre_delete, sender=Category)
+def merge_rollups_on_category_delete(sender, instance, origin=None, **kwargs):
+    """
+    The category's expenses and incomes move to no category through a
+    signal-less UPDATE (SET_NULL), so move its rollup buckets into the
+    uncategorized ones before they are cascaded away.
+    """
+    if isinstance(origin, User) or getattr(origin, 'model', None) is User:
+        # The user's rollups are going too
+        return
+    buckets = MonthlyRollup.objects.filter(category=instance)
+    for user_id, month, kind, total, count in buckets.values_list('user_id', 'month', 'kind', 'total', 'count'):
+        apply_delta(user_id, month, None, kind, total, count)
+    buckets.delete()
+
+
+# =============================
+# Search index
+# =============================
+
+SEARCH_KINDS = {Expense: 'expense', Income: 'income', Transfer: 'transfer'}
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Income)
+@receiver(post_save, sender=Transfer)
+def update_search_index(sender, instance, raw=False, using='default', **kwargs):
+    if not raw:
+        index_objects(SEARCH_KINDS[sender], [instance], using)
+
+
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+@receiver(post_delete, sender=Transfer)
+def remove_from_search_index(sender, instance, using='default', **kwargs):
+    unindex_object(SEARCH_KINDS[sender], instance.pk, using)
+
+
+# =============================
+# Category suggestions
+# =============================
+
+CATEGORIZER_KINDS = {Expense: 'expense', Income: 'income'}
+
+
+def _remember_category_state(sender, instance):
+    """(text, category_id) as last persisted, what the categorizer learnt."""
+    text_field = CATEGORIZER_SOURCES[CATEGORIZER_KINDS[sender]][1]
+    state = None
+    if instance.pk and not (instance.get_deferred_fields() & {text_field, 'category_id'}):
+        state = (getattr(instance, text_field), instance.category_id)
+    instance._category_state = state
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Income)
+def update_categorizer_on_save(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, '_category_state', None)
+    _remember_category_state(sender, instance)
+    new = instance._category_state
+    if old == new or (old is None and not created):
+        # Unchanged, or the previous values are unknown (deferred fields)
+        return
+    changes = [(*new, 1)]
+    if old:
+        changes.append((*old, -1))
+    record_category_changes(instance.user_id, CATEGORIZER_KINDS[sender], changes)
+
+
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+def update_categorizer_on_delete(sender, instance, **kwargs):
+    old = getattr(instance, '_category_state', None)
+    if old:
+        record_category_changes(instance.user_id, CATEGORIZER_KINDS[sender], [(*old, -1)])
+
+
+@receiver(post_delete, sender=Category)
+def forget_categorizer_on_category_delete(sender, instance, **kwargs):
+    # Rows are moved to no category by a queryset update, without signals
+    transaction.on_commit(lambda: forget_categorizer(instance.user_id))
+
+
+# =============================
+# Opening balances and snapshots
+# =============================
+# Transactions patch the snapshots through the balance ledger. Here: the
+# balance an account is opened with, and direct edits of it, which correct
+# the opening balance and so move the account's whole history (as
+# rebuild_snapshots and the reconciliation see it).
+
+@receiver(post_init, sender=BankAccount)
+def remember_account_balance(sender, instance, **kwargs):
+    instance._saved_balance = None
+    if instance.pk and 'balance' not in instance.get_deferred_fields():
+        instance._saved_balance = instance.balance
+
+
+@receiver(post_save, sender=BankAccount)
+def track_opening_balance(sender, instance, raw=False, created=False, **kwargs):
+    if raw:
+        return
+    old = Decimal('0.00') if created else instance._saved_balance
+    instance._saved_balance = instance.balance
+    if old is None:
+        # Previous balance unknown (deferred field)
+        return
+    delta = Decimal(str(instance.balance)) - Decimal(str(old))
+    account = BankAccount.objects.filter(pk=instance.pk)
+    with transaction.atomic():
+        if created and instance.opening_balance is None:
+            instance.opening_balance = instance.balance
+            account.update(opening_balance=instance.balance)
+        elif delta:
+            account.exclude(opening_balance=None).update(opening_balance=F('opening_balance') + delta)
+        if delta and not BalanceSnapshot.objects.filter(account=instance).update(balance=F('balance') + delta):
+            patch_snapshots({(instance.pk, snapshot_date(timezone.localdate())): delta})
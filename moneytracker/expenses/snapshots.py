@@ -0,0 +1,119 @@
+import calendar
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .data_version import bump_data_version
+from .events import publish_change
+from .models import BalanceSnapshot, BankAccount, Expense, Income, Transfer
+
+# =============================
+# Balance snapshots
+# =============================
+# BalanceSnapshot rows hold each account's balance at the end of the days
+# (or months) it changed. The balance ledger hands every dated change to
+# patch_snapshots in the same transaction as the balance update: the
+# change's own row is updated or created and every later row of the
+# account moves by the same amount with one UPDATE, so backdated edits
+# keep the whole history right.
+
+# Money in (+) and out (-) of an account, as (model, account field, sign)
+BALANCE_SOURCES = [
+    (Income, 'account_id', 1),
+    (Expense, 'account_id', -1),
+    (Transfer, 'to_account_id', 1),
+    (Transfer, 'from_account_id', -1),
+]
+
+
+def snapshot_date(day):
+    """The snapshot a change on day counts towards (its day or month end)."""
+    if getattr(settings, 'BALANCE_SNAPSHOT_GRANULARITY', 'day') == 'month':
+        return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+    return day
+
+
+def _balance_at(account_id, day):
+    """
+    The account's balance at the end of day: its current balance less
+    everything dated later. Only needed for the account's first row.
+    """
+    user_id, balance = BankAccount.objects.filter(pk=account_id).values_list('user_id', 'balance').get()
+    for model, field, sign in BALANCE_SOURCES:
+        later = model.objects.filter(user_id=user_id, **{field: account_id}, date__gt=day)
+        balance -= sign * (later.aggregate(total=Sum('amount'))['total'] or Decimal('0.00'))
+    return user_id, balance
+
+
+def patch_snapshots(deltas):
+    """
+    Applies {(account_id, snapshot date): change} to the snapshots, after
+    the balances themselves were updated (BalanceLedger.apply).
+    """
+    for (account_id, day), delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        rows = BalanceSnapshot.objects.filter(account_id=account_id)
+        rows.filter(date__gt=day).update(balance=F('balance') + delta)
+        if rows.filter(date=day).update(balance=F('balance') + delta):
+            continue
+
+        # No row for this period yet: start from the previous one
+        previous = rows.filter(date__lt=day).order_by('-date').values_list('user_id', 'balance').first()
+        user_id, balance = (previous[0], previous[1] + delta) if previous else _balance_at(account_id, day)
+        try:
+            with transaction.atomic():
+                BalanceSnapshot.objects.create(user_id=user_id, account_id=account_id, date=day, balance=balance)
+        except IntegrityError:
+            # Another writer created the row first
+            rows.filter(date=day).update(balance=F('balance') + delta)
+
+
+def rebuild_snapshots(user=None):
+    """
+    Recomputes every snapshot from the raw transactions, taking the
+    current balances as the end point. Restricted to one user if given.
+    Returns the number of rows written.
+    """
+    accounts = BankAccount.objects.all()
+    if user is not None:
+        accounts = accounts.filter(user=user)
+
+    changes = defaultdict(lambda: defaultdict(Decimal))
+    for model, field, sign in BALANCE_SOURCES:
+        qs = model.objects.all()
+        if user is not None:
+            qs = qs.filter(user=user)
+        grouped = qs.exclude(**{field: None}).values_list(field, 'date').annotate(total=Sum('amount')).order_by()
+        for account_id, day, total in grouped:
+            changes[account_id][snapshot_date(day)] += sign * total
+
+    today = snapshot_date(timezone.localdate())
+    rows = []
+    for account_id, user_id, balance in accounts.values_list('id', 'user_id', 'balance'):
+        by_day = changes.get(account_id)
+        if not by_day:
+            # Only the balance it was opened with
+            if balance:
+                rows.append(BalanceSnapshot(user_id=user_id, account_id=account_id, date=today, balance=balance))
+            continue
+        running = balance - sum(by_day.values(), Decimal('0.00'))
+        for day in sorted(by_day):
+            running += by_day[day]
+            rows.append(BalanceSnapshot(user_id=user_id, account_id=account_id, date=day, balance=running))
+
+    with transaction.atomic():
+        existing = BalanceSnapshot.objects.all()
+        if user is not None:
+            existing = existing.filter(user=user)
+        touched = {row.user_id for row in rows} | set(existing.order_by().values_list('user_id', flat=True).distinct())
+        existing.delete()
+        BalanceSnapshot.objects.bulk_create(rows, batch_size=1000)
+        # Net worth histories are cached against the data version
+        for user_id in touched:
+            bump_data_version(user_id)
+            publish_change(user_id, balances=True)
+    return len(rows)
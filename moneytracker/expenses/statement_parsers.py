@@ -0,0 +1,318 @@
+import csv
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+# =============================
+# Statement parsing
+# =============================
+# Pure functions, no Django imports: these run inside the import worker
+# processes (see statements.py), which only receive plain data.
+#
+# A statement is split into units (one CSV file, one XLSX sheet, a range
+# of PDF pages) and each unit is turned into normalized rows:
+#   {'type', 'date', 'amount', 'description', 'line'}
+# ready for the bulk-insert path once the account is filled in. Dates and
+# amounts are date/Decimal objects, which the form fields take as they are.
+
+# Rows scanned at the top of a unit for the header row
+HEADER_SCAN_ROWS = 30
+# PDF pages handed to a worker at once (each task reopens the file)
+PDF_PAGES_PER_TASK = 4
+
+DEBIT_MARKERS = {'dr', 'debit', 'd', 'withdrawal'}
+# Expense.description / Income.source lengths
+TEXT_LIMITS = {'expense': 255, 'income': 100}
+
+_SPACES = re.compile(r'\s+')
+_AMOUNT_JUNK = re.compile(r'[^\d.,\-()]')
+
+
+class StatementError(Exception):
+    """A statement that cannot be read at all (wrong format, no header)."""
+
+
+def _clean(value):
+    if value is None:
+        return ''
+    return _SPACES.sub(' ', str(value)).strip()
+
+
+def find_header(cells, profile):
+    """
+    Maps the profile's column roles ('date', 'description', 'amount',
+    'debit', 'credit', 'direction') to indexes of a header row, or returns
+    None if the row is not a header for this profile.
+    """
+    names = [_clean(cell).lower() for cell in cells]
+    columns = {}
+    for role in ('date', 'description', 'amount', 'debit', 'credit', 'direction'):
+        for alias in profile.get(role, ()):
+            if alias in names:
+                columns[role] = names.index(alias)
+                break
+    if 'date' not in columns or 'description' not in columns:
+        return None
+    if 'amount' not in columns and 'debit' not in columns and 'credit' not in columns:
+        return None
+    return columns
+
+
+def parse_date(value, formats):
+    """date from a cell (date, datetime or text in one of formats), or None."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = _clean(value)
+    if not text:
+        return None
+    for fmt in formats:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_amount(value, decimal_comma=False):
+    """
+    Signed Decimal from a cell: handles currency symbols, thousands
+    separators, '(12.00)' and trailing minus or 'CR'/'DR'. None if empty
+    or unreadable.
+    """
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return Decimal(str(value))
+    text = _clean(value)
+    marks = _AMOUNT_JUNK.sub('', text)
+    negative = marks.startswith(('-', '(')) or marks.endswith('-') or text.lower().endswith('dr')
+    digits = marks.strip('()-')
+    if decimal_comma:
+        digits = digits.replace('.', '').replace(',', '.')
+    else:
+        digits = digits.replace(',', '')
+    if not digits:
+        return None
+    try:
+        amount = Decimal(digits)
+    except InvalidOperation:
+        return None
+    return -amount if negative else amount
+
+
+def _signed_amount(cells, columns, profile):
+    """Money in as positive, money out as negative; None if no amount."""
+    decimal_comma = profile.get('decimal_comma', False)
+
+    def cell(role):
+        index = columns.get(role)
+        return cells[index] if index is not None and index < len(cells) else None
+
+    if 'amount' in columns:
+        amount = parse_amount(cell('amount'), decimal_comma)
+        if amount is None:
+            return None
+        if 'direction' in columns:
+            is_debit = _clean(cell('direction')).lower() in DEBIT_MARKERS
+            amount = -abs(amount) if is_debit else abs(amount)
+        elif profile.get('expenses_positive'):
+            # Card statements list charges as positive amounts
+            amount = -amount
+        return amount
+
+    debit = parse_amount(cell('debit'), decimal_comma)
+    credit = parse_amount(cell('credit'), decimal_comma)
+    if debit:
+        return -abs(debit)
+    if credit:
+        return abs(credit)
+    return None
+
+
+def normalize_rows(table, profile, columns=None, wrapped_lines=False):
+    """
+    Turns raw rows (lists of cells) into normalized transactions.
+
+    Returns (columns, rows, skipped, errors). columns is the header mapping
+    found in table (or the one passed in, for PDF pages without their own
+    header); errors are (line, message) pairs. Rows without a readable
+    date (titles, balances, footers) are skipped; dated rows without an
+    amount are errors. With wrapped_lines, a row with only text right
+    after a transaction continues its description, as in PDF tables.
+    """
+    formats = profile.get('date_formats', ())
+    rows = []
+    errors = []
+    skipped = 0
+
+    for position, cells in enumerate(table):
+        line = position + 1
+        cells = list(cells)
+        if columns is None:
+            if position >= HEADER_SCAN_ROWS:
+                break
+            columns = find_header(cells, profile)
+            continue
+        if not any(_clean(cell) for cell in cells):
+            continue
+        if find_header(cells, profile) is not None:
+            # Repeated header (e.g. on every PDF page)
+            continue
+
+        def cell(role):
+            index = columns.get(role)
+            return cells[index] if index is not None and index < len(cells) else None
+
+        day = parse_date(cell('date'), formats)
+        description = _clean(cell('description'))
+        if day is None:
+            continuation = (
+                wrapped_lines and rows and description and not _clean(cell('date'))
+                and _signed_amount(cells, columns, profile) is None
+            )
+            if continuation:
+                rows[-1]['description'] = f"{rows[-1]['description']} {description}"
+            else:
+                skipped += 1
+            continue
+
+        amount = _signed_amount(cells, columns, profile)
+        if amount is None:
+            errors.append((line, "missing or unreadable amount"))
+            continue
+        if amount == 0:
+            skipped += 1
+            continue
+
+        rows.append({
+            'type': 'income' if amount > 0 else 'expense',
+            'date': day,
+            'amount': abs(amount),
+            'description': description,
+            'line': line,
+        })
+
+    for row in rows:
+        text = row['description'] or profile.get('default_description', 'Statement import')
+        row['description'] = text[:TEXT_LIMITS[row['type']]]
+    return columns, rows, skipped, errors
+
+
+# =============================
+# Readers (one unit each)
+# =============================
+
+def _read_csv(path, profile):
+    encoding = profile.get('encoding', 'utf-8-sig')
+    with open(path, newline='', encoding=encoding, errors='replace') as handle:
+        sample = handle.read(4096)
+        handle.seek(0)
+        delimiter = profile.get('delimiter')
+        if not delimiter:
+            try:
+                delimiter = csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+            except csv.Error:
+                delimiter = ','
+        try:
+            return list(csv.reader(handle, delimiter=delimiter))
+        except csv.Error as e:
+            raise StatementError(f"Not a readable CSV file ({e})") from e
+
+
+def _open_workbook(path, **options):
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        return load_workbook(path, **options)
+    # KeyError: a zip without the workbook parts
+    except (InvalidFileException, zipfile.BadZipFile, KeyError) as e:
+        raise StatementError(f"Not a readable XLSX file ({e})") from e
+
+
+def _read_xlsx(path, sheet_index):
+    workbook = _open_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[sheet_index]
+        return [list(row) for row in sheet.iter_rows(values_only=True)]
+    finally:
+        workbook.close()
+
+
+def _pdf_errors():
+    from pdfminer.psparser import PSException
+    from pdfplumber.utils.exceptions import PdfminerException
+
+    return PdfminerException, PSException
+
+
+def _read_pdf(path, first_page, last_page):
+    import pdfplumber
+
+    table = []
+    try:
+        with pdfplumber.open(path) as pdf:
+            for page in pdf.pages[first_page:last_page]:
+                for page_table in page.extract_tables():
+                    table.extend(page_table)
+    except _pdf_errors() as e:
+        raise StatementError(f"Not a readable PDF file ({e})") from e
+    return table
+
+
+def parse_unit(task):
+    """
+    Worker entry point. task is (fmt, path, part, profile, label) where part
+    is None for CSV, a sheet index for XLSX and a (first, last) page range
+    for PDF. Returns a dict with the label, the header mapping and the
+    normalize_rows results, or with the label and an error if the unit
+    cannot be read.
+    """
+    fmt, path, part, profile, label = task
+    try:
+        if fmt == 'csv':
+            table = _read_csv(path, profile)
+        elif fmt == 'xlsx':
+            table = _read_xlsx(path, part)
+        elif fmt == 'pdf':
+            table = _read_pdf(path, *part)
+        else:
+            raise StatementError(f"Unsupported statement format '{fmt}'")
+    except StatementError as e:
+        return {'label': label, 'error': str(e)}
+    found, rows, skipped, errors = normalize_rows(table, profile, wrapped_lines=fmt == 'pdf')
+    if found is None:
+        # No header here (e.g. a continuation PDF page): hand the raw table
+        # back so the header of an earlier unit can be applied to it
+        return {'label': label, 'columns': None, 'table': table}
+    return {'label': label, 'columns': found, 'rows': rows, 'skipped': skipped, 'errors': errors}
+
+
+def split_statement(fmt, path):
+    """
+    Parts of a statement that can be parsed independently. Raises
+    StatementError if the file cannot be opened as fmt.
+    """
+    if fmt == 'csv':
+        return [(None, '')]
+    if fmt == 'xlsx':
+        workbook = _open_workbook(path, read_only=True)
+        try:
+            return [(index, f'sheet {name}') for index, name in enumerate(workbook.sheetnames)]
+        finally:
+            workbook.close()
+    if fmt == 'pdf':
+        import pdfplumber
+
+        try:
+            with pdfplumber.open(path) as pdf:
+                page_count = len(pdf.pages)
+        except _pdf_errors() as e:
+            raise StatementError(f"Not a readable PDF file ({e})") from e
+        return [
+            ((first, min(first + PDF_PAGES_PER_TASK, page_count)),
+             f'pages {first + 1}-{min(first + PDF_PAGES_PER_TASK, page_count)}')
+            for first in range(0, page_count, PDF_PAGES_PER_TASK)
+        ]
+    raise StatementError(f"Unsupported statement format '{fmt}'")
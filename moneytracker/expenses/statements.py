@@ -0,0 +1,252 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from .bulk import BulkValidator, describe_duplicate, insert_transactions, split_duplicates, validate_transactions
+from .categorizer import get_categorizer
+from .statement_parsers import StatementError, normalize_rows, parse_unit, split_statement
+
+# =============================
+# Bank statement import
+# =============================
+# A statement (CSV, XLSX or PDF) is read through a bank profile that names
+# its columns. Files are split into units (a CSV file, an XLSX sheet, a few
+# PDF pages), parsed in a process pool, and the normalized rows are
+# streamed in batches through the bulk-insert path while later units are
+# still being parsed.
+
+STATEMENT_FORMATS = {
+    '.csv': 'csv',
+    '.xlsx': 'xlsx',
+    '.xlsm': 'xlsx',
+    '.pdf': 'pdf',
+}
+
+_COMMON_DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%d-%m-%Y', '%d %b %Y', '%d-%b-%Y', '%d/%m/%y']
+
+# Column names are matched case-insensitively against the first names in
+# each list; date formats are tried in order. Add or override profiles with
+# the EXPENSES_STATEMENT_PROFILES setting (same shape).
+STATEMENT_PROFILES = {
+    'generic': {
+        'label': "Generic (Date, Description, Amount or Debit/Credit)",
+        'date': ['date', 'transaction date', 'txn date', 'posting date', 'posted date', 'value date'],
+        'description': ['description', 'narration', 'details', 'particulars', 'memo', 'payee'],
+        'amount': ['amount', 'transaction amount'],
+        'debit': ['debit', 'withdrawal', 'withdrawals', 'money out', 'paid out'],
+        'credit': ['credit', 'deposit', 'deposits', 'money in', 'paid in'],
+        'direction': ['dr/cr', 'cr/dr'],
+        'date_formats': _COMMON_DATE_FORMATS,
+    },
+    'hdfc': {
+        'label': "HDFC Bank account statement",
+        'date': ['date'],
+        'description': ['narration'],
+        'debit': ['withdrawal amt.', 'withdrawal amount'],
+        'credit': ['deposit amt.', 'deposit amount'],
+        'date_formats': ['%d/%m/%y', '%d/%m/%Y'],
+    },
+    'sbi': {
+        'label': "SBI account statement",
+        'date': ['txn date', 'transaction date'],
+        'description': ['description'],
+        'debit': ['debit'],
+        'credit': ['credit'],
+        'date_formats': ['%d %b %Y', '%d-%b-%Y', '%d/%m/%Y'],
+    },
+    'icici': {
+        'label': "ICICI Bank account statement",
+        'date': ['transaction date', 'value date'],
+        'description': ['transaction remarks', 'remarks'],
+        'debit': ['withdrawal amount (inr )', 'withdrawal amount (inr)', 'withdrawal amount'],
+        'credit': ['deposit amount (inr )', 'deposit amount (inr)', 'deposit amount'],
+        'date_formats': ['%d/%m/%Y', '%d-%m-%Y'],
+    },
+    'chase': {
+        'label': "Chase checking (CSV download)",
+        'date': ['posting date'],
+        'description': ['description'],
+        'amount': ['amount'],
+        'date_formats': ['%m/%d/%Y'],
+    },
+    'credit_card': {
+        'label': "Credit card (charges as positive amounts)",
+        'date': ['date', 'transaction date', 'posted date'],
+        'description': ['description', 'details', 'merchant'],
+        'amount': ['amount'],
+        'expenses_positive': True,
+        'date_formats': _COMMON_DATE_FORMATS,
+    },
+}
+
+
+def get_statement_profiles():
+    """Built-in profiles merged with EXPENSES_STATEMENT_PROFILES."""
+    profiles = dict(STATEMENT_PROFILES)
+    profiles.update(getattr(settings, 'EXPENSES_STATEMENT_PROFILES', {}))
+    return profiles
+
+
+def statement_format(filename):
+    """'csv', 'xlsx' or 'pdf' from a file name; raises StatementError otherwise."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in STATEMENT_FORMATS:
+        raise StatementError(f"Unsupported file type '{extension or filename}'. Use CSV, XLSX or PDF.")
+    return STATEMENT_FORMATS[extension]
+
+
+class StatementSource:
+    """One statement file to import into one account."""
+
+    def __init__(self, path, profile, account, name=None):
+        self.path = path
+        self.profile = profile
+        self.account = account
+        self.name = name or os.path.basename(path)
+        self.format = statement_format(self.name)
+
+
+class ImportProgress:
+    """Running counters of an import, handed to the progress callback."""
+
+    def __init__(self):
+        self.units_total = 0
+        self.units_done = 0
+        self.rows_parsed = 0
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []
+        self.duplicates = []
+
+    def as_dict(self):
+        return {
+            'units_total': self.units_total,
+            'units_done': self.units_done,
+            'rows_parsed': self.rows_parsed,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'error_count': len(self.errors),
+            'duplicate_count': len(self.duplicates),
+        }
+
+
+def _parsed_units(tasks, workers):
+    """Parsed units in task order; parsing runs ahead of the caller."""
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        # Not worth starting processes for
+        yield from map(parse_unit, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(parse_unit, tasks)
+
+
+def import_statements(user, sources, workers=None, batch_size=None, progress=None, skip_duplicates=True):
+    """
+    Imports statement files for user. Returns the final ImportProgress.
+
+    Rows get the category the user's categorizer suggests, if any. Rows
+    that fail parsing or validation are reported in progress.errors (as
+    "file, part, line N: message"), as are parts that cannot be read, and
+    the rest are imported; each batch is committed on its own through the
+    bulk-insert path. progress, if given, is called with the ImportProgress
+    after every unit and batch.
+
+    With skip_duplicates, rows whose fingerprint matches a stored
+    transaction (e.g. a statement imported twice) are left out and listed
+    in progress.duplicates; each batch is checked with one query.
+    """
+    profiles = get_statement_profiles()
+    if workers is None:
+        workers = getattr(settings, 'STATEMENT_IMPORT_WORKERS', None) or os.cpu_count() or 1
+    if batch_size is None:
+        batch_size = getattr(settings, 'STATEMENT_IMPORT_BATCH_SIZE', 500)
+
+    tasks = []
+    task_sources = []
+    for source in sources:
+        if source.profile not in profiles:
+            raise StatementError(f"Unknown statement profile '{source.profile}'")
+        profile = profiles[source.profile]
+        try:
+            parts = split_statement(source.format, source.path)
+        except StatementError as e:
+            raise StatementError(f"{source.name}: {e}") from e
+        for part, part_label in parts:
+            label = f'{source.name}, {part_label}' if part_label else source.name
+            tasks.append((source.format, source.path, part, profile, label))
+            task_sources.append(source)
+
+    state = ImportProgress()
+    state.units_total = len(tasks)
+    # Account and category lookups are loaded once for the whole import
+    validator = BulkValidator(user)
+    categorizer = get_categorizer(user.id)
+    batch = []
+    labels = []
+
+    def report():
+        if progress:
+            progress(state)
+
+    def flush():
+        new_rows, row_errors = validate_transactions(validator, batch)
+        for index, error in row_errors:
+            state.errors.append(f"{labels[index]}: {error}")
+        if skip_duplicates:
+            new_rows, matched = split_duplicates(user, new_rows)
+            state.duplicates.extend(f"{labels[index]}: {describe_duplicate(obj)}" for index, obj in matched)
+        state.imported += insert_transactions(user, new_rows)
+        batch.clear()
+        labels.clear()
+        report()
+
+    header = {}
+    for task, source, result in zip(tasks, task_sources, _parsed_units(tasks, workers)):
+        label = result['label']
+        if 'error' in result:
+            # Unreadable part: reported, and the others are still imported
+            state.errors.append(f"{label}: {result['error']}")
+            state.units_done += 1
+            report()
+            continue
+        if result['columns'] is None:
+            # Continuation pages reuse the header of the statement's last unit
+            columns = header.get(source.path)
+            if columns is None:
+                state.errors.append(f"{label}: no header row matching profile '{source.profile}'")
+                state.units_done += 1
+                report()
+                continue
+            _, rows, skipped, errors = normalize_rows(
+                result['table'], task[3], columns, wrapped_lines=source.format == 'pdf'
+            )
+        else:
+            header[source.path] = result['columns']
+            rows, skipped, errors = result['rows'], result['skipped'], result['errors']
+
+        state.units_done += 1
+        state.rows_parsed += len(rows)
+        state.skipped += skipped
+        state.errors.extend(f"{label}, line {line}: {error}" for line, error in errors)
+
+        for row in rows:
+            category_id = categorizer.predict(row['type'], row['description'])[0]
+            if category_id not in validator.categories[row['type']]:
+                category_id = None
+            batch.append({
+                'type': row['type'],
+                'date': row['date'],
+                'amount': row['amount'],
+                'description': row['description'],
+                'account_id': source.account.pk if source.account else None,
+                'category_id': category_id,
+            })
+            labels.append(f"{label}, line {row['line']}")
+            if len(batch) >= batch_size:
+                flush()
+        report()
+
+    if batch:
+        flush()
+    return state
@@ -0,0 +1,221 @@
+import random
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from accounts.models import Connection, Profile
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from .models import BankAccount, Budget, Category, Expense, Income, Transfer, year_month_key
+from .rollups import rebuild_rollups
+from .search import rebuild_search_index
+from .snapshots import rebuild_snapshots
+
+# =============================
+# Synthetic data
+# =============================
+# Realistic-looking users for benchmarks and local testing: a few accounts,
+# the usual categories with merchant descriptions, monthly salary and
+# rent, budgets for recent months and accepted partner connections. Rows
+# are written with bulk_create, which skips save() and the signals, so
+# the derived fields (year_month, fingerprint, balances) and tables
+# (rollups, search index, snapshots) are filled in here.
+
+# name: (merchants, amount range, relative frequency)
+EXPENSE_CATEGORIES = {
+    'Groceries': (['Whole Foods', 'Trader Joes', 'Safeway', 'Costco', 'Aldi'], (12, 180), 22),
+    'Dining': (['Starbucks', 'Chipotle', 'Pizza Place', 'Sushi Bar', 'Thai Kitchen'], (5, 90), 20),
+    'Transport': (['Uber', 'Lyft', 'Shell', 'Chevron', 'Metro Card'], (8, 70), 14),
+    'Shopping': (['Amazon', 'Target', 'Best Buy', 'IKEA'], (10, 400), 10),
+    'Entertainment': (['Netflix', 'Spotify', 'AMC Theatres', 'Steam'], (8, 60), 7),
+    'Utilities': (['Electric Company', 'Comcast Internet', 'Water Utility', 'Verizon Wireless'], (40, 200), 5),
+    'Health': (['CVS Pharmacy', 'Walgreens', 'Dental Clinic', 'Gym Membership'], (10, 250), 4),
+}
+INCOME_CATEGORIES = {
+    'Freelance': (['Upwork', 'Client invoice'], (150, 1500), 3),
+    'Interest': (['Savings interest'], (1, 40), 1),
+}
+# Paid every month on a fixed day: (category, kind, description, amount range, day)
+MONTHLY_ITEMS = [
+    ('Salary', 'income', 'Acme Corp Payroll', (3000, 6000), 1),
+    ('Rent', 'expense', 'Monthly Rent', (1200, 2400), 3),
+]
+# (name, type, opening balance range)
+ACCOUNTS = [
+    ('Checking', 'checking', (1000, 5000)),
+    ('Savings', 'savings', (2000, 20000)),
+    ('Credit Card', 'credit', (0, 0)),
+]
+# Share of the generated transactions that are expenses, incomes and transfers
+TRANSACTION_MIX = (0.75, 0.17, 0.08)
+# Categories with their own budget, besides the monthly total
+BUDGETED_CATEGORIES = ['Groceries', 'Dining', 'Shopping', 'Rent']
+BUDGET_MONTHS = 4
+
+
+def _amount(rng, low, high):
+    return Decimal(f'{rng.uniform(low, high):.2f}')
+
+
+def _pick(rng, table):
+    names = list(table)
+    return rng.choices(names, weights=[table[name][2] for name in names])[0]
+
+
+def _describe(rng, merchants):
+    merchant = rng.choice(merchants)
+    return f'{merchant} #{rng.randint(1000, 9999)}' if rng.random() < 0.3 else merchant
+
+
+def _first_of_month(day, back=0):
+    month = day.year * 12 + day.month - 1 - back
+    return day.replace(year=month // 12, month=month % 12 + 1, day=1)
+
+
+def _user_rows(rng, user, accounts, categories, transactions, months, today):
+    """
+    (expenses, incomes, transfers, opening balances) for one user: the
+    monthly items first, then random rows up to transactions in total.
+    """
+    checking, savings, card = accounts
+    start = _first_of_month(today, months - 1)
+    span = (today - start).days + 1
+    opening = {account.pk: _amount(rng, *ACCOUNTS[i][2]) for i, account in enumerate(accounts)}
+    expenses, incomes, transfers = [], [], []
+
+    for back in range(months):
+        month = _first_of_month(today, back)
+        for category, kind, description, amounts, day in MONTHLY_ITEMS:
+            day = month.replace(day=day)
+            if day > today or len(expenses) + len(incomes) >= transactions:
+                continue
+            row = dict(user=user, account=checking, category=categories[kind, category], date=day,
+                       amount=_amount(rng, *amounts))
+            if kind == 'income':
+                incomes.append(Income(source=description, **row))
+            else:
+                expenses.append(Expense(description=description, **row))
+
+    expense_share, income_share, _ = TRANSACTION_MIX
+    for _ in range(transactions - len(expenses) - len(incomes)):
+        day = start + timedelta(days=rng.randrange(span))
+        kind = rng.random()
+        if kind < expense_share:
+            name = _pick(rng, EXPENSE_CATEGORIES)
+            merchants, amounts, _ = EXPENSE_CATEGORIES[name]
+            expenses.append(Expense(
+                user=user, account=card if rng.random() < 0.4 else checking,
+                category=categories['expense', name] if rng.random() < 0.95 else None,
+                description=_describe(rng, merchants), amount=_amount(rng, *amounts), date=day,
+            ))
+        elif kind < expense_share + income_share:
+            name = _pick(rng, INCOME_CATEGORIES)
+            merchants, amounts, _ = INCOME_CATEGORIES[name]
+            account = savings if name == 'Interest' else checking
+            incomes.append(Income(
+                user=user, account=account, category=categories['income', name],
+                source=_describe(rng, merchants), amount=_amount(rng, *amounts), date=day,
+            ))
+        elif rng.random() < 0.5:
+            transfers.append(Transfer(user=user, from_account=checking, to_account=card, date=day,
+                                      amount=_amount(rng, 100, 1500), description='Card payment'))
+        else:
+            transfers.append(Transfer(user=user, from_account=checking, to_account=savings, date=day,
+                                      amount=_amount(rng, 50, 800), description='Savings'))
+    return expenses, incomes, transfers, opening
+
+
+def _budgets(rng, user, categories, expenses, today):
+    """Monthly total and per-category budgets near the user's average spending."""
+    spent = defaultdict(Decimal)
+    months = set()
+    for expense in expenses:
+        months.add(expense.year_month)
+        spent[expense.category.name if expense.category else None] += expense.amount
+    count = len(months) or 1
+
+    budgets = []
+    for back in range(BUDGET_MONTHS):
+        month = _first_of_month(today, back)
+        total = sum(spent.values(), Decimal('0.00')) / count
+        budgets.append(Budget(user=user, month=month, category=None,
+                              limit_amount=(total * Decimal(rng.uniform(0.9, 1.2))).quantize(Decimal('1'))))
+        for name in BUDGETED_CATEGORIES:
+            if spent[name]:
+                limit = spent[name] / count * Decimal(rng.uniform(0.8, 1.3))
+                budgets.append(Budget(user=user, month=month, category=categories['expense', name],
+                                      limit_amount=limit.quantize(Decimal('1'))))
+    return budgets
+
+
+def generate_dataset(users=1, transactions=1000, months=24, seed=0, prefix='demo', password='password'):
+    """
+    Creates users {prefix}1 .. {prefix}N, each with three accounts,
+    categories, budgets for the last BUDGET_MONTHS months and about
+    transactions incomes, expenses and transfers over the last months.
+    Consecutive users are connected as partners. The same seed gives the
+    same data. Returns the users.
+    """
+    rng = random.Random(seed)
+    today = timezone.localdate()
+    months = max(months, 1)
+    names = [f'{prefix}{i}' for i in range(1, users + 1)]
+    taken = list(User.objects.filter(username__in=names).values_list('username', flat=True))
+    if taken:
+        raise ValueError(f"Users already exist: {', '.join(sorted(taken)[:5])}")
+
+    with transaction.atomic():
+        hashed = make_password(password)
+        User.objects.bulk_create([User(username=name, password=hashed, email=f'{name}@example.com') for name in names])
+        created = list(User.objects.filter(username__in=names).order_by('id'))
+        Profile.objects.bulk_create([Profile(user=user) for user in created])
+        Connection.objects.bulk_create([
+            Connection(sender=created[i], receiver=created[i + 1], status='accepted')
+            for i in range(0, len(created) - 1, 2)
+        ])
+
+        accounts = BankAccount.objects.bulk_create([
+            BankAccount(user=user, name=name, account_type=kind) for user in created for name, kind, _ in ACCOUNTS
+        ])
+        kinds = [('expense', name) for name in EXPENSE_CATEGORIES] + [('income', name) for name in INCOME_CATEGORIES]
+        kinds += [(kind, name) for name, kind, _, _, _ in MONTHLY_ITEMS]
+        categories = Category.objects.bulk_create([
+            Category(user=user, type=kind, name=name) for user in created for kind, name in kinds
+        ])
+
+        for index, user in enumerate(created):
+            user_accounts = accounts[index * len(ACCOUNTS):(index + 1) * len(ACCOUNTS)]
+            user_categories = {
+                (category.type, category.name): category
+                for category in categories[index * len(kinds):(index + 1) * len(kinds)]
+            }
+            expenses, incomes, transfers, opening = _user_rows(
+                rng, user, user_accounts, user_categories, transactions, months, today
+            )
+
+            balances = dict(opening)
+            for obj in expenses + incomes + transfers:
+                obj.year_month = year_month_key(obj.date)
+            for obj in expenses + incomes:
+                obj.fingerprint = obj.compute_fingerprint()
+                sign = -1 if isinstance(obj, Expense) else 1
+                balances[obj.account_id] += sign * obj.amount
+            for obj in transfers:
+                balances[obj.from_account_id] -= obj.amount
+                balances[obj.to_account_id] += obj.amount
+
+            Expense.objects.bulk_create(expenses, batch_size=1000)
+            Income.objects.bulk_create(incomes, batch_size=1000)
+            Transfer.objects.bulk_create(transfers, batch_size=1000)
+            Budget.objects.bulk_create(_budgets(rng, user, user_categories, expenses, today))
+            for account in user_accounts:
+                account.opening_balance = opening[account.pk]
+                account.balance = balances[account.pk]
+            BankAccount.objects.bulk_update(user_accounts, ['balance', 'opening_balance'])
+
+            rebuild_rollups(user)
+            rebuild_search_index(user=user)
+            rebuild_snapshots(user)
+    return created
@@ -1,3 +1,1419 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import pstats
+import re
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from dashboard.analytics import get_cash_flow_analytics
+from accounts.models import Connection, Profile
+from accounts.partners import get_partner_graph, has_partner
+from dashboard.services import get_dashboard_data, get_net_worth_history
+from .benchmarks import _context, time_view
+from .bulk import BulkValidator, ingest_transactions, split_duplicates, validate_transactions
+from .data_version import get_data_version
+from .categorizer import categorizer_version_key, forget_categorizer, get_categorizer, suggest_category
+from .events import hub
+from .feed import encode_cursor, get_feed_page, get_feed_totals, iter_feed
+from .ledger import BalanceLedger, balance_ledger, expense_effect, income_effect, transfer_effect
+from .metrics import registry, span
+from .profiling import list_profiles
+from .models import BalanceSnapshot, BankAccount, Budget, Category, Expense, Income, MonthlyRollup, Transfer
+from .projections import get_spending_pattern
+from .reconcile import reconcile_accounts
+from .rollups import get_month_summary, rebuild_rollups
+from .search import rebuild_search_index
+from .snapshots import rebuild_snapshots
+from .services import get_budget_summaries
+from . import statement_parsers
+from .statement_parsers import StatementError
+from .statements import StatementSource, import_statements
+from .synthetic import generate_dataset
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN is SQLite syntax")
+class QueryPlanTests(TestCase):
+    """
+    Guards the composite indexes: the queries behind the main views must
+    reach the transaction tables through an index, never a full scan.
+    """
+    FULL_SCAN = re.compile(r'\bSCAN (expenses_\w+|accounts_\w+)')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='planner')
+        other = User.objects.create(username='other')
+        cls.account = BankAccount.objects.create(user=cls.user, name='Checking')
+        savings = BankAccount.objects.create(user=cls.user, name='Savings')
+        cls.category = Category.objects.create(user=cls.user, name='Food')
+        start = date(2024, 1, 1)
+        for owner in (cls.user, other):
+            for i in range(30):
+                day = start + timedelta(days=i * 3)
+                Expense.objects.create(user=owner, account=cls.account, category=cls.category,
+                                       amount=Decimal('10.00'), description='Lunch', date=day)
+                Income.objects.create(user=owner, account=cls.account, amount=Decimal('50.00'),
+                                      source='Salary', date=day)
+                Transfer.objects.create(user=owner, from_account=cls.account, to_account=savings,
+                                        amount=Decimal('5.00'), date=day)
+
+    def assertIndexedQueries(self, func):
+        with CaptureQueriesContext(connection) as ctx:
+            func()
+        self.assertTrue(ctx.captured_queries)
+        with connection.cursor() as cursor:
+            for query in ctx.captured_queries:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = '\n'.join(row[-1] for row in cursor.fetchall())
+                self.assertIsNone(
+                    self.FULL_SCAN.search(plan),
+                    f"Full table scan in:\n{query['sql']}\n{plan}"
+                )
+
+    def test_transactions_feed_page(self):
+        self.assertIndexedQueries(lambda: get_feed_page(self.user))
+
+    def test_transactions_feed_filtered(self):
+        filters = dict(account_id=self.account.id, start_date='2024-02-01', end_date='2024-03-01')
+        self.assertIndexedQueries(lambda: get_feed_page(self.user, **filters))
+        self.assertIndexedQueries(lambda: get_feed_totals(self.user, **filters))
+
+    def test_transactions_feed_by_category(self):
+        self.assertIndexedQueries(lambda: get_feed_page(self.user, category_id=self.category.id))
+
+    def test_dashboard_month(self):
+        self.assertIndexedQueries(lambda: get_dashboard_data(self.user, 2024, 2))
+        self.assertIndexedQueries(lambda: get_dashboard_data(self.user, 2024, 2, include_days=False))
+
+    def test_year_month_grouping(self):
+        self.assertIndexedQueries(lambda: list(
+            Expense.objects.filter(user=self.user, year_month=202402).values('category_id').order_by()
+        ))
+
+    def test_budget_list(self):
+        self.assertIndexedQueries(lambda: get_budget_summaries(self.user))
+
+    def test_year_month_key_follows_date(self):
+        expense = Expense.objects.filter(user=self.user).first()
+        expense.date = date(2023, 11, 5)
+        expense.save()
+        expense.refresh_from_db()
+        self.assertEqual(expense.year_month, 202311)
+
+
+class FeedCursorTests(TestCase):
+    """
+    Keyset paging of the merged feed: rows sharing a date (and an id, one
+    per table) must each appear exactly once, newest first: date, id, then
+    transfer, income, expense.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='paged')
+        checking = BankAccount.objects.create(user=self.user, name='Checking')
+        savings = BankAccount.objects.create(user=self.user, name='Savings')
+        # The same ids in all three tables, on the same two days
+        for pk in (1, 2, 3):
+            for day in (date(2024, 5, 1), date(2024, 5, 2)):
+                key = pk if day.day == 1 else pk + 10
+                Expense.objects.create(id=key, user=self.user, account=checking, amount=Decimal('1.00'),
+                                       description='Lunch', date=day)
+                Income.objects.create(id=key, user=self.user, account=checking, amount=Decimal('2.00'),
+                                      source='Salary', date=day)
+                Transfer.objects.create(id=key, user=self.user, from_account=checking, to_account=savings,
+                                        amount=Decimal('3.00'), date=day)
+        ranks = {'expense': 0, 'income': 1, 'transfer': 2}
+        self.expected = sorted(
+            ((row['date'], row['id'], row['type']) for row in get_feed_page(self.user, page_size=100)),
+            key=lambda key: (-key[0].toordinal(), -key[1], -ranks[key[2]]),
+        )
+
+    def keys(self, page):
+        return [(row['date'], row['id'], row['type']) for row in page]
+
+    def test_whole_feed_order(self):
+        self.assertEqual(len(self.expected), 18)
+        self.assertEqual(self.keys(get_feed_page(self.user, page_size=100)), self.expected)
+
+    def test_next_and_previous_pages(self):
+        for size in (1, 2, 4, 5):
+            pages = [get_feed_page(self.user, page_size=size)]
+            self.assertFalse(pages[0].has_previous)
+            while pages[-1].has_next:
+                pages.append(get_feed_page(self.user, after=pages[-1].next_cursor, page_size=size))
+            self.assertEqual([key for page in pages for key in self.keys(page)], self.expected)
+
+            # Walking back from the last page gives the same pages again
+            back = [pages[-1]]
+            while back[-1].has_previous:
+                back.append(get_feed_page(self.user, before=back[-1].previous_cursor, page_size=size))
+            self.assertEqual([self.keys(page) for page in reversed(back)], [self.keys(page) for page in pages])
+            self.assertTrue(back[-1].has_next)
+
+    def test_empty_previous_page(self):
+        newest = get_feed_page(self.user, page_size=1)
+        page = get_feed_page(self.user, before=encode_cursor(newest[0]), page_size=5)
+        self.assertEqual(list(page), [])
+        self.assertFalse(page.has_next or page.has_previous)
+        self.assertIsNone(page.next_cursor)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('transactions'), {'before': encode_cursor(newest[0])})
+        self.assertNotContains(response, 'after=None')
+
+
+class CsvExportTests(TestCase):
+    """The streamed CSV export: same rows, order and filters as the feed."""
+
+    def setUp(self):
+        self.user = User.objects.create(username='exported')
+        self.checking = BankAccount.objects.create(user=self.user, name='Checking')
+        savings = BankAccount.objects.create(user=self.user, name='Savings')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        Expense.objects.create(user=self.user, account=self.checking, category=self.food, amount=Decimal('4.50'),
+                               description='Coffee', date=date(2024, 3, 2))
+        Expense.objects.create(user=self.user, account=self.checking, amount=Decimal('60.00'),
+                               description='Gym, monthly', date=date(2024, 3, 9))
+        Income.objects.create(user=self.user, account=self.checking, amount=Decimal('2500.00'),
+                              source='Salary', date=date(2024, 3, 1))
+        Transfer.objects.create(user=self.user, from_account=self.checking, to_account=savings,
+                                amount=Decimal('300.00'), date=date(2024, 3, 5))
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(reverse('transactions'), {'export': 'csv', **params})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="transactions_', response['Content-Disposition'])
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_header_and_order(self):
+        rows = self.export()
+        self.assertEqual(rows[0], ['Date', 'Type', 'Description', 'Category', 'Account', 'Amount'])
+        # Newest first, as on the page
+        self.assertEqual([row[0] for row in rows[1:]], ['2024-03-09', '2024-03-05', '2024-03-02', '2024-03-01'])
+        self.assertEqual([row[1] for row in rows[1:]], ['Expense', 'Transfer', 'Expense', 'Income'])
+        # The comma inside the description is quoted, not a new column
+        self.assertEqual(rows[1], ['2024-03-09', 'Expense', 'Gym, monthly', '—', 'Checking', '60.00'])
+        self.assertEqual(rows[3], ['2024-03-02', 'Expense', 'Coffee', 'Food', 'Checking', '4.50'])
+
+    def test_filters(self):
+        rows = self.export(type='expense', start_date='2024-03-03')
+        self.assertEqual([row[2] for row in rows[1:]], ['Gym, monthly'])
+
+        rows = self.export(category=self.food.id)
+        self.assertEqual([row[2] for row in rows[1:]], ['Coffee'])
+
+        rows = self.export(search='coffee')
+        self.assertEqual([row[2] for row in rows[1:]], ['Coffee'])
+
+        # Nothing matches: just the header
+        self.assertEqual(len(self.export(end_date='2023-12-31')), 1)
+
+    def test_chunked_reads_keep_the_order(self):
+        page = get_feed_page(self.user, page_size=100)
+        self.assertEqual([(row['type'], row['id']) for row in iter_feed(self.user, chunk_size=1)],
+                         [(row['type'], row['id']) for row in page])
+
+
+class MonthlyRollupTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='rolled')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking')
+        self.food = Category.objects.create(user=self.user, name='Food')
+
+    def add(self, amount, day, category=None, model=Expense):
+        text = {'description': 'Lunch'} if model is Expense else {'source': 'Salary'}
+        return model.objects.create(user=self.user, account=self.account, category=category,
+                                    amount=Decimal(amount), date=day, **text)
+
+    def buckets(self):
+        """{(month, category_id, kind): (total, count)} of the non-empty buckets."""
+        return {
+            (month, category_id, kind): (total, count)
+            for month, category_id, kind, total, count in MonthlyRollup.objects.filter(
+                user=self.user, count__gt=0).values_list('month', 'category_id', 'kind', 'total', 'count')
+        }
+
+    def test_add_edit_delete(self):
+        march, april = date(2024, 3, 1), date(2024, 4, 1)
+        lunch = self.add('10.00', date(2024, 3, 5), self.food)
+        self.add('4.00', date(2024, 3, 9), self.food)
+        salary = self.add('100.00', date(2024, 3, 1), model=Income)
+        self.assertEqual(self.buckets(), {
+            (march, self.food.id, 'expense'): (Decimal('14.00'), 2),
+            (march, None, 'income'): (Decimal('100.00'), 1),
+        })
+
+        lunch.amount = Decimal('12.50')
+        lunch.save()
+        self.assertEqual(self.buckets()[(march, self.food.id, 'expense')], (Decimal('16.50'), 2))
+
+        # A new category and a new month move the row to another bucket
+        travel = Category.objects.create(user=self.user, name='Travel')
+        lunch.category = travel
+        lunch.save()
+        lunch.date = date(2024, 4, 2)
+        lunch.save()
+        salary.date = '2024-04-30'
+        salary.save()
+        self.assertEqual(self.buckets(), {
+            (march, self.food.id, 'expense'): (Decimal('4.00'), 1),
+            (april, travel.id, 'expense'): (Decimal('12.50'), 1),
+            (april, None, 'income'): (Decimal('100.00'), 1),
+        })
+
+        lunch.delete()
+        salary.delete()
+        self.assertEqual(self.buckets(), {(march, self.food.id, 'expense'): (Decimal('4.00'), 1)})
+
+        # The maintained buckets match a rebuild from the raw rows
+        maintained = self.buckets()
+        rebuild_rollups(self.user)
+        self.assertEqual(self.buckets(), maintained)
+
+    def test_edit_of_partly_loaded_row(self):
+        self.add('10.00', date(2024, 3, 5), self.food)
+        lunch = Expense.objects.only('id', 'description').get(user=self.user)
+        lunch.description = 'Dinner'
+        lunch.save()
+        lunch = Expense.objects.defer('amount').get(user=self.user)
+        lunch.date = date(2024, 4, 5)
+        lunch.save()
+        self.assertEqual(self.buckets(), {(date(2024, 4, 1), self.food.id, 'expense'): (Decimal('10.00'), 1)})
+        Expense.objects.only('id', 'user').get(user=self.user).delete()
+        self.assertEqual(self.buckets(), {})
+
+    def test_rebuild_moves_the_data_version(self):
+        self.add('10.00', date(2024, 3, 5), self.food)
+        other = User.objects.create(username='untouched')
+        before = get_data_version(self.user.id), get_data_version(other.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_rollups(self.user)
+        self.assertNotEqual(get_data_version(self.user.id), before[0])
+        self.assertEqual(get_data_version(other.id), before[1])
+
+    def test_year_month_backfilled_after_migrate(self):
+        lunch = self.add('10.00', date(2024, 3, 5), self.food)
+        salary = self.add('100.00', date(2023, 12, 31), model=Income)
+        # As stored before the column existed
+        Expense.objects.update(year_month=0)
+        Income.objects.update(year_month=0)
+
+        emit_post_migrate_signal(verbosity=0, interactive=False, db='default')
+        lunch.refresh_from_db()
+        salary.refresh_from_db()
+        self.assertEqual((lunch.year_month, salary.year_month), (202403, 202312))
+
+    def test_category_delete_keeps_totals(self):
+        self.add('10.00', date(2024, 3, 5), self.food)
+        self.add('2.50', date(2024, 3, 6))
+        self.add('100.00', date(2024, 3, 1), self.food, model=Income)
+
+        self.food.delete()
+        summary = get_month_summary(self.user, 2024, 3)
+        self.assertEqual(summary['total_expenses'], Decimal('12.50'))
+        self.assertEqual(summary['total_income'], Decimal('100.00'))
+        self.assertEqual(summary['expense_by_category'], {'Uncategorized': 12.5})
+        bucket = MonthlyRollup.objects.get(user=self.user, kind='expense')
+        self.assertEqual((bucket.category_id, bucket.count), (None, 2))
+
+        # Deleting the user takes every rollup with it, its categories' too
+        self.add('900.00', date(2024, 3, 25), Category.objects.create(user=self.user, name='Rent'))
+        self.user.delete()
+        self.assertFalse(MonthlyRollup.objects.exists())
+
+
+class SearchIndexTests(TestCase):
+    """
+    Prefix, multi-word and ranked search through the index (FTS5 on
+    SQLite); TokenSearchIndexTests repeats them on the token index.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username='searcher')
+        other = User.objects.create(username='stranger')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking')
+        savings = BankAccount.objects.create(user=self.user, name='Savings')
+        for day, text in enumerate(['Starbucks coffee', 'Lunch at cafe', 'Coffee', 'Groceries'], start=1):
+            Expense.objects.create(user=self.user, account=self.account, amount=Decimal('4.00'),
+                                   description=text, date=date(2024, 1, day))
+        Income.objects.create(user=self.user, account=self.account, amount=Decimal('9.00'),
+                              source='Coffee refund', date=date(2024, 1, 9))
+        Transfer.objects.create(user=self.user, from_account=self.account, to_account=savings,
+                                amount=Decimal('5.00'), description='Cafe fund', date=date(2024, 1, 10))
+        Expense.objects.create(user=other, account=self.account, amount=Decimal('1.00'),
+                               description='Coffee', date=date(2024, 1, 1))
+
+    def descriptions(self, query, **filters):
+        return [row['description'] for row in get_feed_page(self.user, search_query=query, **filters)]
+
+    def test_search(self):
+        # Prefixes, all three tables, never another user's rows
+        self.assertCountEqual(self.descriptions('cof'), ['Starbucks coffee', 'Coffee', 'Coffee refund'])
+        # Every word must match, in any order
+        self.assertEqual(self.descriptions('caf lun'), ['Lunch at cafe'])
+        self.assertEqual(self.descriptions('xyz'), [])
+        # The closest match ranks first
+        self.assertEqual(self.descriptions('coffee', transaction_type='expense'), ['Coffee', 'Starbucks coffee'])
+        self.assertEqual(get_feed_totals(self.user, search_query='cof')['count'], 3)
+
+        expense = Expense.objects.get(user=self.user, description='Groceries')
+        expense.description = 'Coffee beans'
+        expense.save()
+        self.assertIn('Coffee beans', self.descriptions('bean'))
+        expense.delete()
+        self.assertEqual(self.descriptions('bean'), [])
+
+        self.assertEqual(rebuild_search_index(self.user), 5)
+        self.assertCountEqual(self.descriptions('cafe'), ['Lunch at cafe', 'Cafe fund'])
+
+    def test_substring_fallback(self):
+        # Not a word prefix: no index hit, so a substring match, newest first
+        self.assertEqual(self.descriptions('bucks'), ['Starbucks coffee'])
+        self.assertEqual(self.descriptions('fee'), ['Coffee refund', 'Coffee', 'Starbucks coffee'])
+        self.assertEqual(get_feed_totals(self.user, search_query='bucks')['count'], 1)
+        self.assertEqual([row['description'] for row in iter_feed(self.user, search_query='bucks')],
+                         ['Starbucks coffee'])
+        # Any index hit keeps the search on word prefixes
+        self.assertEqual(self.descriptions('star'), ['Starbucks coffee'])
+        self.assertCountEqual(self.descriptions('caf'), ['Cafe fund', 'Lunch at cafe'])
+
+    def test_rebuild_user_with_blank_text(self):
+        Income.objects.create(user=self.user, account=self.account, amount=Decimal('1.00'), source='',
+                              date=date(2024, 1, 11))
+        self.assertEqual(rebuild_search_index(self.user), 7)
+        # Twice: the blank row's old entry must be replaced too
+        self.assertEqual(rebuild_search_index(self.user), 7)
+        self.assertCountEqual(self.descriptions('cof'), ['Starbucks coffee', 'Coffee', 'Coffee refund'])
+
+
+@override_settings(EXPENSES_SEARCH_BACKEND='tokens')
+class TokenSearchIndexTests(SearchIndexTests):
+    pass
+
+
+class StatementImportTests(TestCase):
+    STATEMENT = (
+        "Account statement\n"
+        "\n"
+        "Txn Date,Description,Debit,Credit,Balance\n"
+        "02 Jan 2024,Coffee,\"1,200.50\",,\n"
+        "03 Jan 2024,Salary,,2000.00,\n"
+        "04 Jan 2024,Broken,,,\n"
+        "Closing balance,,,,799.50\n"
+        "05 Feb 2024,Rent,(300.00),,\n"
+    )
+
+    def setUp(self):
+        self.user = User.objects.create(username='importer')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking', balance=Decimal('100.00'))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'january.csv')
+        with open(self.path, 'w') as handle:
+            handle.write(self.STATEMENT)
+
+    def test_csv_import(self):
+        reports = []
+        result = import_statements(
+            self.user, [StatementSource(self.path, 'sbi', self.account)],
+            workers=1, batch_size=2, progress=lambda state: reports.append(state.imported)
+        )
+        self.assertEqual(result.imported, 3)
+        self.assertEqual(result.skipped, 1)
+        self.assertEqual(result.errors, ['january.csv, line 6: missing or unreadable amount'])
+        self.assertEqual(reports[-1], 3)
+
+        self.assertEqual(
+            list(Expense.objects.order_by('date').values_list('description', 'amount', 'date', 'year_month')),
+            [('Coffee', Decimal('1200.50'), date(2024, 1, 2), 202401),
+             ('Rent', Decimal('300.00'), date(2024, 2, 5), 202402)]
+        )
+        self.assertEqual(Income.objects.get().source, 'Salary')
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('599.50'))
+        self.assertEqual(get_dashboard_data(self.user, 2024, 1, include_days=False)['total_expenses'],
+                         Decimal('1200.50'))
+
+    def write(self, name, content):
+        path = os.path.join(os.path.dirname(self.path), name)
+        with open(path, 'wb') as handle:
+            handle.write(content)
+        return path
+
+    def test_unreadable_file(self):
+        sources = [StatementSource(self.path, 'sbi', self.account),
+                   StatementSource(self.write('march.xlsx', b'not a workbook'), 'sbi', self.account)]
+        with self.assertRaisesMessage(StatementError, 'march.xlsx: Not a readable XLSX file'):
+            import_statements(self.user, sources, workers=1)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_unreadable_part_is_reported(self):
+        february = self.write('february.csv', b'')
+        read_csv = statement_parsers._read_csv
+
+        def fail_on_february(path, profile):
+            if path == february:
+                raise StatementError("Not a readable CSV file (line contains NUL)")
+            return read_csv(path, profile)
+
+        sources = [StatementSource(self.path, 'sbi', self.account), StatementSource(february, 'sbi', self.account)]
+        with mock.patch('expenses.statement_parsers._read_csv', fail_on_february):
+            result = import_statements(self.user, sources, workers=1)
+        self.assertEqual(result.imported, 3)
+        self.assertEqual(result.errors[-1], 'february.csv: Not a readable CSV file (line contains NUL)')
+
+    def test_import_view_errors(self):
+        self.client.force_login(self.user)
+        url = reverse('import_statement')
+
+        def post(name, content):
+            upload = SimpleUploadedFile(name, content)
+            return self.client.post(url, {'statements': upload, 'profile': 'sbi', 'account': self.account.id})
+
+        response = post('march.xlsx', b'not a workbook')
+        self.assertFalse(response.json()['success'])
+        self.assertTrue(response.json()['error'].startswith('march.xlsx: Not a readable XLSX file'))
+
+        # Anything else is a bug, not a bad statement
+        with mock.patch('expenses.views_import.import_statements', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                post('january.csv', self.STATEMENT.encode())
+
+    @override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'}},
+        DASHBOARD_CACHE_ALIAS='shared', STATEMENT_IMPORT_WORKERS=1,
+    )
+    def test_import_progress(self):
+        self.client.force_login(self.user)
+        progress_url = reverse('import_statement_progress', args=['upload-1'])
+        self.assertFalse(self.client.get(progress_url).json()['success'])
+
+        upload = SimpleUploadedFile('january.csv', self.STATEMENT.encode())
+        response = self.client.post(reverse('import_statement'), {
+            'statements': upload, 'profile': 'sbi', 'account': self.account.id, 'token': 'upload-1'
+        })
+        self.assertEqual(response.json()['imported'], 3)
+
+        # Kept in the shared cache, where any worker can answer the poll
+        self.assertIsNotNone(caches['shared'].get(f'statement-import:{self.user.id}:upload-1'))
+        self.assertIsNone(caches['default'].get(f'statement-import:{self.user.id}:upload-1'))
+        state = self.client.get(progress_url).json()
+        self.assertTrue(state['success'])
+        self.assertEqual(state['imported'], 3)
+
+        # Another user's token is not theirs to read
+        other = User.objects.create(username='nosy')
+        self.client.force_login(other)
+        self.assertFalse(self.client.get(progress_url).json()['success'])
+
+
+class BalanceLedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='ledger')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking', balance=Decimal('100.00'))
+
+    def test_changes_to_one_account_are_merged(self):
+        ledger = BalanceLedger()
+        ledger.credit(self.account, Decimal('20.00'))
+        ledger.debit(self.account.pk, Decimal('5.50'))
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(ledger.apply(), 1)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('114.50'))
+
+    def test_stale_copies_do_not_lose_updates(self):
+        # Two requests that loaded the account before either one wrote
+        first = BankAccount.objects.get(pk=self.account.pk)
+        second = BankAccount.objects.get(pk=self.account.pk)
+        with balance_ledger() as ledger:
+            ledger.debit(first, Decimal('30.00'))
+        with balance_ledger() as ledger:
+            ledger.credit(second, Decimal('10.00'))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('80.00'))
+
+    def test_rollback_discards_balance_change(self):
+        with self.assertRaises(ValueError):
+            with balance_ledger() as ledger:
+                ledger.debit(self.account, Decimal('30.00'))
+                raise ValueError
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('100.00'))
+
+
+class ConcurrentBalanceTests(TransactionTestCase):
+    """Parallel writers against one account must all be reflected."""
+    WRITERS = 8
+    WRITES_PER_WRITER = 10
+
+    def test_parallel_writers(self):
+        user = User.objects.create(username='parallel')
+        account = BankAccount.objects.create(user=user, name='Shared', balance=Decimal('0.00'))
+        start = threading.Barrier(self.WRITERS)
+        failures = []
+
+        def writer(index):
+            try:
+                start.wait()
+                for _ in range(self.WRITES_PER_WRITER):
+                    # SQLite's shared test database reports lock contention
+                    # instead of waiting; retrying is fine, losing a write is not.
+                    while True:
+                        try:
+                            with balance_ledger() as ledger:
+                                if index % 2:
+                                    income = Income.objects.create(user=user, account=account, amount=Decimal('3.00'),
+                                                                   date=date(2024, 1, 1))
+                                    income_effect(ledger, income)
+                                else:
+                                    expense = Expense.objects.create(user=user, account=account, amount=Decimal('1.00'),
+                                                                     description='Coffee', date=date(2024, 1, 1))
+                                    expense_effect(ledger, expense)
+                            break
+                        except OperationalError as exc:
+                            if 'locked' not in str(exc):
+                                raise
+            except Exception as exc:
+                failures.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(self.WRITERS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(failures, [])
+        account.refresh_from_db()
+        writes = self.WRITERS // 2 * self.WRITES_PER_WRITER
+        self.assertEqual(account.balance, writes * Decimal('3.00') - writes * Decimal('1.00'))
+
+
+class CategorizerTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='categorized')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        self.travel = Category.objects.create(user=self.user, name='Travel')
+        for text, category in [('Starbucks coffee 1021', self.food), ('Starbucks coffee 2210', self.food),
+                               ('Uber trip airport', self.travel), ('Uber trip home', self.travel),
+                               ('Lunch with Sam', self.food)]:
+            Expense.objects.create(user=self.user, account=self.account, category=category, amount=Decimal('5.00'),
+                                   description=text, date=date(2024, 1, 5))
+        forget_categorizer(self.user.id)
+        self.addCleanup(forget_categorizer, self.user.id)
+
+    def test_suggestions(self):
+        self.assertEqual(suggest_category(self.user.id, 'expense', 'STARBUCKS COFFEE 9999')[0], self.food.id)
+        self.assertEqual(suggest_category(self.user.id, 'expense', 'uber')[0], self.travel.id)
+        self.assertEqual(suggest_category(self.user.id, 'expense', 'Something new'), (None, 0.0))
+        self.assertEqual(suggest_category(self.user.id, 'income', 'Starbucks coffee'), (None, 0.0))
+
+    def test_incremental_updates(self):
+        categorizer = get_categorizer(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            expense = Expense.objects.create(user=self.user, account=self.account, category=self.food,
+                                             amount=Decimal('9.00'), description='Netflix', date=date(2024, 1, 6))
+        self.assertEqual(categorizer.predict('expense', 'netflix')[0], self.food.id)
+
+        expense = Expense.objects.get(pk=expense.pk)
+        expense.category = self.travel
+        with self.captureOnCommitCallbacks(execute=True):
+            expense.save()
+        self.assertEqual(categorizer.predict('expense', 'netflix')[0], self.travel.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            expense.delete()
+        self.assertEqual(categorizer.predict('expense', 'netflix'), (None, 0.0))
+
+    @override_settings(CATEGORIZER_MAX_AGE=0)
+    def test_incremental_updates_keep_the_model(self):
+        categorizer = get_categorizer(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            expense = Expense.objects.create(user=self.user, account=self.account, category=self.food,
+                                             amount=Decimal('9.00'), description='Netflix', date=date(2024, 1, 6))
+        with self.captureOnCommitCallbacks(execute=True):
+            # Not something the models learn from
+            expense.amount = Decimal('10.00')
+            expense.save()
+        self.assertIs(get_categorizer(self.user.id), categorizer)
+
+        # A change learnt by another process only
+        cache.incr(categorizer_version_key(self.user.id))
+        rebuilt = get_categorizer(self.user.id)
+        self.assertIsNot(rebuilt, categorizer)
+        self.assertEqual(rebuilt.predict('expense', 'netflix')[0], self.food.id)
+        self.assertIs(get_categorizer(self.user.id), rebuilt)
+
+
+class DuplicateDetectionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='repaster')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking')
+
+    def rows(self, *items):
+        return [{'type': kind, 'amount': amount, 'date': '2024-03-01', 'description': text,
+                 'account_id': self.account.id} for kind, amount, text in items]
+
+    def test_repasted_batch(self):
+        batch = self.rows(('expense', '4.50', 'Coffee'), ('income', '100', 'Salary'))
+        self.assertEqual(ingest_transactions(self.user, batch), (2, [], []))
+
+        # Same rows again, with different case and punctuation: flagged, nothing written
+        again = self.rows(('expense', '4.5', 'COFFEE.'), ('income', '100.00', 'Salary'), ('expense', '3', 'Tea'))
+        saved, errors, duplicates = ingest_transactions(self.user, again)
+        self.assertEqual(saved, 0)
+        self.assertEqual(errors, duplicates)
+        self.assertEqual(len(duplicates), 2)
+        self.assertTrue(duplicates[0].startswith('Row 1: duplicate of an existing expense'))
+
+        self.assertEqual(ingest_transactions(self.user, again, 'skip'), (1, [], duplicates))
+        self.assertEqual(ingest_transactions(self.user, again, 'allow')[0], 3)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('200.00') - Decimal('4.50') * 2 - Decimal('3.00') * 2)
+
+    def test_one_query_per_batch(self):
+        ingest_transactions(self.user, self.rows(('expense', '4.50', 'Coffee')))
+        # Two identical purchases, one of them already stored: only one matches
+        new_rows, _ = validate_transactions(BulkValidator(self.user), self.rows(
+            ('expense', '4.50', 'Coffee'), ('expense', '4.50', 'Coffee'), ('income', '1', 'Refund')
+        ))
+        with self.assertNumQueries(1):
+            fresh, matched = split_duplicates(self.user, new_rows)
+        self.assertEqual([index for index, obj in matched], [0])
+        self.assertEqual(len(fresh['expense']) + len(fresh['income']), 2)
+
+
+class BulkIngestTests(TestCase):
+    """The bulk_create path must leave the same state as saving row by row."""
+
+    def setUp(self):
+        self.user = User.objects.create(username='bulker')
+        self.checking = BankAccount.objects.create(user=self.user, name='Checking', balance=Decimal('100.00'))
+        self.cash = BankAccount.objects.create(user=self.user, name='Cash', balance=Decimal('20.00'))
+        self.food = Category.objects.create(user=self.user, name='Food')
+
+    def row(self, kind, amount, day, account, category=None, text='Row'):
+        return {'type': kind, 'amount': amount, 'date': day, 'description': text,
+                'account_id': account.id, 'category_id': category.id if category else None}
+
+    def test_balances_rollups_and_year_month(self):
+        batch = [
+            self.row('expense', '12.50', '2024-03-05', self.checking, self.food, 'Lunch'),
+            self.row('expense', '7.50', '2024-03-20', self.checking, self.food, 'Dinner'),
+            self.row('expense', '3.00', '2024-04-01', self.cash, text='Bus'),
+            self.row('income', '250.00', '2024-03-31', self.checking, text='Salary'),
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(ingest_transactions(self.user, batch), (4, [], []))
+
+        self.checking.refresh_from_db()
+        self.cash.refresh_from_db()
+        self.assertEqual(self.checking.balance, Decimal('330.00'))
+        self.assertEqual(self.cash.balance, Decimal('17.00'))
+
+        self.assertEqual(
+            sorted(Expense.objects.filter(user=self.user).values_list('year_month', flat=True)),
+            [202403, 202403, 202404]
+        )
+        self.assertEqual(Income.objects.get(user=self.user).year_month, 202403)
+
+        march = get_month_summary(self.user, 2024, 3)
+        self.assertEqual(march['total_expenses'], Decimal('20.00'))
+        self.assertEqual(march['total_income'], Decimal('250.00'))
+        self.assertEqual(march['expense_by_category'], {'Food': 20.0})
+        self.assertEqual(get_month_summary(self.user, 2024, 4)['total_expenses'], Decimal('3.00'))
+
+        # Same buckets as a rebuild from the inserted rows
+        def buckets():
+            return sorted(MonthlyRollup.objects.filter(user=self.user).values_list(
+                'month', 'category_id', 'kind', 'total', 'count'), key=str)
+        maintained = buckets()
+        rebuild_rollups(self.user)
+        self.assertEqual(buckets(), maintained)
+
+    def test_invalid_row_writes_nothing(self):
+        batch = [
+            self.row('expense', '12.50', '2024-03-05', self.checking, self.food),
+            self.row('expense', 'lots', '2024-03-06', self.checking),
+        ]
+        saved, errors, _ = ingest_transactions(self.user, batch)
+        self.assertEqual(saved, 0)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('Row 2:'))
+        self.assertFalse(Expense.objects.filter(user=self.user).exists())
+        self.assertFalse(MonthlyRollup.objects.filter(user=self.user).exists())
+        self.checking.refresh_from_db()
+        self.assertEqual(self.checking.balance, Decimal('100.00'))
+
+
+class CashFlowAnalyticsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='analytics')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        Income.objects.create(user=self.user, account=self.account, amount=Decimal('1000.00'),
+                              source='Salary', date=date(2023, 12, 29))
+        Income.objects.create(user=self.user, account=self.account, amount=Decimal('1000.00'),
+                              source='Salary', date=date(2024, 1, 31))
+        for day, amount, category in [(date(2023, 12, 31), '100.00', self.food), (date(2024, 1, 1), '250.50', None),
+                                      (date(2024, 1, 7), '49.50', self.food)]:
+            Expense.objects.create(user=self.user, account=self.account, category=category, amount=Decimal(amount),
+                                   description='Groceries', date=day)
+
+    def test_series(self):
+        result = get_cash_flow_analytics(self.user)
+        self.assertEqual((result['start'], result['end']), ('2023-12-29', '2024-01-31'))
+        self.assertEqual(result['savings_rate'], 0.8)
+
+        monthly = result['monthly']
+        self.assertEqual(monthly['labels'], ['2023-12', '2024-01'])
+        self.assertEqual(monthly['expense'], [100.0, 300.0])
+        self.assertEqual(monthly['net'], [900.0, 700.0])
+        self.assertEqual(monthly['net_rolling'], [900.0, 800.0])
+        self.assertEqual(monthly['savings_rate'], [0.9, 0.7])
+
+        # Weeks start on Monday: 2023-12-25 covers the 29th and 31st
+        weekly = result['weekly']
+        self.assertEqual(weekly['labels'][:2], ['2023-12-25', '2024-01-01'])
+        self.assertEqual(weekly['net'][:2], [900.0, -300.0])
+        self.assertEqual(len(result['daily']['labels']), 34)
+        self.assertEqual(sum(result['daily']['expense']), 400.0)
+
+        categories = {item['name']: item['totals'] for item in result['categories']['items']}
+        self.assertEqual(result['categories']['years'], [2023, 2024])
+        self.assertEqual(categories, {'Food': [100.0, 49.5], 'Uncategorized': [0.0, 250.5]})
+
+    def test_range_and_endpoint(self):
+        result = get_cash_flow_analytics(self.user, start=date(2024, 1, 1))
+        self.assertEqual(result['monthly']['labels'], ['2024-01'])
+        self.assertIsNone(get_cash_flow_analytics(self.user, end=date(2023, 1, 1))['monthly'])
+
+        self.client.force_login(self.user)
+        response = self.client.get('/dashboard/analytics/', {'end': '2023-12-31'})
+        self.assertEqual(response.json()['monthly']['expense'], [100.0])
+        self.assertFalse(self.client.get('/dashboard/analytics/', {'start': 'soon'}).json()['success'])
+
+
+class DeferredBudgetCheckTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='budgeted')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        self.rent = Category.objects.create(user=self.user, name='Rent')
+
+    def add(self, amount, day, category):
+        return Expense.objects.create(user=self.user, account=self.account, category=category,
+                                      amount=Decimal(amount), description='Row', date=day)
+
+    def test_coalesced_per_month(self):
+        with mock.patch('expenses.budget_checks.check_month_budgets') as check:
+            with self.captureOnCommitCallbacks(execute=True):
+                lunch = self.add('10.00', date(2024, 3, 5), self.food)
+                self.add('12.00', date(2024, 3, 6), self.food)
+                self.add('900.00', date(2024, 3, 25), self.rent)
+                lunch.date = date(2024, 4, 1)
+                lunch.save()
+                self.assertFalse(check.called)
+        self.assertEqual(sorted(check.call_args_list, key=str), [
+            mock.call(self.user.id, date(2024, 3, 1), {self.food.id, self.rent.id}),
+            mock.call(self.user.id, date(2024, 4, 1), {self.food.id}),
+        ])
+
+    def test_dropped_on_rollback(self):
+        with mock.patch('expenses.budget_checks.check_month_budgets') as check:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                with transaction.atomic():
+                    self.add('10.00', date(2024, 3, 5), self.food)
+                    transaction.set_rollback(True)
+            self.assertEqual(callbacks, [])
+            self.assertFalse(check.called)
+
+            # Nor is it checked along with the next committed write
+            with self.captureOnCommitCallbacks(execute=True):
+                self.add('5.00', date(2024, 4, 5), self.rent)
+        check.assert_called_once_with(self.user.id, date(2024, 4, 1), {self.rent.id})
+
+    def test_one_notification_per_batch(self):
+        budget = Budget.objects.create(user=self.user, month=date(2024, 3, 1), category=self.food,
+                                       limit_amount=Decimal('15.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            for day in (1, 2, 3):
+                self.add('10.00', date(2024, 3, day), self.food)
+        self.assertEqual(list(budget.notifications.values_list('exceeded_amount', 'active')),
+                         [(Decimal('15.00'), True)])
+
+
+class BudgetListTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='listed')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        # Budgets two months apart, spending in every month
+        for month in range(1, 6):
+            Expense.objects.create(user=self.user, account=self.account, category=self.food,
+                                   amount=Decimal(month * 10), description='Row', date=date(2023, month, 5))
+        for month in (1, 3, 5):
+            Budget.objects.create(user=self.user, month=date(2023, month, 1), limit_amount=Decimal('100.00'))
+            Budget.objects.create(user=self.user, month=date(2023, month, 1), category=self.food,
+                                  limit_amount=Decimal('25.00'))
+
+    def test_sparse_months(self):
+        with CaptureQueriesContext(connection) as ctx:
+            summaries = get_budget_summaries(self.user, months=[date(2023, 5, 1), date(2023, 1, 1)])
+        self.assertEqual([s['month'] for s in summaries], [date(2023, 5, 1), date(2023, 1, 1)])
+        self.assertEqual([s['total_spent'] for s in summaries], [Decimal('50'), Decimal('10')])
+        self.assertEqual([s['categories'][0]['is_exceeded'] for s in summaries], [True, False])
+        # Only the two months' rollups are read, not the months between them
+        rollup_query, = [q['sql'] for q in ctx.captured_queries if 'expenses_monthlyrollup' in q['sql']]
+        self.assertIn(' IN (', rollup_query)
+        self.assertNotIn('2023-03-01', rollup_query)
+
+    @mock.patch('expenses.views_budget.BUDGET_MONTHS_PER_PAGE', 2)
+    def test_paged_list(self):
+        self.client.force_login(self.user)
+        url = reverse('budget_list')
+
+        response = self.client.get(url)
+        self.assertIsNone(response.context['page_obj'])
+        self.assertEqual([s['month'] for s in response.context['budgets']],
+                         [date(2023, 5, 1), date(2023, 3, 1), date(2023, 1, 1)])
+
+        response = self.client.get(url, {'page': 1})
+        self.assertEqual(response.context['page_obj'].paginator.num_pages, 2)
+        self.assertEqual([s['month'] for s in response.context['budgets']], [date(2023, 5, 1), date(2023, 3, 1)])
+        self.assertEqual([s['total_spent'] for s in response.context['budgets']], [Decimal('50'), Decimal('30')])
+        self.assertContains(response, 'href="?page=2"')
+
+        # Out of range falls back to the last page
+        for page in (2, 99):
+            response = self.client.get(url, {'page': page})
+            self.assertEqual(response.context['page_obj'].number, 2)
+            self.assertEqual([s['month'] for s in response.context['budgets']], [date(2023, 1, 1)])
+            self.assertContains(response, 'href="?page=1"')
+
+
+class BudgetProjectionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='projected')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking')
+        self.rent = Category.objects.create(user=self.user, name='Rent')
+        self.food = Category.objects.create(user=self.user, name='Food')
+        # Feb-Apr 2024: rent on the 25th, groceries on the first 20 days
+        for month in (2, 3, 4):
+            Expense.objects.create(user=self.user, account=self.account, category=self.rent,
+                                   amount=Decimal('900.00'), description='Rent', date=date(2024, month, 25))
+            for day in range(1, 21):
+                Expense.objects.create(user=self.user, account=self.account, category=self.food,
+                                       amount=Decimal('10.00'), description='Groceries', date=date(2024, month, day))
+
+    def test_projection(self):
+        with self.assertNumQueries(1):
+            pattern = get_spending_pattern(self.user, today=date(2024, 5, 10))
+        projected = pattern.project({
+            date(2024, 4, 1): {self.food.id: Decimal('200.00')},
+            date(2024, 5, 1): {self.food.id: Decimal('300.00'), None: Decimal('31.00')},
+            date(2024, 6, 1): {},
+        })
+        # Past months keep their spend
+        self.assertEqual(projected[date(2024, 4, 1)], {self.food.id: Decimal('200.00')})
+        # Half the usual grocery spend is done by the 10th: half run rate, half pattern
+        may = projected[date(2024, 5, 1)]
+        self.assertEqual(may[self.food.id], Decimal('665.00'))
+        # Rent is still expected, and spending with no history follows its run rate
+        self.assertEqual(may[self.rent.id], Decimal('900.00'))
+        self.assertEqual(may[None], Decimal('96.10'))
+        june = projected[date(2024, 6, 1)]
+        self.assertEqual((june[self.rent.id], june[self.food.id]), (Decimal('900.00'), Decimal('200.00')))
+
+    def test_future_month_with_spending(self):
+        pattern = get_spending_pattern(self.user, today=date(2024, 5, 10))
+        travel = Category.objects.create(user=self.user, name='Travel')
+        june = pattern.project({
+            date(2024, 6, 1): {self.food.id: Decimal('50.00'), travel.id: Decimal('20.00')},
+        })[date(2024, 6, 1)]
+        # Not started: what is already booked plus the usual month, no run rate
+        self.assertEqual(june[self.food.id], Decimal('250.00'))
+        self.assertEqual(june[self.rent.id], Decimal('900.00'))
+        # No history either: only what is booked
+        self.assertEqual(june[travel.id], Decimal('20.00'))
+
+    def test_future_dated_expense_in_budget_month(self):
+        month = date(2024, 6, 1)
+        Budget.objects.create(user=self.user, month=month, limit_amount=Decimal('1000.00'))
+        Budget.objects.create(user=self.user, month=month, category=self.food, limit_amount=Decimal('100.00'))
+        Expense.objects.create(user=self.user, account=self.account, category=self.food, amount=Decimal('40.00'),
+                               description='Groceries', date=date(2024, 6, 15))
+        with mock.patch('django.utils.timezone.localdate', return_value=date(2024, 5, 10)):
+            summary = get_budget_summaries(self.user, months=[month])[0]
+        self.assertEqual(summary['global']['projected'], Decimal('1140.00'))
+        self.assertEqual(summary['categories'][0]['projected'], Decimal('240.00'))
+        self.assertTrue(summary['categories'][0]['projected_to_exceed'])
+
+    def test_budget_summaries(self):
+        month = date(2024, 5, 1)
+        Budget.objects.create(user=self.user, month=month, limit_amount=Decimal('900.00'))
+        Budget.objects.create(user=self.user, month=month, category=self.food, limit_amount=Decimal('100.00'))
+        Budget.objects.create(user=self.user, month=date(2024, 3, 1), limit_amount=Decimal('5000.00'))
+        Expense.objects.create(user=self.user, account=self.account, amount=Decimal('5.00'),
+                               description='Coffee', date=month)
+
+        with mock.patch('django.utils.timezone.localdate', return_value=date(2024, 5, 10)):
+            with self.assertNumQueries(3):
+                current, past = get_budget_summaries(self.user)
+            with self.assertNumQueries(2):
+                get_budget_summaries(self.user, months=[date(2024, 3, 1)])
+
+        # Rent and (at a quiet month's pace) groceries are still to come
+        self.assertEqual(current['global']['projected'], Decimal('965.50'))
+        self.assertTrue(current['global']['projected_to_exceed'])
+        self.assertFalse(current['global']['is_exceeded'])
+        self.assertEqual(current['categories'][0]['projected'], Decimal('50.00'))
+        self.assertFalse(current['categories'][0]['projected_to_exceed'])
+        self.assertEqual(past['global']['projected'], past['global']['spent'])
+
+
+class BalanceSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='snapshots')
+        self.checking = BankAccount.objects.create(user=self.user, name='Checking', balance=Decimal('1000.00'))
+        self.savings = BankAccount.objects.create(user=self.user, name='Savings')
+
+    def snapshots(self):
+        return list(BalanceSnapshot.objects.filter(user=self.user).order_by('account_id', 'date')
+                    .values_list('account_id', 'date', 'balance'))
+
+    def add_expense(self, day, amount):
+        with balance_ledger() as ledger:
+            expense = Expense.objects.create(user=self.user, account=self.checking, amount=Decimal(amount),
+                                             description='Shop', date=day)
+            expense_effect(ledger, expense)
+        return expense
+
+    def test_rebuild_moves_the_data_version(self):
+        self.add_expense(date(2024, 1, 5), '30.00')
+        before = get_data_version(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_snapshots()
+        self.assertNotEqual(get_data_version(self.user.id), before)
+
+    def test_backdated_changes(self):
+        opened = self.snapshots()[0][1]
+        self.add_expense(date(2024, 3, 10), '100.00')
+        with balance_ledger() as ledger:
+            transfer = Transfer.objects.create(user=self.user, from_account=self.checking, to_account=self.savings,
+                                               amount=Decimal('200.00'), date=date(2024, 3, 20))
+            transfer_effect(ledger, transfer)
+        # Backdated: every later snapshot of the account moves
+        expense = self.add_expense(date(2024, 3, 1), '50.00')
+        self.assertEqual(self.snapshots(), [
+            (self.checking.id, date(2024, 3, 1), Decimal('950.00')),
+            (self.checking.id, date(2024, 3, 10), Decimal('850.00')),
+            (self.checking.id, date(2024, 3, 20), Decimal('650.00')),
+            (self.checking.id, opened, Decimal('650.00')),
+            (self.savings.id, date(2024, 3, 20), Decimal('200.00')),
+        ])
+
+        with balance_ledger() as ledger:
+            expense_effect(ledger, expense, reverse=True)
+            expense.delete()
+        self.assertEqual(self.snapshots()[2], (self.checking.id, date(2024, 3, 20), Decimal('700.00')))
+
+        # Rebuilding from the raw rows gives the same balances, without the
+        # rows of days that no longer have activity
+        incremental = self.snapshots()
+        rebuild_snapshots(self.user)
+        self.assertEqual(self.snapshots(), [row for row in incremental if row[1] not in (date(2024, 3, 1), opened)])
+
+    def test_opening_balance_edit(self):
+        self.add_expense(date(2024, 3, 10), '100.00')
+        account = BankAccount.objects.get(pk=self.checking.pk)
+        account.balance = Decimal('1500.00')
+        account.save()
+        self.assertEqual([row[2] for row in self.snapshots()], [Decimal('1500.00'), Decimal('1500.00')])
+
+    def test_net_worth_history(self):
+        self.add_expense(date(2024, 1, 10), '100.00')
+        self.add_expense(date(2024, 2, 10), '100.00')
+        with balance_ledger() as ledger:
+            income = Income.objects.create(user=self.user, account=self.savings, amount=Decimal('1.00'),
+                                           date=date(2024, 2, 11))
+            income_effect(ledger, income)
+        rebuild_snapshots(self.user)
+        self.assertEqual(get_net_worth_history(self.user, end=date(2024, 12, 31)), {
+            'interval': 'day',
+            'labels': ['2024-01-10', '2024-02-10', '2024-02-11'],
+            'net_worth': [900.0, 800.0, 801.0],
+        })
+
+        self.client.force_login(self.user)
+        with self.assertNumQueries(3):  # session, user, snapshots
+            data = self.client.get('/dashboard/net-worth/', {'start': '2024-02-01', 'interval': 'month'}).json()
+        self.assertEqual((data['labels'][0], data['net_worth'][0]), ('2024-02', 801.0))
+        self.assertEqual(data['net_worth'][-1], 801.0)
+
+
+class ReconcileBalancesTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='reconciled')
+        self.checking = BankAccount.objects.create(user=self.user, name='Checking', balance=Decimal('100.00'))
+        self.savings = BankAccount.objects.create(user=self.user, name='Savings')
+        with balance_ledger() as ledger:
+            expense = Expense.objects.create(user=self.user, account=self.checking, amount=Decimal('30.00'),
+                                             description='Shop', date=date(2024, 1, 5))
+            expense_effect(ledger, expense)
+            transfer = Transfer.objects.create(user=self.user, from_account=self.checking, to_account=self.savings,
+                                               amount=Decimal('50.00'), date=date(2024, 1, 6))
+            transfer_effect(ledger, transfer)
+
+    def reconcile(self, *args):
+        out = io.StringIO()
+        call_command('reconcile_balances', '--workers', '1', *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_dry_run_and_fix(self):
+        self.assertEqual(reconcile_accounts([self.user.id]), {'accounts': 2, 'discrepancies': []})
+
+        # Changed behind the ledger's back
+        Expense.objects.filter(user=self.user).update(amount=Decimal('35.00'))
+        report = self.reconcile('--format', 'csv')
+        self.assertIn(f'reconciled,{self.checking.id},Checking,20.00,15.00,-5.00,found', report)
+        self.checking.refresh_from_db()
+        self.assertEqual(self.checking.balance, Decimal('20.00'))
+
+        self.assertIn('- fixed', self.reconcile('--fix'))
+        self.checking.refresh_from_db()
+        self.assertEqual(self.checking.balance, Decimal('15.00'))
+        self.assertEqual(BalanceSnapshot.objects.get(account=self.checking, date=date(2024, 1, 6)).balance,
+                         Decimal('15.00'))
+        self.assertIn('0 off', self.reconcile())
+
+    def test_fix_moves_the_etag(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        url = reverse('dashboard')
+        # The first response sets the CSRF cookie, which is part of the ETag
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+
+        Expense.objects.filter(user=self.user).update(amount=Decimal('35.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reconcile('--fix')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_opening_balance(self):
+        BankAccount.objects.filter(pk=self.savings.pk).update(opening_balance=None)
+        self.assertIn('opening balance not recorded', self.reconcile())
+        self.reconcile('--fix')
+        self.savings.refresh_from_db()
+        self.assertEqual(self.savings.opening_balance, Decimal('0.00'))
+
+
+class SyntheticDataTests(TestCase):
+
+    def test_generated_data_is_consistent(self):
+        users = generate_dataset(users=3, transactions=300, months=6, prefix='synth')
+        self.assertEqual([user.username for user in users], ['synth1', 'synth2', 'synth3'])
+        self.assertEqual(Profile.objects.filter(user__in=users).count(), 3)
+        self.assertTrue(Connection.objects.filter(sender=users[0], receiver=users[1], status='accepted').exists())
+
+        first = users[0]
+        count = sum(model.objects.filter(user=first).count() for model in (Expense, Income, Transfer))
+        self.assertEqual(count, 300)
+        self.assertFalse(Expense.objects.filter(user=first, year_month=0).exists())
+        self.assertFalse(Expense.objects.filter(user=first, fingerprint='').exists())
+        self.assertTrue(Budget.objects.filter(user=first, category=None).exists())
+        # Balances agree with the transactions and opening balances
+        self.assertEqual(reconcile_accounts([user.id for user in users])['discrepancies'], [])
+        self.assertTrue(BalanceSnapshot.objects.filter(user=first).exists())
+
+        with self.assertRaises(ValueError):
+            generate_dataset(users=1, prefix='synth')
+
+    def test_benchmarked_views_respond(self):
+        user = generate_dataset(users=1, transactions=100, months=3, prefix='timed')[0]
+        self.client.force_login(user)
+        context = _context(user)
+        for name in ('dashboard_view', 'transactions_view_csv', 'add_bulk_transactions'):
+            result = time_view(name, self.client, context, repeat=1)
+            self.assertEqual(result['status'], 200)
+            self.assertGreater(result['queries'], 0)
+        # The bulk insert is rolled back after every run
+        self.assertFalse(Expense.objects.filter(user=user, description__startswith='Benchmark row').exists())
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        registry.reset()
+        self.user = User.objects.create(username='watched')
+        self.client.force_login(self.user)
+
+    def metric(self, text, name, **labels):
+        label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+        match = re.search(rf'^{name}{{{re.escape(label_text)}}} (\S+)$', text, re.M)
+        return float(match.group(1)) if match else None
+
+    def test_requests_sql_and_spans(self):
+        self.client.get('/budgets/')
+        self.client.get('/budgets/')
+        with span('custom'):
+            pass
+
+        self.assertEqual(self.client.get('/metrics').status_code, 302)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        response = self.client.get('/metrics')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+
+        self.assertEqual(self.metric(text, 'moneytracker_http_requests_total',
+                                     view='budget_list', method='GET', status='200'), 2)
+        self.assertEqual(self.metric(text, 'moneytracker_http_request_duration_seconds_bucket',
+                                     view='budget_list', le='+Inf'), 2)
+        self.assertEqual(self.metric(text, 'moneytracker_http_requests_total',
+                                     view='metrics', method='GET', status='302'), 1)
+        self.assertGreater(self.metric(text, 'moneytracker_db_queries_total', view='budget_list'), 0)
+        self.assertGreater(self.metric(text, 'moneytracker_db_query_seconds_total', view='budget_list'), 0)
+        self.assertEqual(self.metric(text, 'moneytracker_span_duration_seconds_count', span='get_budget_summaries'), 2)
+        self.assertEqual(self.metric(text, 'moneytracker_span_duration_seconds_count', span='custom'), 1)
+
+    def test_queries_outside_requests_are_not_counted(self):
+        self.client.get('/budgets/')
+        queries = registry.sql['budget_list'][0]
+        list(Budget.objects.all())
+        self.assertEqual(registry.sql['budget_list'][0], queries)
+
+
+class RequestProfilingTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='profiler', is_staff=True)
+        self.client.force_login(self.user)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_off_by_default(self):
+        self.assertNotIn('X-Profile-Id', self.client.get('/budgets/', {'profile': '1'}))
+
+    def test_staff_profile_saved_and_downloaded(self):
+        with override_settings(REQUEST_PROFILING_ENABLED=True, REQUEST_PROFILING_DIR=self.directory.name,
+                               REQUEST_PROFILING_KEEP=2):
+            self.assertNotIn('X-Profile-Id', self.client.get('/budgets/'))
+            ids = [self.client.get('/budgets/', {'profile': '1'})['X-Profile-Id'],
+                   self.client.get('/budgets/', HTTP_X_PROFILE='1')['X-Profile-Id']]
+            newest = self.client.get('/transactions/', {'profile': '1'})['X-Profile-Id']
+
+            # Ring buffer of two
+            profiles = list_profiles()
+            self.assertEqual([profile['id'] for profile in profiles], [newest, ids[1]])
+            self.assertEqual(len(os.listdir(self.directory.name)), 6)
+            self.assertEqual(profiles[0]['view'], 'transactions')
+            self.assertGreater(profiles[0]['queries'], 0)
+
+            page = self.client.get('/dashboard/profiles/')
+            self.assertContains(page, f'/dashboard/profiles/{newest}/prof/')
+
+            download = self.client.get(f'/dashboard/profiles/{newest}/prof/')
+            path = os.path.join(self.directory.name, 'downloaded.prof')
+            with open(path, 'wb') as f:
+                f.write(b''.join(download.streaming_content))
+            self.assertGreater(pstats.Stats(path).total_calls, 0)
+            log = json.loads(b''.join(self.client.get(f'/dashboard/profiles/{newest}/sql/').streaming_content))
+            self.assertEqual(len(log['queries']), profiles[0]['queries'])
+            self.assertEqual(self.client.get('/dashboard/profiles/../sql/').status_code, 404)
+
+            # Only staff can ask
+            User.objects.filter(pk=self.user.pk).update(is_staff=False)
+            self.assertNotIn('X-Profile-Id', self.client.get('/budgets/', {'profile': '1'}))
+            self.assertEqual(self.client.get('/dashboard/profiles/').status_code, 302)
+
+
+class ChangeEventTests(TestCase):
+
+    def setUp(self):
+        # Committed, as it would be before the writes under test
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create(username='watched')
+            self.account = BankAccount.objects.create(user=self.user, name='Checking')
+
+    def add(self, day):
+        return Expense.objects.create(user=self.user, account=self.account, amount=Decimal('4.50'),
+                                      description='Coffee', date=day)
+
+    def test_one_event_per_commit(self):
+        with mock.patch.object(hub, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.add(date(2024, 3, 5))
+                self.add(date(2024, 4, 5))
+                self.assertFalse(publish.called)
+        publish.assert_called_once()
+        user_id, months, all_months, balances = publish.call_args.args
+        self.assertEqual((user_id, months), (self.user.id, {date(2024, 3, 1), date(2024, 4, 1)}))
+
+    def test_dropped_on_rollback(self):
+        with mock.patch.object(hub, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    self.add(date(2024, 3, 5))
+                    transaction.set_rollback(True)
+            self.assertFalse(publish.called)
+
+            # Nor is it published with the next committed write
+            with self.captureOnCommitCallbacks(execute=True):
+                self.add(date(2024, 4, 5))
+        publish.assert_called_once()
+        self.assertEqual(publish.call_args.args[1], {date(2024, 4, 1)})
+
+
+class ConditionalResponseTests(TestCase):
+    """ETag/304 on the pages built only from the user's own data."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='revalidated')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking')
+        self.client.force_login(self.user)
+
+    def assertRevalidates(self, url, **params):
+        # The first response sets the CSRF cookie, which is part of the ETag
+        self.client.get(url, params)
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # Any write moves the user's data version, and so the ETag
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.create(user=self.user, account=self.account, amount=Decimal('4.50'),
+                                   description='Coffee', date=date.today())
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_transactions(self):
+        etag = self.assertRevalidates(reverse('transactions'))
+        # Other filters are another validator
+        response = self.client.get(reverse('transactions'), {'type': 'expense'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_dashboard(self):
+        self.assertRevalidates(reverse('dashboard'))
+        self.assertRevalidates(reverse('dashboard_live_data'), year=2024, month=3)
+
+    def test_other_users_writes(self):
+        self.client.get(reverse('transactions'))
+        etag = self.client.get(reverse('transactions'))['ETag']
+        other = User.objects.create(username='neighbour')
+        with self.captureOnCommitCallbacks(execute=True):
+            BankAccount.objects.create(user=other, name='Savings')
+        response = self.client.get(reverse('transactions'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class AsyncConditionalResponseTests(TransactionTestCase):
+    """The async wrapper; its view queries on other connections, so no TestCase."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='revalidated')
+        self.account = BankAccount.objects.create(user=self.user, name='Checking')
+        self.client.force_login(self.user)
+
+    def test_live_data(self):
+        url = reverse('dashboard_live_data_async')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Expense.objects.create(user=self.user, account=self.account, amount=Decimal('4.50'),
+                               description='Coffee', date=date.today())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class PartnerGraphTests(TestCase):
+
+    def setUp(self):
+        # Ids are reused between tests; so would be cached graphs
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.client.force_login(self.alice)
+
+    def test_graph_follows_connection_changes(self):
+        self.assertEqual(get_partner_graph(self.bob.id), {'partners': [], 'incoming': 0, 'outgoing': 0})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/accounts/shared/send/', {'username': 'bob'})
+        self.assertEqual(get_partner_graph(self.bob.id)['incoming'], 1)
+        self.assertEqual(get_partner_graph(self.alice.id)['outgoing'], 1)
+
+        self.client.force_login(self.bob)
+        connection_id = Connection.objects.get().id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(f'/accounts/shared/respond/{connection_id}/accept/')
+        self.assertEqual(get_partner_graph(self.bob.id), {'partners': [self.alice.id], 'incoming': 0, 'outgoing': 0})
+
+        # Once warm, the check costs nothing
+        has_partner(self.alice)
+        with self.assertNumQueries(0):
+            self.assertTrue(has_partner(self.alice))
+        response = self.client.get('/transactions/partner/', {'partner_id': self.alice.id})
+        self.assertEqual(response.context['partner'], self.alice)
+        self.assertContains(self.client.get('/accounts/shared/'), '@alice')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/accounts/shared/disconnect/{self.alice.id}/')
+        self.assertFalse(has_partner(self.alice))
+        self.assertRedirects(self.client.get('/transactions/partner/'), '/accounts/shared/')
+
+    def test_connection_deleted_outside_the_views(self):
+        connection = Connection.objects.create(sender=self.alice, receiver=self.bob, status='accepted')
+        self.assertEqual(self.client.get('/transactions/partner/', {'partner_id': self.bob.id}).status_code, 200)
+
+        # Admin or shell: the signal drops the cached graphs
+        with self.captureOnCommitCallbacks(execute=True):
+            connection.delete()
+        response = self.client.get('/transactions/partner/', {'partner_id': self.bob.id})
+        self.assertRedirects(response, '/accounts/shared/')
+        self.assertEqual(get_partner_graph(self.bob.id)['partners'], [])
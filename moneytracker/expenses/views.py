@@ -1,9 +1,11 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db import transaction
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from .forms import ExpenseForm, IncomeForm, BankAccountForm, CategoryForm, TransferForm
 from .models import Expense, Income, BankAccount, Category, Transfer, Budget
+from .ledger import balance_ledger, expense_effect, income_effect, transfer_effect
+from .bulk import DUPLICATE_MODES, ingest_transactions
+from .categorizer import get_categorizer
 from django.http import JsonResponse
 import json
 
@@ -15,12 +17,10 @@ def add_expense(request):
             expense = form.save(commit=False)
             expense.user = request.user
             
-            # Update account balance
-            if expense.account:
-                expense.account.balance -= expense.amount
-                expense.account.save()
-                
-            expense.save()
+            # Save and update account balance atomically
+            with balance_ledger() as ledger:
+                expense.save()
+                expense_effect(ledger, expense)
             
             next_url = request.POST.get('next')
             if next_url == 'transactions':
@@ -49,12 +49,10 @@ def add_income(request):
             income = form.save(commit=False)
             income.user = request.user
             
-            # Update account balance
-            if income.account:
-                income.account.balance += income.amount
-                income.account.save()
-                
-            income.save()
+            # Save and update account balance atomically
+            with balance_ledger() as ledger:
+                income.save()
+                income_effect(ledger, income)
             
             next_url = request.POST.get('next')
             if next_url == 'transactions':
@@ -129,25 +127,20 @@ def add_category(request):
 @login_required
 def edit_expense(request, pk):
     expense = get_object_or_404(Expense, pk=pk, user=request.user)
-    old_account = expense.account
+    old_account_id = expense.account_id
     old_amount = expense.amount
+    old_date = expense.date
 
     if request.method == 'POST':
         form = ExpenseForm(request.user, request.POST, instance=expense)
         if form.is_valid():
             new_expense = form.save(commit=False)
             
-            # Revert old balance
-            if old_account:
-                old_account.balance += old_amount
-                old_account.save()
-            
-            # Apply new balance
-            if new_expense.account:
-                new_expense.account.balance -= new_expense.amount
-                new_expense.account.save()
-                
-            new_expense.save()
+            with balance_ledger() as ledger:
+                # Revert old balance, apply new (merged if same account)
+                ledger.credit(old_account_id, old_amount, old_date)
+                expense_effect(ledger, new_expense)
+                new_expense.save()
             return redirect('transactions')
     else:
         form = ExpenseForm(request.user, instance=expense)
@@ -164,10 +157,9 @@ def delete_expense(request, pk):
     expense = get_object_or_404(Expense, pk=pk, user=request.user)
     if request.method == 'POST':
         # Revert balance
-        if expense.account:
-            expense.account.balance += expense.amount
-            expense.account.save()
-        expense.delete()
+        with balance_ledger() as ledger:
+            expense_effect(ledger, expense, reverse=True)
+            expense.delete()
         return redirect('transactions')
     
     return render(request, 'expenses/confirm_delete.html', {'object': expense, 'type': 'Expense'})
@@ -175,25 +167,20 @@ def delete_expense(request, pk):
 @login_required
 def edit_income(request, pk):
     income = get_object_or_404(Income, pk=pk, user=request.user)
-    old_account = income.account
+    old_account_id = income.account_id
     old_amount = income.amount
+    old_date = income.date
 
     if request.method == 'POST':
         form = IncomeForm(request.user, request.POST, instance=income)
         if form.is_valid():
             new_income = form.save(commit=False)
             
-            # Revert old balance
-            if old_account:
-                old_account.balance -= old_amount
-                old_account.save()
-            
-            # Apply new balance
-            if new_income.account:
-                new_income.account.balance += new_income.amount
-                new_income.account.save()
-                
-            new_income.save()
+            with balance_ledger() as ledger:
+                # Revert old balance, apply new (merged if same account)
+                ledger.debit(old_account_id, old_amount, old_date)
+                income_effect(ledger, new_income)
+                new_income.save()
             return redirect('transactions')
     else:
         form = IncomeForm(request.user, instance=income)
@@ -210,10 +197,9 @@ def delete_income(request, pk):
     income = get_object_or_404(Income, pk=pk, user=request.user)
     if request.method == 'POST':
         # Revert balance
-        if income.account:
-            income.account.balance -= income.amount
-            income.account.save()
-        income.delete()
+        with balance_ledger() as ledger:
+            income_effect(ledger, income, reverse=True)
+            income.delete()
         return redirect('transactions')
     
     return render(request, 'expenses/confirm_delete.html', {'object': income, 'type': 'Income'})
@@ -272,14 +258,10 @@ def add_transfer(request):
             transfer = form.save(commit=False)
             transfer.user = request.user
             
-            # Update balances
-            if transfer.from_account and transfer.to_account:
-                transfer.from_account.balance -= transfer.amount
-                transfer.to_account.balance += transfer.amount
-                transfer.from_account.save()
-                transfer.to_account.save()
-            
-            transfer.save()
+            # Save and update both balances atomically
+            with balance_ledger() as ledger:
+                transfer.save()
+                transfer_effect(ledger, transfer)
             return redirect('transactions')
     else:
         form = TransferForm(request.user)
@@ -294,32 +276,24 @@ def add_transfer(request):
 @login_required
 def edit_transfer(request, pk):
     transfer = get_object_or_404(Transfer, pk=pk, user=request.user)
-    old_from = transfer.from_account
-    old_to = transfer.to_account
+    old_from_id = transfer.from_account_id
+    old_to_id = transfer.to_account_id
     old_amount = transfer.amount
+    old_date = transfer.date
 
     if request.method == 'POST':
         form = TransferForm(request.user, request.POST, instance=transfer)
         if form.is_valid():
             new_transfer = form.save(commit=False)
             
-            # Revert old balances
-            if old_from:
-                old_from.balance += old_amount
-                old_from.save()
-            if old_to:
-                old_to.balance -= old_amount
-                old_to.save()
-            
-            # Apply new balances
-            if new_transfer.from_account:
-                new_transfer.from_account.balance -= new_transfer.amount
-                new_transfer.from_account.save()
-            if new_transfer.to_account:
-                new_transfer.to_account.balance += new_transfer.amount
-                new_transfer.to_account.save()
+            with balance_ledger() as ledger:
+                # Revert old balances
+                ledger.credit(old_from_id, old_amount, old_date)
+                ledger.debit(old_to_id, old_amount, old_date)
                 
-            new_transfer.save()
+                # Apply new balances
+                transfer_effect(ledger, new_transfer)
+                new_transfer.save()
             return redirect('transactions')
     else:
         form = TransferForm(request.user, instance=transfer)
@@ -336,14 +310,9 @@ def delete_transfer(request, pk):
     transfer = get_object_or_404(Transfer, pk=pk, user=request.user)
     if request.method == 'POST':
         # Revert balances
-        if transfer.from_account:
-            transfer.from_account.balance += transfer.amount
-            transfer.from_account.save()
-        if transfer.to_account:
-            transfer.to_account.balance -= transfer.amount
-            transfer.to_account.save()
-            
-        transfer.delete()
+        with balance_ledger() as ledger:
+            transfer_effect(ledger, transfer, reverse=True)
+            transfer.delete()
         return redirect('transactions')
     
     return render(request, 'expenses/confirm_delete.html', {'object': transfer, 'type': 'Transfer'})
@@ -371,6 +340,44 @@ def api_create_category(request):
     return JsonResponse({'success': False, 'error': 'Invalid method'})
 
 
+@login_required
+def api_suggest_category(request):
+    """
+    Suggested category for new rows. GET ?type=expense&description=...
+    for one row; POST {"items": [{"type", "description"}, ...]} for a
+    batch (answered in the same order, null where there is no suggestion).
+    """
+    if request.method == 'POST':
+        try:
+            items = json.loads(request.body).get('items', [])
+        except (ValueError, AttributeError):
+            return JsonResponse({'success': False, 'error': 'Invalid JSON'})
+    else:
+        items = [{'type': request.GET.get('type', 'expense'), 'description': request.GET.get('description', '')}]
+
+    if not isinstance(items, list) or len(items) > 1000:
+        return JsonResponse({'success': False, 'error': 'Send at most 1000 items'})
+
+    categorizer = get_categorizer(request.user.id)
+    names = dict(Category.objects.filter(user=request.user).values_list('id', 'name'))
+    suggestions = []
+    for item in items:
+        kind = item.get('type') if isinstance(item, dict) else None
+        if kind not in ('expense', 'income'):
+            suggestions.append(None)
+            continue
+        category_id, confidence = categorizer.predict(kind, str(item.get('description') or ''))
+        if category_id in names:
+            suggestions.append({'category_id': category_id, 'name': names[category_id],
+                                'confidence': round(confidence, 3)})
+        else:
+            suggestions.append(None)
+
+    if request.method == 'POST':
+        return JsonResponse({'success': True, 'suggestions': suggestions})
+    return JsonResponse({'success': True, 'suggestion': suggestions[0]})
+
+
 @login_required
 def manage_categories(request):
     expenses_categories = Category.objects.filter(user=request.user, type='expense')
@@ -437,66 +444,26 @@ def add_bulk_transactions(request):
             if not transactions_list:
                 return JsonResponse({'success': False, 'error': 'No transactions provided'})
 
-            saved_count = 0
-            errors = []
-
-            # Atomic block: All or nothing
-            with transaction.atomic():
-                # First pass: Validate all
-                # To really do "atomic", we can just iterate and save. 
-                # If any error, we raise an Exception or set_rollback inside the block.
-                
-                for index, item in enumerate(transactions_list):
-                    t_type = item.get('type')
-                    row_num = index + 1
-                    
-                    # Normalize data for Forms
-                    form_data = {
-                        'amount': item.get('amount'),
-                        'date': item.get('date'),
-                        'category': item.get('category_id'),
-                        'account': item.get('account_id'),
-                    }
-                    
-                    form = None
-                    if t_type == 'expense':
-                        form_data['description'] = item.get('description')
-                        form = ExpenseForm(request.user, form_data)
-                    elif t_type == 'income':
-                        form_data['source'] = item.get('description') # Front-end sends 'description' for both
-                        form = IncomeForm(request.user, form_data)
-                    else:
-                        errors.append(f"Row {row_num}: Invalid type '{t_type}'")
-                        continue
-
-                    if form.is_valid():
-                        obj = form.save(commit=False)
-                        obj.user = request.user
-                        
-                        # Handle Balance Update
-                        if obj.account:
-                            if t_type == 'expense':
-                                obj.account.balance -= obj.amount
-                            elif t_type == 'income':
-                                obj.account.balance += obj.amount
-                            obj.account.save()
-                        
-                        obj.save()
-                        saved_count += 1
-                    else:
-                        # Format errors
-                        field_errors = []
-                        for field, err_list in form.errors.items():
-                            field_errors.append(f"{field}: {err_list[0]}")
-                        errors.append(f"Row {row_num}: " + ", ".join(field_errors))
-                
-                if errors:
-                    # Rollback everything if there are errors
-                    transaction.set_rollback(True)
-                    return JsonResponse({'success': False, 'error': 'Validation Failed', 'details': errors})
+            # 'flag' (default) rejects the batch if any row is already
+            # stored, 'skip' leaves those rows out, 'allow' saves them anyway
+            duplicates = data.get('duplicates', 'flag')
+            if duplicates not in DUPLICATE_MODES:
+                return JsonResponse({'success': False, 'error': f"Invalid duplicates mode '{duplicates}'"})
+
+            # All or nothing: rows are validated against in-memory lookups
+            # and only inserted if every row is valid
+            saved_count, errors, duplicate_rows = ingest_transactions(request.user, transactions_list, duplicates)
+            if errors and duplicate_rows:
+                return JsonResponse({'success': False, 'error': 'Possible duplicates', 'details': errors,
+                                     'duplicates': duplicate_rows})
+            if errors:
+                return JsonResponse({'success': False, 'error': 'Validation Failed', 'details': errors})
             
-            messages.success(request, f"Successfully added {saved_count} transactions.")
-            return JsonResponse({'success': True, 'count': saved_count})
+            message = f"Successfully added {saved_count} transactions."
+            if duplicate_rows and duplicates == 'skip':
+                message += f" Skipped {len(duplicate_rows)} duplicates."
+            messages.success(request, message)
+            return JsonResponse({'success': True, 'count': saved_count, 'duplicates': duplicate_rows})
 
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)})
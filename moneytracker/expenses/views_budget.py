@@ -3,23 +3,33 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .models import Budget, Category
 from .forms_budget import BudgetGlobalForm
-from .services import get_budget_dashboard_data, check_budget_state
+from .services import get_budget_months, get_budget_summaries, check_budget_state
+from django.core.paginator import Paginator
 from datetime import date, datetime
 
+# Months per page when budget_list is paged (?page=N)
+BUDGET_MONTHS_PER_PAGE = 12
+
 @login_required
 def budget_list(request):
     """
     Lists all monthly budgets with summary statistics.
+    Pass ?page=N to only evaluate one page of months.
     """
-    budgets_qs = Budget.objects.filter(user=request.user).order_by('-month')
-    months = sorted(list(set(b.month for b in budgets_qs)), reverse=True)
+    page_obj = None
+    page_number = request.GET.get('page')
     
-    budget_summaries = []
-    for m in months:
-        data = get_budget_dashboard_data(request.user, m)
-        budget_summaries.append(data)
+    if page_number is not None:
+        paginator = Paginator(get_budget_months(request.user), BUDGET_MONTHS_PER_PAGE)
+        page_obj = paginator.get_page(page_number)
+        budget_summaries = get_budget_summaries(request.user, months=page_obj.object_list)
+    else:
+        budget_summaries = get_budget_summaries(request.user)
         
-    return render(request, 'expenses/budget_list.html', {'budgets': budget_summaries})
+    return render(request, 'expenses/budget_list.html', {
+        'budgets': budget_summaries,
+        'page_obj': page_obj
+    })
 
 @login_required
 def budget_manage(request, month_str=None):
@@ -0,0 +1,88 @@
+import os
+import re
+import tempfile
+
+from django.contrib import messages
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.shortcuts import render
+from .forms import StatementImportForm
+from .statement_parsers import StatementError
+from .statements import StatementSource, import_statements
+
+# Errors and duplicates returned to the page; the counts cover all of them
+MAX_REPORTED_ERRORS = 200
+PROGRESS_TIMEOUT = 600
+_TOKEN_RE = re.compile(r'^[\w-]{1,64}$')
+
+
+def _cache():
+    # The progress poll may reach another worker than the upload
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def _progress_key(user_id, token):
+    return f'statement-import:{user_id}:{token}'
+
+
+@login_required
+def import_statement(request):
+    """
+    GET: upload form. POST: imports the uploaded statements and answers
+    with a JSON summary. The page polls import_statement_progress with the
+    token it sent while the upload is being processed.
+    """
+    form = StatementImportForm(request.user, request.POST or None, request.FILES or None)
+    if request.method != 'POST':
+        return render(request, 'expenses/import_statement.html', {'form': form})
+
+    if not form.is_valid():
+        errors = [f"{field}: {', '.join(errs)}" for field, errs in form.errors.items()]
+        return JsonResponse({'success': False, 'error': 'Invalid upload', 'details': errors})
+
+    token = request.POST.get('token', '')
+    progress_key = _progress_key(request.user.id, token) if _TOKEN_RE.match(token) else None
+
+    def report(state):
+        if progress_key:
+            _cache().set(progress_key, state.as_dict(), PROGRESS_TIMEOUT)
+
+    try:
+        with tempfile.TemporaryDirectory(prefix='statement-import-') as directory:
+            sources = []
+            for index, upload in enumerate(form.cleaned_data['statements']):
+                # Keep the extension: it selects the parser
+                path = os.path.join(directory, f'{index}{os.path.splitext(upload.name)[1].lower()}')
+                with open(path, 'wb') as handle:
+                    for chunk in upload.chunks():
+                        handle.write(chunk)
+                sources.append(StatementSource(
+                    path, form.cleaned_data['profile'], form.cleaned_data['account'], name=upload.name
+                ))
+            result = import_statements(request.user, sources, progress=report,
+                                       skip_duplicates=not form.cleaned_data['allow_duplicates'])
+    except StatementError as e:
+        # Raised before anything is imported: an unsupported file type, an
+        # unknown profile or a file that cannot be opened. Unreadable parts
+        # and rows of an import are reported in its errors instead.
+        return JsonResponse({'success': False, 'error': str(e)})
+
+    if result.imported:
+        messages.success(request, f"Imported {result.imported} transactions from {len(sources)} statement(s).")
+    return JsonResponse({
+        'success': True,
+        **result.as_dict(),
+        'errors': result.errors[:MAX_REPORTED_ERRORS],
+        'duplicates': result.duplicates[:MAX_REPORTED_ERRORS],
+    })
+
+
+@login_required
+def import_statement_progress(request, token):
+    """Counters of the running import started with token (JSON)."""
+    state = _cache().get(_progress_key(request.user.id, token)) if _TOKEN_RE.match(token) else None
+    if state is None:
+        return JsonResponse({'success': False, 'error': 'No import in progress'})
+    return JsonResponse({'success': True, **state})
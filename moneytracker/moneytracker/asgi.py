@@ -3,6 +3,10 @@ ASGI config for moneytracker project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The dashboard's server-sent events stream (dashboard/events/) is an async
+view and needs this entry point, e.g. ``uvicorn moneytracker.asgi:application``.
+Change events are delivered in-process, so run a single worker process.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
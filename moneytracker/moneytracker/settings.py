@@ -25,17 +25,21 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.humanize',
+    'mathfilters',
     'accounts',
     'expenses',
     'dashboard',
 ]
 
 MIDDLEWARE = [
+    'expenses.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'expenses.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -70,6 +74,58 @@ DATABASES = {
 }
 
 
+# Cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Dashboard payloads are cached per (user, year, month) against a per-user
+# data version that every write moves; statement import progress is kept
+# there too. Point the alias at a shared backend (Redis, Memcached) when
+# running several workers.
+DASHBOARD_CACHE_ALIAS = 'default'
+DASHBOARD_CACHE_TIMEOUT = 300
+# Cached partner graphs (accounts.partners) are invalidated whenever a
+# Connection is saved or deleted; the timeout only bounds queryset updates
+PARTNER_GRAPH_CACHE_TIMEOUT = 3600
+# Threads the async dashboard views use to run their queries concurrently
+DASHBOARD_QUERY_WORKERS = 4
+
+# Statement import: parser processes (None = one per CPU) and rows per
+# bulk-insert batch. Extra bank profiles go in EXPENSES_STATEMENT_PROFILES.
+STATEMENT_IMPORT_WORKERS = None
+STATEMENT_IMPORT_BATCH_SIZE = 500
+
+# Category suggestions: per-user models cached in-process (LRU of this many
+# users), refreshed from the database when older than CATEGORIZER_MAX_AGE
+# seconds and the user's data changed; suggestions below the confidence
+# are not made.
+CATEGORIZER_CACHE_SIZE = 256
+CATEGORIZER_MAX_AGE = 600
+CATEGORIZER_MIN_CONFIDENCE = 0.6
+
+# Budget projections: months of history behind the usual daily pattern
+BUDGET_PROJECTION_MONTHS = 6
+
+# Balance snapshots (net worth history): one row per account per 'day' or
+# 'month' with activity. Run rebuild_balance_snapshots after changing it.
+BALANCE_SNAPSHOT_GRANULARITY = 'day'
+
+# Request metrics (served to staff at /metrics): latency histogram bounds,
+# in seconds
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Request profiling: when enabled, staff profile a request with ?profile=1
+# or an "X-Profile: 1" header, and SAMPLE_RATE of all requests are profiled.
+# The newest KEEP profiles are listed at /dashboard/profiles/.
+REQUEST_PROFILING_ENABLED = False
+REQUEST_PROFILING_SAMPLE_RATE = 0.0
+REQUEST_PROFILING_DIR = BASE_DIR / 'profiles'
+REQUEST_PROFILING_KEEP = 50
+
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
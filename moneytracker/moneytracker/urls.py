@@ -3,15 +3,20 @@ URL configuration for moneytracker project.
 """
 from django.contrib import admin
 from django.urls import path, include
-from dashboard.views import dashboard_view, dashboard_live_data
+from dashboard.views import (
+    dashboard_view, dashboard_live_data, dashboard_view_async, dashboard_live_data_async,
+    dashboard_events, dashboard_cache_stats, dashboard_analytics, dashboard_net_worth,
+    metrics_view, profile_list, profile_download
+)
 from expenses.views import (
     add_expense, add_income, add_account, add_category,
     edit_expense, delete_expense, edit_income, delete_income,
     manage_accounts, edit_account, delete_account, api_create_category,
     add_transfer, edit_transfer, delete_transfer, manage_categories, edit_category, delete_category,
-    add_bulk_transactions
+    add_bulk_transactions, api_suggest_category
 )
 from expenses.views_budget import budget_list, budget_manage, budget_delete
+from expenses.views_import import import_statement, import_statement_progress
 
 from expenses.views_transactions import transactions_view, partner_transactions_view
 from accounts.views_shared import shared_view, send_request, respond_request, disconnect_user
@@ -30,6 +35,14 @@ urlpatterns = [
     # Dashboard URLs
     path('dashboard/', dashboard_view, name='dashboard'),
     path('dashboard/live-data/', dashboard_live_data, name='dashboard_live_data'),  # NEW: Real-time data endpoint
+    path('dashboard/async/', dashboard_view_async, name='dashboard_async'),  # ASGI variants
+    path('dashboard/live-data/async/', dashboard_live_data_async, name='dashboard_live_data_async'),
+    path('dashboard/events/', dashboard_events, name='dashboard_events'),  # Server-sent events (ASGI)
+    path('dashboard/analytics/', dashboard_analytics, name='dashboard_analytics'),
+    path('dashboard/net-worth/', dashboard_net_worth, name='dashboard_net_worth'),
+    path('dashboard/cache-stats/', dashboard_cache_stats, name='dashboard_cache_stats'),
+    path('dashboard/profiles/', profile_list, name='profile_list'),
+    path('dashboard/profiles/<str:profile_id>/<str:kind>/', profile_download, name='profile_download'),
     
     # Transactions
     path('transactions/', transactions_view, name='transactions'),
@@ -38,6 +51,8 @@ urlpatterns = [
     # Expenses
     path('expenses/add/', add_expense, name='add_expense'),
     path('expenses/add-bulk/', add_bulk_transactions, name='add_bulk_transactions'),
+    path('expenses/import/', import_statement, name='import_statement'),
+    path('expenses/import/progress/<str:token>/', import_statement_progress, name='import_statement_progress'),
     path('expenses/edit/<int:pk>/', edit_expense, name='edit_expense'),
     path('expenses/delete/<int:pk>/', delete_expense, name='delete_expense'),
     path('expenses/category/add/', add_category, name='add_category'),
@@ -63,6 +78,7 @@ urlpatterns = [
     
     # API
     path('api/category/create/', api_create_category, name='api_create_category'),
+    path('api/category/suggest/', api_suggest_category, name='api_suggest_category'),
     
     # Budget URLs
     path('budgets/', budget_list, name='budget_list'),
@@ -72,4 +88,7 @@ urlpatterns = [
 
     # Home
     path('', dashboard_view, name='home'),
+
+    # Prometheus scrape target (staff only)
+    path('metrics', metrics_view, name='metrics'),
 ]
\ No newline at end of file